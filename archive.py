@@ -0,0 +1,204 @@
+"""
+Archive of old conversations, kept out of the conversation table.
+
+Conversations are appended to one segment per month, zstd compressed JSON lines (gzip without zstandard), and never
+rewritten: every append adds a new compressed frame at the end of its segment. A small index keeps the rows, the
+time span and the thread, assistant and user IDs of each segment, so loading or searching the archive only
+decompresses the segments that can match.
+
+    archive = ConversationArchive('archive')
+    wrapper.enable_archive(archive, older_than=datetime.timedelta(days=90))
+    archive.load(thread_id='thread_...')
+    archive.search('revenue', assistant_id='asst_...')
+"""
+import datetime, gzip, io, json, os, threading
+
+from compression import zstandard
+from records import ArchivedConversationRecord
+
+INDEX_FILENAME = 'index.json'
+
+
+def open_compressed(path, mode='r'):
+    """
+    Opens a text file, zstd compressed if its name ends with .zst, gzip compressed with .gz and plain otherwise.
+    Appending to a compressed file adds a frame (a gzip member), which reading goes on across.
+
+    :param path: Path of the file.
+    :param mode: 'r', 'w' or 'a', always text in UTF-8.
+    :return: File object.
+    """
+    mode = mode.replace('t', '')
+    if mode not in ('r', 'w', 'a'):
+        raise ValueError(f'Unsupported mode: {mode}')
+    if path.endswith('.zst'):
+        if zstandard is None:
+            raise ImportError(f'zstandard is required to open {path} (pip install zstandard)')
+        raw = open(path, mode + 'b')
+        if mode == 'r':
+            stream = zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True, closefd=True)
+        else:
+            stream = zstandard.ZstdCompressor().stream_writer(raw, closefd=True)
+        return io.TextIOWrapper(stream, encoding='utf-8')
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def to_jsonl(record):
+    # Line of an archive segment or of an export of GenericDBHandler
+    row = dict(record)
+    row['timestamp'] = record['timestamp'].isoformat() if record['timestamp'] else None
+    return json.dumps(row, separators=(',', ':'), ensure_ascii=False) + '\n'
+
+
+def from_jsonl(line):
+    row = json.loads(line)
+    if row['timestamp']:
+        row['timestamp'] = datetime.datetime.fromisoformat(row['timestamp'])
+    return ArchivedConversationRecord(**row)
+
+
+class ConversationArchive:
+    """
+    Append-only archive of conversations in monthly compressed segments, with an index of the segments.
+    """
+
+    def __init__(self, directory):
+        self.__directory = directory
+        self.__suffix = '.jsonl.zst' if zstandard is not None else '.jsonl.gz'
+        self.__lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.__index = self.__read_index()
+
+    def get_directory(self):
+        return self.__directory
+
+    def __read_index(self):
+        path = os.path.join(self.__directory, INDEX_FILENAME)
+        if not os.path.exists(path):
+            return {}
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def __write_index(self):
+        # Replaced at once, a crash leaves the previous index
+        path = os.path.join(self.__directory, INDEX_FILENAME)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self.__index, f)
+        os.replace(path + '.tmp', path)
+
+    def append(self, records):
+        """
+        Appends conversations to the segments of their months.
+
+        :param records: List of ArchivedConversationRecord.
+        """
+        months = {}
+        for record in records:
+            month = record['timestamp'].strftime('%Y-%m') if record['timestamp'] else 'undated'
+            months.setdefault(month, []).append(record)
+        with self.__lock:
+            for month, month_records in sorted(months.items()):
+                # A month keeps the codec of its existing segment
+                filename = next((name for name in self.__index if name.startswith(month + '.')), month + self.__suffix)
+                path = os.path.join(self.__directory, filename)
+                with open_compressed(path, 'a') as f:
+                    f.writelines(to_jsonl(record) for record in month_records)
+                self.__update_segment(filename, month_records, os.path.getsize(path))
+            self.__write_index()
+
+    def __update_segment(self, filename, records, size):
+        segment = self.__index.setdefault(filename, {
+            'rows': 0, 'first_id': None, 'last_id': None, 'first_at': None, 'last_at': None,
+            'thread_ids': [], 'assistant_ids': [], 'user_ids': [],
+        })
+        segment['rows'] += len(records)
+        segment['bytes'] = size
+        ids = [record['conversation_id'] for record in records]
+        segment['first_id'] = min(ids + ([segment['first_id']] if segment['first_id'] is not None else []))
+        segment['last_id'] = max(ids + ([segment['last_id']] if segment['last_id'] is not None else []))
+        timestamps = [record['timestamp'].isoformat() for record in records if record['timestamp']]
+        if timestamps:
+            segment['first_at'] = min(timestamps + ([segment['first_at']] if segment['first_at'] else []))
+            segment['last_at'] = max(timestamps + ([segment['last_at']] if segment['last_at'] else []))
+        for key in ('thread_ids', 'assistant_ids', 'user_ids'):
+            values = set(segment[key])
+            values.update(record[key[:-1]] for record in records if record[key[:-1]] is not None)
+            segment[key] = sorted(values)
+
+    def get_segments(self):
+        """
+        Gets the index of the segments.
+
+        :return: Dictionary of the rows, size, IDs and time span of each segment by file name.
+        """
+        with self.__lock:
+            return json.loads(json.dumps(self.__index))
+
+    def __iter_records(self, thread_id=None, assistant_id=None, user_id=None, since=None, until=None, needle=None):
+        with self.__lock:
+            segments = sorted(self.__index.items())
+        for filename, segment in segments:
+            # Segments the index rules out are not decompressed at all
+            if (thread_id is not None and thread_id not in segment['thread_ids']) or \
+                    (assistant_id is not None and assistant_id not in segment['assistant_ids']) or \
+                    (user_id is not None and user_id not in segment['user_ids']) or \
+                    (since is not None and segment['last_at'] and segment['last_at'] < since.isoformat()) or \
+                    (until is not None and segment['first_at'] and segment['first_at'] >= until.isoformat()):
+                continue
+            # A row appended twice, e.g. when archiving was interrupted before its rows were deleted, is read once
+            seen = set()
+            with open_compressed(os.path.join(self.__directory, filename)) as f:
+                for line in f:
+                    # Most lines of a search are skipped without parsing them
+                    if needle is not None and needle not in line.casefold():
+                        continue
+                    record = from_jsonl(line)
+                    if record['conversation_id'] in seen:
+                        continue
+                    seen.add(record['conversation_id'])
+                    if (thread_id is not None and record['thread_id'] != thread_id) or \
+                            (assistant_id is not None and record['assistant_id'] != assistant_id) or \
+                            (user_id is not None and record['user_id'] != user_id) or \
+                            (since is not None and (record['timestamp'] is None or record['timestamp'] < since)) or \
+                            (until is not None and (record['timestamp'] is None or record['timestamp'] >= until)):
+                        continue
+                    yield record
+
+    def load(self, thread_id=None, assistant_id=None, user_id=None, since=None, until=None):
+        """
+        Loads archived conversations in the order they were written.
+
+        :param thread_id: Optional ID of the thread.
+        :param assistant_id: Optional ID of the assistant.
+        :param user_id: Optional ID of the user (server mode).
+        :param since: Optional datetime.datetime (UTC) of the oldest conversation.
+        :param until: Optional datetime.datetime (UTC) the conversations are older than.
+        :return: List of ArchivedConversationRecord.
+        """
+        return list(self.__iter_records(thread_id, assistant_id, user_id, since, until))
+
+    def search(self, text, thread_id=None, assistant_id=None, user_id=None, since=None, until=None, limit=None):
+        """
+        Searches the archived conversations containing a text, case-insensitively.
+
+        :param text: Text to search for.
+        :param thread_id: Optional ID of the thread.
+        :param assistant_id: Optional ID of the assistant.
+        :param user_id: Optional ID of the user (server mode).
+        :param since: Optional datetime.datetime (UTC) of the oldest conversation.
+        :param until: Optional datetime.datetime (UTC) the conversations are older than.
+        :param limit: Optional maximum number of results.
+        :return: List of ArchivedConversationRecord.
+        """
+        text = text.casefold()
+        # Lines are matched before they are parsed as long as the text looks the same in JSON
+        needle = text if json.dumps(text, ensure_ascii=False)[1:-1] == text else None
+        results = []
+        for record in self.__iter_records(thread_id, assistant_id, user_id, since, until, needle):
+            if text in (record['content'] or '').casefold():
+                results.append(record)
+                if limit is not None and len(results) >= limit:
+                    break
+        return results
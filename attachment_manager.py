@@ -0,0 +1,127 @@
+import datetime, hashlib, os, threading
+from concurrent.futures import ThreadPoolExecutor
+
+from records import AttachmentRecord
+
+_HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def hash_file(path):
+    """
+    Hashes the content of a file without reading it into memory at once.
+
+    :param path: Path of the file.
+    :return: SHA-256 hex digest.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(_HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class AttachmentManager:
+    """
+    Uploads local files attached to messages once and reuses their file IDs across messages and threads.
+
+    A file is looked up by path, mtime and size first, then by content hash, so a copy or a touched
+    but unchanged file isn't uploaded again. Attachments beyond the eviction policy are dropped,
+    and their uploaded files deleted.
+    """
+
+    def __init__(self, wrapper, db_handler, max_entries=200, max_bytes=None, max_age=datetime.timedelta(days=30),
+                 delete_remote=True, max_workers=4):
+        """
+        Initializes the AttachmentManager.
+
+        :param wrapper: GPTAssistantV2Wrapper to upload with.
+        :param db_handler: GenericDBHandler storing the attachments.
+        :param max_entries: Maximum number of attachments kept.
+        :param max_bytes: Maximum total size of the attachments kept.
+        :param max_age: Attachments unused for longer are evicted.
+        :param delete_remote: If True, the uploaded files of evicted attachments are deleted too.
+        :param max_workers: Maximum number of concurrent prefetches.
+        """
+        self.__wrapper = wrapper
+        self.__db_handler = db_handler
+        self.__max_entries = max_entries
+        self.__max_bytes = max_bytes
+        self.__max_age = max_age
+        self.__delete_remote = delete_remote
+        self.__executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='attachment')
+        self.__lock = threading.Lock()
+        # Path -> Future of the upload, so a prefetch and a send never upload the same file twice
+        self.__in_flight = {}
+
+    def set_policy(self, max_entries=None, max_bytes=None, max_age=None, delete_remote=None):
+        if max_entries is not None:
+            self.__max_entries = max_entries
+        if max_bytes is not None:
+            self.__max_bytes = max_bytes
+        if max_age is not None:
+            self.__max_age = max_age
+        if delete_remote is not None:
+            self.__delete_remote = delete_remote
+
+    def prefetch(self, path):
+        """
+        Starts uploading a file in the background, e.g. as soon as it is attached and before the message is sent.
+
+        :param path: Path of the file.
+        :return: Future of the file ID.
+        """
+        path = os.path.abspath(path)
+        with self.__lock:
+            future = self.__in_flight.get(path)
+            if future is None:
+                future = self.__executor.submit(self.__get_file_id, path)
+                self.__in_flight[path] = future
+                future.add_done_callback(lambda _: self.__forget(path, future))
+        return future
+
+    def __forget(self, path, future):
+        with self.__lock:
+            if self.__in_flight.get(path) is future:
+                del self.__in_flight[path]
+
+    def get_file_id(self, path):
+        """
+        Gets the file ID of a local file, uploading it only if its content was never uploaded.
+
+        :param path: Path of the file.
+        :return: File ID.
+        """
+        return self.prefetch(path).result()
+
+    def __get_file_id(self, path):
+        stat = os.stat(path)
+        attachment = self.__db_handler.get_attachment(path=path, mtime=stat.st_mtime, size=stat.st_size)
+        if attachment is not None:
+            return attachment['file_id']
+
+        content_hash = hash_file(path)
+        attachment = self.__db_handler.get_attachment(content_hash=content_hash)
+        if attachment is not None:
+            file_id = attachment['file_id']
+        else:
+            file_id = self.__wrapper.upload_files([path])[0]['file_id']
+        # Remember the latest path and mtime of the content for the fast lookup
+        self.__db_handler.put_attachment(AttachmentRecord(path, content_hash, stat.st_mtime, stat.st_size, file_id, None))
+        if attachment is None:
+            self.evict()
+        return file_id
+
+    def evict(self):
+        """
+        Drops the attachments beyond the eviction policy.
+
+        :return: List of the evicted AttachmentRecord.
+        """
+        stale = self.__db_handler.get_stale_attachments(self.__max_entries, self.__max_bytes, self.__max_age)
+        if not stale:
+            return []
+        self.__db_handler.delete_attachments([attachment['content_hash'] for attachment in stale])
+        if self.__delete_remote:
+            # A file already deleted on the server is fine, the results are not checked
+            self.__wrapper.delete_files([attachment['file_id'] for attachment in stale])
+        return stale
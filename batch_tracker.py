@@ -0,0 +1,140 @@
+import threading, time
+
+
+class BatchTracker:
+    """
+    Tracks the indexing of many vector store file batches with one background poller.
+
+    Each batch is polled on its own adaptive interval: it starts short, grows while the file counts don't move
+    and goes back to short as soon as they do. Callbacks get a FileBatchRecord whenever the counts change.
+    """
+
+    def __init__(self, wrapper, min_interval=1, max_interval=30, backoff=1.5):
+        """
+        Initializes the BatchTracker.
+
+        :param wrapper: GPTAssistantV2Wrapper to poll with.
+        :param min_interval: Seconds between two polls of a batch that is moving.
+        :param max_interval: Maximum seconds between two polls of a batch.
+        :param backoff: Growth of the interval while a batch doesn't move.
+        """
+        self.__wrapper = wrapper
+        self.__min_interval = min_interval
+        self.__max_interval = max_interval
+        self.__backoff = backoff
+        self.__condition = threading.Condition()
+        # Batch ID -> [record, interval, next poll time, done event], a batch is dropped once it is done
+        self.__batches = {}
+        self.__callbacks = []
+        self.__thread = None
+        self.__stopped = False
+
+    def add_callback(self, callback):
+        """
+        Adds a callback called with the FileBatchRecord of a batch whenever its status or counts change.
+        It is called on the poller thread.
+
+        :param callback: Callable with one argument.
+        """
+        with self.__condition:
+            self.__callbacks.append(callback)
+
+    def track(self, batch):
+        """
+        Starts tracking a batch. It returns right away.
+
+        :param batch: FileBatchRecord returned by create_file_batch().
+        :return: Event set once the batch is done, or once the tracker is stopped.
+        """
+        return self.__track(batch)[3]
+
+    def __track(self, batch):
+        with self.__condition:
+            if self.__stopped:
+                raise RuntimeError('The batch tracker is stopped')
+            if batch['batch_id'] in self.__batches:
+                return self.__batches[batch['batch_id']]
+            entry = [batch, self.__min_interval, time.monotonic() + self.__min_interval, threading.Event()]
+            self.__batches[batch['batch_id']] = entry
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__poll, daemon=True)
+                self.__thread.start()
+            self.__condition.notify_all()
+        return entry
+
+    def wait(self, batch, timeout=None):
+        """
+        Tracks a batch and blocks until it is done.
+
+        :param batch: FileBatchRecord returned by create_file_batch().
+        :param timeout: Maximum number of seconds to wait.
+        :return: Latest FileBatchRecord of the batch.
+        :raises RuntimeError: If the tracker is stopped before the batch is done.
+        """
+        # The entry is kept here, the tracker drops it once the batch is done
+        entry = self.__track(batch)
+        entry[3].wait(timeout)
+        with self.__condition:
+            if self.__stopped and not entry[0].is_done():
+                raise RuntimeError(f'The batch tracker was stopped before batch {batch["batch_id"]} was done')
+            return entry[0]
+
+    def get_batch(self, batch_id):
+        with self.__condition:
+            entry = self.__batches.get(batch_id)
+            return entry[0] if entry else None
+
+    def get_batches(self):
+        with self.__condition:
+            return [entry[0] for entry in self.__batches.values()]
+
+    def stop(self):
+        # Wakes up every wait() of a batch that isn't done, they raise
+        with self.__condition:
+            self.__stopped = True
+            for entry in self.__batches.values():
+                entry[3].set()
+            self.__batches.clear()
+            self.__condition.notify_all()
+
+    def __poll(self):
+        while True:
+            with self.__condition:
+                while not self.__stopped:
+                    pending = [(entry[2], batch_id) for batch_id, entry in self.__batches.items() if not entry[3].is_set()]
+                    if not pending:
+                        self.__thread = None
+                        return
+                    wait = min(pending)[0] - time.monotonic()
+                    if wait <= 0:
+                        break
+                    self.__condition.wait(wait)
+                if self.__stopped:
+                    self.__thread = None
+                    return
+                now = time.monotonic()
+                due = [(batch_id, self.__batches[batch_id][0]) for next_at, batch_id in pending if next_at <= now]
+                callbacks = list(self.__callbacks)
+
+            for batch_id, old in due:
+                try:
+                    new = self.__wrapper.get_file_batch(old['vector_store_id'], batch_id)
+                except Exception:
+                    # Polled again later, a failing poll doesn't end the tracking
+                    new = old
+                changed = new != old
+                with self.__condition:
+                    entry = self.__batches.get(batch_id)
+                    if entry is None:
+                        # Dropped by stop()
+                        continue
+                    entry[0] = new
+                    entry[1] = self.__min_interval if changed else min(self.__max_interval, entry[1] * self.__backoff)
+                    entry[2] = time.monotonic() + entry[1]
+                if changed:
+                    for callback in callbacks:
+                        callback(new)
+                if new.is_done():
+                    with self.__condition:
+                        self.__batches.pop(batch_id, None)
+                    entry[3].set()
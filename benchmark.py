@@ -0,0 +1,913 @@
+import asyncio, contextlib, json, os, sys, tempfile, time, tracemalloc, types
+
+from compression import COMPRESSION_THRESHOLD, compress_content
+from records import ConversationRecord
+
+
+def _sample_messages(n):
+    # Mostly short messages with a long answer every 10th row, like a real history
+    short = 'What was the total revenue of the company in the last fiscal year?'
+    long = 'The total revenue was reported in the consolidated statements of income. ' * 40
+    for i in range(n):
+        role = 'user' if i % 2 == 0 else 'assistant'
+        yield role, long if i % 10 == 9 else short
+
+
+def bench_message_memory(n=100000):
+    """
+    Measures the per-message memory overhead of dict rows and of slotted ConversationRecord rows.
+
+    :param n: Number of messages.
+    :return: Dictionary of bytes per message by row type.
+    """
+    # Rows as they come out of the database, compressed when they are big enough
+    rows = []
+    for role, content in _sample_messages(n):
+        if len(content.encode('utf-8')) > COMPRESSION_THRESHOLD:
+            blob, compression = compress_content(content)
+            rows.append((role, None, blob, compression))
+        else:
+            rows.append((role, content, None, None))
+
+    def measure(build):
+        tracemalloc.start()
+        start = time.perf_counter()
+        messages = build()
+        seconds = time.perf_counter() - start
+        size, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del messages
+        return {'bytes_per_message': size / n, 'peak_bytes': peak, 'seconds': seconds}
+
+    def build_dicts():
+        return [{'role': role, 'content': content if blob is None else ConversationRecord(role, None, blob, compression).content}
+                for role, content, blob, compression in rows]
+
+    def build_records():
+        return [ConversationRecord(role, content, blob, compression) for role, content, blob, compression in rows]
+
+    return {
+        'messages': n,
+        'dict': measure(build_dicts),
+        'record': measure(build_records),
+    }
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else None
+
+
+class StandInWrapper:
+    """
+    Stand-in for GPTAssistantV2Wrapper that streams canned tokens at a fixed rate without any API call.
+    """
+
+    def __init__(self, tokens=50, tokens_per_sec=100, first_token_delay=0.2):
+        """
+        Initializes the StandInWrapper.
+
+        :param tokens: Number of tokens per answer.
+        :param tokens_per_sec: Streaming rate of the answers.
+        :param first_token_delay: Seconds before the first token, like a run being queued.
+        """
+        self.__tokens = tokens
+        self.__interval = 1 / tokens_per_sec
+        self.__first_token_delay = first_token_delay
+        self.__thread_count = 0
+
+    def create_thread(self, messages=None):
+        self.__thread_count += 1
+        return f'thread_{self.__thread_count}'
+
+    def send_message(self, message_str, instructions='', message_file=None, assistant_id=None, thread_id=None,
+                     cancel_token=None, timeout=None, idle_timeout=None, user_id=None):
+        time.sleep(self.__first_token_delay)
+        for i in range(self.__tokens):
+            if cancel_token is not None and cancel_token.is_cancelled():
+                return
+            yield f'token{i} '
+            time.sleep(self.__interval)
+
+    def get_assistants(self, order='desc'):
+        return []
+
+    def get_conversations(self, thread_id=None, assistant_id=None, user_id=None):
+        return []
+
+
+async def _sse_client(port, user, timeout):
+    start = time.perf_counter()
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    body = json.dumps({'user': user, 'assistant_id': 'asst_bench', 'prompt': 'Hello'}).encode('utf-8')
+    writer.write(b'POST /chat HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n'
+                 b'Content-Length: ' + str(len(body)).encode('ascii') + b'\r\n\r\n' + body)
+    await writer.drain()
+    status = (await asyncio.wait_for(reader.readline(), timeout)).split()[1]
+    ttft = None
+    deltas = 0
+    try:
+        while True:
+            line = await asyncio.wait_for(reader.readline(), timeout)
+            if not line:
+                break
+            if line.startswith(b'event: delta'):
+                deltas += 1
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+            elif line.startswith(b'event: error'):
+                raise RuntimeError('error event')
+    finally:
+        writer.close()
+    return int(status), ttft, deltas, time.perf_counter() - start
+
+
+def bench_server_load(clients=300, tokens=50, tokens_per_sec=100, timeout=60):
+    """
+    Load-tests the SSE server with concurrent chat clients against a StandInWrapper.
+
+    :param clients: Number of concurrent clients.
+    :param tokens: Number of tokens per answer.
+    :param tokens_per_sec: Streaming rate of the answers.
+    :param timeout: Seconds before a silent stream counts as an error.
+    :return: Dictionary of TTFT percentiles, throughput and errors.
+    """
+    from server import AssistantServer
+
+    async def run():
+        server = AssistantServer(StandInWrapper(tokens, tokens_per_sec), max_streams=clients)
+        await server.start('127.0.0.1', 0)
+        start = time.perf_counter()
+        try:
+            results = await asyncio.gather(*(_sse_client(server.get_port(), f'user{i}', timeout) for i in range(clients)),
+                                           return_exceptions=True)
+        finally:
+            server.close()
+        return results, time.perf_counter() - start
+
+    results, seconds = asyncio.run(run())
+    ok = [r for r in results if not isinstance(r, BaseException) and r[0] == 200 and r[2] == tokens]
+    ttfts = [r[1] for r in ok]
+    return {
+        'clients': clients,
+        'errors': len(results) - len(ok),
+        'ttft_p50': _percentile(ttfts, 0.5),
+        'ttft_p95': _percentile(ttfts, 0.95),
+        'stream_p95': _percentile([r[3] for r in ok], 0.95),
+        'tokens_per_sec': sum(r[2] for r in ok) / seconds,
+        'seconds': seconds,
+    }
+
+
+def bench_run_replay(runs=20, path=None, answer_chars=2000, citations=3, sinks=()):
+    """
+    Replays a run through send_message and the EventHandler as fast as possible, without any network.
+
+    :param runs: Number of runs to replay.
+    :param path: Optional recording of RunRecorder, a synthetic run is replayed without it.
+    :param answer_chars: Length of the answer of the synthetic run.
+    :param citations: Number of citations in the synthetic run.
+    :param sinks: Sinks added to the event bus of the wrapper, which is disabled without any.
+    :return: Dictionary of seconds per run and overhead per event.
+    """
+    from run_recorder import ReplayClient, load_runs, synthesize_run
+    from script import GPTAssistantV2Wrapper
+
+    recorded = load_runs(path) if path else [synthesize_run('The revenue grew. ' * (answer_chars // 18), citations=citations)]
+    # A file and not sqlite://, where every connection of the pool would get an empty database of its own
+    wrapper = GPTAssistantV2Wrapper(db_url=f'sqlite:///{os.path.join(tempfile.mkdtemp(), "conv.db")}?profile=wal')
+    wrapper.set_client(ReplayClient(recorded, speed=None))
+    for sink in sinks:
+        wrapper.get_event_bus().add_sink(sink)
+    events = 0
+    seconds = []
+    for i in range(runs + 1):
+        start = time.perf_counter()
+        for _ in wrapper.send_message('replayed', assistant_id='asst_replay', thread_id='thread_replay'):
+            pass
+        if i:
+            # The first run only warms up the event models
+            seconds.append(time.perf_counter() - start)
+            events += len(recorded[i % len(recorded)])
+    wrapper.get_event_bus().close()
+    return {
+        'runs': runs,
+        'events': events,
+        'run_p50': _percentile(seconds, 0.5),
+        'run_p95': _percentile(seconds, 0.95),
+        'us_per_event': sum(seconds) / events * 1e6,
+    }
+
+
+def bench_legacy_upgrade(rows=100000):
+    """
+    Opens a conversation database with the schema of the first release, as left by older versions of the app,
+    and times the migrations to the current schema. Raises if the upgrade fails or loses rows.
+
+    :param rows: Number of legacy conversations.
+    :return: Dictionary of the upgrade time and the schema version reached.
+    """
+    import sqlite3
+
+    from db_handler import GenericDBHandler, MIGRATIONS
+
+    path = os.path.join(tempfile.mkdtemp(), 'conv.db')
+    connection = sqlite3.connect(path)
+    connection.executescript("""
+        CREATE TABLE conversation (id INTEGER PRIMARY KEY, role VARCHAR(500), content VARCHAR(5000), timestamp DATETIME);
+        CREATE TABLE assistant (id INTEGER PRIMARY KEY, assistant_id VARCHAR(500), name VARCHAR(500),
+                                instructions VARCHAR(5000), tools VARCHAR(500), model VARCHAR(500), timestamp DATETIME);
+        CREATE TABLE thread (id INTEGER PRIMARY KEY, thread_id VARCHAR(500), name VARCHAR(500),
+                             assistant_id INTEGER REFERENCES assistant (id));
+    """)
+    connection.executemany('INSERT INTO conversation (role, content) VALUES (?, ?)', _sample_messages(rows))
+    connection.commit()
+    connection.close()
+
+    start = time.perf_counter()
+    handler = GenericDBHandler(f'sqlite:///{path}')
+    seconds = time.perf_counter() - start
+    version = handler.get_schema_version()
+    if version != max(MIGRATIONS):
+        raise RuntimeError(f'Upgraded to version {version} instead of {max(MIGRATIONS)}')
+    migrated = len(handler.get_conversations())
+    if migrated != rows:
+        raise RuntimeError(f'{migrated} of {rows} legacy conversations left after the upgrade')
+    return {'rows': rows, 'seconds': seconds, 'schema_version': version}
+
+
+def bench_event_bus(runs=20, answer_chars=2000):
+    """
+    Compares the overhead per event of replayed runs with the event bus disabled and with batched sinks.
+
+    :param runs: Number of runs to replay per setup.
+    :param answer_chars: Length of the answer of the synthetic run.
+    :return: Dictionary of the microseconds per event by setup.
+    """
+    from event_bus import JsonlSink, MetricsSink
+
+    with tempfile.TemporaryDirectory() as directory:
+        setups = {
+            'none': lambda: (),
+            'metrics': lambda: (MetricsSink(),),
+            'jsonl': lambda: (JsonlSink(os.path.join(directory, 'events.jsonl')),),
+        }
+        return {name: bench_run_replay(runs=runs, answer_chars=answer_chars, sinks=sinks())['us_per_event']
+                for name, sinks in setups.items()}
+
+
+def bench_fan_out(assistants=(2, 4, 8), answer_chars=400, interval=0.02):
+    """
+    Sends one prompt to several assistants in a row through send_message and at once through
+    send_message_to_assistants, against replayed runs at their recorded pace.
+
+    :param assistants: Numbers of assistants to compare.
+    :param answer_chars: Length of the answer of each run.
+    :param interval: Seconds between two text deltas of a run.
+    :return: Dictionary of the seconds of both ways and the time to the first token of each run, per number of assistants.
+    """
+    from run_recorder import ReplayClient, synthesize_run
+    from script import GPTAssistantV2Wrapper
+
+    recorded = [synthesize_run('The revenue grew. ' * (answer_chars // 18), interval=interval)]
+    results = {}
+    for n in assistants:
+        # The runs are saved from their own threads, an in-memory database would be one per connection
+        wrapper = GPTAssistantV2Wrapper(db_url=f'sqlite:///{os.path.join(tempfile.mkdtemp(), "conv.db")}?profile=wal')
+        wrapper.set_client(ReplayClient(recorded))
+        assistant_ids = [f'asst_replay_{i}' for i in range(n)]
+
+        start = time.perf_counter()
+        for assistant_id in assistant_ids:
+            for _ in wrapper.send_message('Compare', assistant_id=assistant_id, thread_id=wrapper.create_thread()):
+                pass
+        sequential_seconds = time.perf_counter() - start
+
+        fan_out = []
+        start = time.perf_counter()
+        for _ in wrapper.send_message_to_assistants('Compare', assistant_ids, on_result=fan_out.append):
+            pass
+        results[n] = {
+            'sequential_seconds': sequential_seconds,
+            'fan_out_seconds': time.perf_counter() - start,
+            'ttft_seconds': [result['ttft_seconds'] for result in fan_out],
+            'errors': [result['error'] for result in fan_out if result['error']],
+        }
+    return results
+
+
+def bench_sqlite_profile(commits=2000, reads=200, history=500):
+    """
+    Compares the default SQLite setup with the 'wal' profile of db_handler on files in a temporary directory.
+
+    :param commits: Number of single-row commits, one per message like while chatting.
+    :param reads: Number of history loads done while a writer keeps committing.
+    :param history: Number of messages in the loaded history.
+    :return: Dictionary of the commits per second and the read latency percentiles in milliseconds by profile.
+    """
+    import threading
+    from db_handler import Conversation, GenericDBHandler
+
+    result = {}
+    for profile in ('default', 'wal'):
+        with tempfile.TemporaryDirectory() as directory:
+            handler = GenericDBHandler(f'sqlite:///{os.path.join(directory, "conv.db")}?profile={profile}')
+            thread_pk = handler.get_thread_pk('thread_bench', 'asst_bench')
+            assistant_pk = handler.get_assistant_pk('asst_bench')
+
+            def commit(role, content):
+                handler.append(Conversation, {'role': role, 'content': content,
+                                              'thread_id': thread_pk, 'assistant_id': assistant_pk})
+
+            for role, content in _sample_messages(history):
+                commit(role, content)
+            start = time.perf_counter()
+            for role, content in _sample_messages(commits):
+                commit(role, content)
+            commits_per_sec = commits / (time.perf_counter() - start)
+
+            # The UI loads a history while the answer of a run is being saved
+            stop = threading.Event()
+
+            def write():
+                while not stop.is_set():
+                    commit('assistant', 'The revenue grew.')
+
+            writer = threading.Thread(target=write)
+            writer.start()
+            latencies = []
+            try:
+                for _ in range(reads):
+                    start = time.perf_counter()
+                    handler.get_conversations(thread_id='thread_bench')
+                    latencies.append((time.perf_counter() - start) * 1000)
+            finally:
+                stop.set()
+                writer.join()
+            handler.engine.dispose()
+            if handler.ReadSession is not handler.Session:
+                handler.read_engine.dispose()
+        result[profile] = {
+            'commits_per_sec': commits_per_sec,
+            'read_p50_ms': _percentile(latencies, 0.5),
+            'read_p95_ms': _percentile(latencies, 0.95),
+        }
+    return result
+
+
+def bench_export_import(rows=100000, suffix='.jsonl.gz', baseline_rows=2000):
+    """
+    Exports a history of SQLite to a JSON lines file and imports it into a new database, against appending the
+    conversations one by one.
+
+    :param rows: Number of conversations in the history.
+    :param suffix: Suffix of the exported file, which picks its compression.
+    :param baseline_rows: Number of conversations appended one by one for the baseline.
+    :return: Dictionary of the conversations per second and the MB of JSON lines per second.
+    """
+    from archive import to_jsonl
+    from db_handler import Conversation, GenericDBHandler
+    from records import ArchivedConversationRecord
+
+    with tempfile.TemporaryDirectory() as directory:
+        seed_path = os.path.join(directory, 'seed.jsonl')
+        with open(seed_path, 'w', encoding='utf-8') as f:
+            for i, (role, content) in enumerate(_sample_messages(rows)):
+                f.write(to_jsonl(ArchivedConversationRecord(i + 1, role, content, f'thread_{i % 100}', 'asst_bench',
+                                                            None, None, None)))
+        source = GenericDBHandler(f'sqlite:///{os.path.join(directory, "source.db")}')
+        source.import_conversations(seed_path)
+
+        export_path = os.path.join(directory, 'export' + suffix)
+        start = time.perf_counter()
+        source.export_conversations(export_path)
+        export_seconds = time.perf_counter() - start
+        # Throughput in MB of JSON lines, whatever the compression
+        size_mb = os.path.getsize(seed_path) / (1024 * 1024)
+        file_mb = os.path.getsize(export_path) / (1024 * 1024)
+
+        target = GenericDBHandler(f'sqlite:///{os.path.join(directory, "target.db")}')
+        start = time.perf_counter()
+        target.import_conversations(export_path)
+        import_seconds = time.perf_counter() - start
+
+        baseline = GenericDBHandler(f'sqlite:///{os.path.join(directory, "baseline.db")}')
+        thread_pk = baseline.get_thread_pk('thread_bench', 'asst_bench')
+        start = time.perf_counter()
+        for role, content in _sample_messages(baseline_rows):
+            baseline.append(Conversation, {'role': role, 'content': content, 'thread_id': thread_pk})
+        append_seconds = time.perf_counter() - start
+        for handler in (source, target, baseline):
+            handler.engine.dispose()
+    return {
+        'rows': rows,
+        'jsonl_mb': size_mb,
+        'file_mb': file_mb,
+        'export_rows_per_sec': rows / export_seconds,
+        'export_mb_per_sec': size_mb / export_seconds,
+        'import_rows_per_sec': rows / import_seconds,
+        'import_mb_per_sec': size_mb / import_seconds,
+        'append_rows_per_sec': baseline_rows / append_seconds,
+    }
+
+
+_app = None
+
+
+def _get_app():
+    # The GUI benchmarks run without a display unless a platform is set
+    global _app
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PyQt6.QtWidgets import QApplication
+    if QApplication.instance() is None:
+        # Kept referenced, the application is destroyed along with its Python object
+        _app = QApplication([])
+    return QApplication.instance()
+
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        # Not available on Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def _run_in_event_loop(steps, heartbeat_ms=5):
+    """
+    Runs the steps of a benchmark in the Qt event loop, while a heartbeat timer measures how long the loop stalls.
+
+    :param steps: Iterator running one step per next(), yielding the seconds to wait before the next step.
+    :param heartbeat_ms: Interval of the heartbeat timer.
+    :return: Dictionary of the wall time, the peak RSS of the process and the stall percentiles in milliseconds.
+    """
+    from PyQt6.QtCore import QEventLoop, QTimer, Qt
+
+    loop = QEventLoop()
+    gaps = []
+    last_beat = [time.perf_counter()]
+    errors = []
+
+    def beat():
+        now = time.perf_counter()
+        gaps.append(now - last_beat[0])
+        last_beat[0] = now
+
+    def step():
+        try:
+            wait = next(steps)
+        except StopIteration:
+            loop.quit()
+            return
+        except Exception as e:
+            errors.append(e)
+            loop.quit()
+            return
+        QTimer.singleShot(max(0, round((wait or 0) * 1000)), Qt.TimerType.PreciseTimer, step)
+
+    heartbeat = QTimer()
+    heartbeat.setTimerType(Qt.TimerType.PreciseTimer)
+    heartbeat.setInterval(heartbeat_ms)
+    heartbeat.timeout.connect(beat)
+    start = time.perf_counter()
+    last_beat[0] = start
+    heartbeat.start()
+    QTimer.singleShot(0, step)
+    loop.exec()
+    # The last step may have blocked the loop until now
+    beat()
+    heartbeat.stop()
+    seconds = time.perf_counter() - start
+    if errors:
+        raise errors[0]
+
+    stalls = [max(0.0, gap * 1000 - heartbeat_ms) for gap in gaps]
+    return {
+        'seconds': seconds,
+        'peak_rss_mb': _peak_rss_mb(),
+        'stall_p50_ms': _percentile(stalls, 0.5),
+        'stall_p95_ms': _percentile(stalls, 0.95),
+        'stall_p99_ms': _percentile(stalls, 0.99),
+        'stall_max_ms': max(stalls),
+    }
+
+
+def _close_widget(widget):
+    from PyQt6.QtWidgets import QApplication
+
+    widget.close()
+    widget.deleteLater()
+    QApplication.processEvents()
+
+
+def bench_gui_set_messages(sizes=(1000, 10000, 100000), max_seconds=120):
+    """
+    Measures ChatBrowser.setMessages with histories of increasing size, up to the first layout pass.
+
+    :param sizes: Numbers of messages.
+    :param max_seconds: Sizes expected to take longer, from the last size measured scaled linearly,
+        are skipped and reported as None.
+    :return: Dictionary of results by number of messages.
+    """
+    from chatBrowser import ChatBrowser
+
+    _get_app()
+    results = {}
+    last = None
+    for n in sizes:
+        if last is not None and results[last]['seconds'] * n / last > max_seconds:
+            results[n] = None
+            continue
+        messages = [ConversationRecord(role, content) for role, content in _sample_messages(n)]
+        browser = ChatBrowser()
+        browser.resize(800, 600)
+        browser.show()
+
+        def steps():
+            yield 0
+            browser.setMessages(messages)
+            # The next step only runs once the layout and the paint of the messages are done
+            yield 0
+
+        results[n] = _run_in_event_loop(steps())
+        _close_widget(browser)
+        last = n
+    return results
+
+
+def bench_gui_add_chunk(answer_chars=(2000, 20000), tokens_per_sec=100, chars_per_token=4):
+    """
+    Streams answers into the ChatBrowser chunk by chunk at a realistic token rate.
+
+    :param answer_chars: Lengths of the answers.
+    :param tokens_per_sec: Rate of the chunks, one token per chunk.
+    :param chars_per_token: Number of characters per chunk.
+    :return: Dictionary of results by answer length, with the time spent in addChunk and the rate achieved.
+    """
+    from chatBrowser import ChatBrowser
+
+    _get_app()
+    paragraph = 'The total revenue was reported in the consolidated statements of income. ' * 5 + '\n\n'
+    results = {}
+    for n in answer_chars:
+        answer = (paragraph * (n // len(paragraph) + 1))[:n]
+        chunks = [answer[i:i + chars_per_token] for i in range(0, n, chars_per_token)]
+        browser = ChatBrowser()
+        browser.resize(800, 600)
+        browser.show()
+        browser.addMessage(ConversationRecord('user', 'What was the total revenue?'))
+        chunk_seconds = []
+
+        def steps():
+            yield 0
+            for chunk in chunks:
+                start = time.perf_counter()
+                browser.addChunk(chunk)
+                chunk_seconds.append(time.perf_counter() - start)
+                yield 1 / tokens_per_sec
+
+        result = _run_in_event_loop(steps())
+        result.update({
+            'chunks': len(chunks),
+            'chunk_p50_ms': _percentile(chunk_seconds, 0.5) * 1000,
+            'chunk_p95_ms': _percentile(chunk_seconds, 0.95) * 1000,
+            'chunk_max_ms': max(chunk_seconds) * 1000,
+            'tokens_per_sec': len(chunks) / result['seconds'],
+        })
+        results[n] = result
+        _close_widget(browser)
+    return results
+
+
+def bench_gui_table(rows=10000):
+    """
+    Adds file records to a sorted TableWidget one by one with addRecord, and all at once with addRecords.
+
+    :param rows: Number of records.
+    :return: Dictionary of results by method.
+    """
+    from PyQt6.QtCore import Qt
+    from records import FileRecord
+    from tableWidget import TableWidget
+
+    _get_app()
+    now = int(time.time())
+    records = [FileRecord(file_id=f'file_{i:06d}', filename=f'report_{i}.pdf', bytes=(i * 7919) % 100000,
+                          created_at=now - (i * 104729) % 1000000) for i in range(rows)]
+    results = {}
+    for method in ('addRecord', 'addRecords'):
+        table = TableWidget(columns=['file_id', 'filename', 'bytes', 'created_at'], id_key='file_id')
+        table.resize(800, 600)
+        table.setSortingEnabled(True)
+        table.sortByColumn(3, Qt.SortOrder.DescendingOrder)
+        table.show()
+
+        def steps():
+            yield 0
+            if method == 'addRecord':
+                # One record per step, like records arriving while the table is shown
+                for record in records:
+                    table.addRecord(record)
+                    yield 0
+            else:
+                table.addRecords(records)
+                yield 0
+
+        results[method] = _run_in_event_loop(steps())
+        results[method]['rows'] = table.rowCount()
+        _close_widget(table)
+    return results
+
+
+def _sample_answer(n):
+    # Markdown like an answer about a 10-K filing, with headings, lists, tables and code
+    section = (
+        '## Results of operations\n\n'
+        'Total revenue was **$307.4 billion**, up 9% year over year, driven by *Services* and Cloud.\n'
+        'Operating margin improved as headcount costs were flat.\n\n'
+        '- Services revenue: $272.5 billion\n'
+        '- Cloud revenue: $33.1 billion\n'
+        '- Other bets: $1.5 billion\n\n'
+        '| Segment | 2023 | 2022 | Change |\n'
+        '|---------|------|------|--------|\n'
+        '| Services | 272.5 | 253.5 | 7% |\n'
+        '| Cloud | 33.1 | 26.3 | 26% |\n\n'
+        '```python\n'
+        'growth = (revenue_2023 - revenue_2022) / revenue_2022\n'
+        '```\n\n'
+    )
+    return (section * (n // len(section) + 1))[:n]
+
+
+def bench_markdown_render(answer_chars=(2000, 20000), chars_per_chunk=4):
+    """
+    Streams Markdown answers chunk by chunk, rendering the whole answer again on every chunk (full)
+    and with the incremental rendering of ChatBrowser.addChunk (incremental).
+
+    :param answer_chars: Lengths of the answers.
+    :param chars_per_chunk: Number of characters per chunk.
+    :return: Dictionary of results by answer length and rendering.
+    """
+    from PyQt6.QtWidgets import QTextBrowser
+    from chatBrowser import ChatBrowser, _MARKDOWN_FEATURES
+
+    _get_app()
+    results = {}
+    for n in answer_chars:
+        answer = _sample_answer(n)
+        chunks = [answer[i:i + chars_per_chunk] for i in range(0, n, chars_per_chunk)]
+        results[n] = {}
+        for mode in ('full', 'incremental'):
+            browser = ChatBrowser() if mode == 'incremental' else QTextBrowser()
+            browser.resize(800, 600)
+            browser.show()
+            chunk_seconds = []
+
+            def steps():
+                yield 0
+                text = ''
+                for chunk in chunks:
+                    start = time.perf_counter()
+                    if mode == 'incremental':
+                        browser.addChunk(chunk)
+                    else:
+                        text += chunk
+                        browser.document().setMarkdown(text, _MARKDOWN_FEATURES)
+                    chunk_seconds.append(time.perf_counter() - start)
+                    yield 0
+
+            result = _run_in_event_loop(steps())
+            result.update({
+                'chunks': len(chunks),
+                'chunk_p50_ms': _percentile(chunk_seconds, 0.5) * 1000,
+                'chunk_p95_ms': _percentile(chunk_seconds, 0.95) * 1000,
+                'render_seconds': sum(chunk_seconds),
+            })
+            results[n][mode] = result
+            _close_widget(browser)
+    return results
+
+
+class StandInClient:
+    """
+    Stand-in for the OpenAI client serving assistants sharing one vector store of files from memory,
+    with a fixed latency per request like a local API.
+    """
+
+    def __init__(self, assistants=300, files=300, latency=0.02):
+        """
+        Initializes the StandInClient.
+
+        :param assistants: Number of assistants.
+        :param files: Number of files in the vector store.
+        :param latency: Seconds per request.
+        """
+        from openai._models import construct_type
+        from openai.types import FileObject, VectorStore
+        from openai.types.beta import Assistant
+
+        now = int(time.time())
+        self.__latency = latency
+        self.__vector_store = construct_type(type_=VectorStore, value={
+            'id': 'vs_bench', 'object': 'vector_store', 'name': 'Reports', 'created_at': now, 'last_active_at': now,
+            'status': 'completed', 'usage_bytes': files * 1000,
+            'file_counts': {'in_progress': 0, 'completed': files, 'failed': 0, 'cancelled': 0, 'total': files},
+        })
+        self.__assistants = [construct_type(type_=Assistant, value={
+            'id': f'asst_{i:05d}', 'object': 'assistant', 'name': f'Assistant {i}', 'model': 'gpt-4o',
+            'instructions': 'Answer from the reports.', 'tools': [{'type': 'file_search'}], 'created_at': now - i,
+            'tool_resources': {'file_search': {'vector_store_ids': [self.__vector_store.id]}},
+        }) for i in range(assistants)]
+        self.__files = [construct_type(type_=FileObject, value={
+            'id': f'file_{i:05d}', 'object': 'file', 'filename': f'report_{i}.pdf', 'bytes': 1000 + i,
+            'created_at': now - i, 'purpose': 'assistants', 'status': 'processed',
+        }) for i in range(files)]
+        assistants_by_id = {assistant.id: assistant for assistant in self.__assistants}
+        files_by_id = {file.id: file for file in self.__files}
+
+        assistants_ns = types.SimpleNamespace(list=lambda **kwargs: self.__list(self.__assistants, **kwargs),
+                                              retrieve=lambda assistant_id, **kwargs: self.__get(assistants_by_id[assistant_id]))
+        vector_store_files_ns = types.SimpleNamespace(list=lambda vector_store_id, **kwargs: self.__list(self.__files, **kwargs))
+        vector_stores_ns = types.SimpleNamespace(files=vector_store_files_ns,
+                                                 retrieve=lambda vector_store_id, **kwargs: self.__get(self.__vector_store))
+        threads_ns = types.SimpleNamespace(create=lambda **kwargs: self.__get(types.SimpleNamespace(id='thread_bench')))
+        self.beta = types.SimpleNamespace(assistants=assistants_ns, vector_stores=vector_stores_ns, threads=threads_ns)
+        self.files = types.SimpleNamespace(retrieve=lambda file_id, **kwargs: self.__get(files_by_id[file_id]))
+        self.models = types.SimpleNamespace(list=lambda **kwargs: self.__get(types.SimpleNamespace(data=[], has_more=False)))
+
+    def __get(self, obj):
+        time.sleep(self.__latency)
+        return obj
+
+    def __list(self, objs, limit=20, after=None, **kwargs):
+        start = next(i + 1 for i, obj in enumerate(objs) if obj.id == after) if after else 0
+        return self.__get(types.SimpleNamespace(data=objs[start:start + limit], has_more=start + limit < len(objs)))
+
+
+@contextlib.contextmanager
+def _stand_in_main(client):
+    """
+    Patches main to build its wrapper on a stand-in client and a temporary database.
+    MainWindow creates settings.ini next to main.py, it is removed again if it wasn't there.
+
+    :param client: StandInClient.
+    :yield: The patched main module.
+    """
+    from unittest import mock
+
+    import main
+    from script import GPTAssistantV2Wrapper
+
+    directory = tempfile.mkdtemp()
+
+    class StandInApiWrapper(GPTAssistantV2Wrapper):
+        def __init__(self, api_key=None, db_url=None):
+            super().__init__(db_url=f'sqlite:///{os.path.join(directory, "conv.db")}')
+            self.set_client(client)
+
+        def request_and_set_api(self, api_key):
+            # The key check of the ApiWidget goes to the stand-in too
+            client.models.list()
+            return True
+
+    settings_path = os.path.join(os.path.dirname(os.path.abspath(main.__file__)), 'settings.ini')
+    had_settings = os.path.exists(settings_path)
+    try:
+        with mock.patch.object(main, 'GPTAssistantV2Wrapper', StandInApiWrapper):
+            yield main
+    finally:
+        if not had_settings and os.path.exists(settings_path):
+            os.remove(settings_path)
+
+
+def bench_gui_main_window(assistants=300, files=300, latency=0.02, settle=2.0):
+    """
+    Measures the construction of the MainWindow against a StandInClient, from the constructor
+    to the first page of assistants, vector stores and files being shown.
+
+    :param assistants: Number of assistants of the stand-in.
+    :param files: Number of files of the stand-in.
+    :param latency: Seconds per request of the stand-in.
+    :param settle: Seconds the window is kept open after it is shown, e.g. for the first sync pass.
+    :return: Dictionary of the construction time and the results over the whole run.
+    """
+    _get_app()
+    client = StandInClient(assistants, files, latency)
+    construct_seconds = []
+    windows = []
+
+    with _stand_in_main(client) as main:
+        def steps():
+            yield 0
+            start = time.perf_counter()
+            windows.append(main.MainWindow())
+            windows[0].show()
+            construct_seconds.append(time.perf_counter() - start)
+            yield settle
+
+        try:
+            result = _run_in_event_loop(steps())
+            rows = windows[0].findChildren(main.TableWidget)
+            result['rows'] = [table.rowCount() for table in rows]
+            result['construct_seconds'] = construct_seconds[0]
+        finally:
+            if windows:
+                _close_widget(windows[0])
+    return result
+
+
+def bench_assistant_selection(clicks=20, dwell=1.0, assistants=300, files=300, latency=0.05):
+    """
+    Measures how long selecting an assistant blocks the UI, clicking down the assistant table with a pause
+    between two clicks, with the prefetcher warming the visible assistants and with every selection cold.
+
+    :param clicks: Number of assistants selected after the first one.
+    :param dwell: Seconds between two clicks.
+    :param assistants: Number of assistants of the stand-in.
+    :param files: Number of files of the stand-in.
+    :param latency: Seconds per request of the stand-in.
+    :return: Dictionary of the click percentiles, the cache hits and the event loop results per mode.
+    """
+    from unittest import mock
+
+    from prefetcher import Prefetcher
+
+    _get_app()
+    results = {}
+    for mode in ('prefetch', 'cold'):
+        client = StandInClient(assistants, files, latency)
+        click_seconds = []
+        windows = []
+        prefetchers = []
+
+        class BenchPrefetcher(Prefetcher):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                prefetchers.append(self)
+
+            def prefetch(self, assistant_ids):
+                if mode == 'prefetch':
+                    super().prefetch(assistant_ids)
+
+        with _stand_in_main(client) as main, mock.patch.object(main, 'Prefetcher', BenchPrefetcher):
+            def steps():
+                yield 0
+                windows.append(main.MainWindow())
+                windows[0].show()
+                yield dwell
+                table = next(table for table in windows[0].findChildren(main.TableWidget)
+                             if table.rowCount() and 'assistant_id' in dict(table.getRecord(0)))
+                for row in range(1, clicks + 1):
+                    start = time.perf_counter()
+                    # The selection handler lists the vector stores and the first files before it returns
+                    table.selectRow(row)
+                    click_seconds.append(time.perf_counter() - start)
+                    yield dwell
+
+            try:
+                result = _run_in_event_loop(steps())
+                result.update({
+                    'click_p50_ms': _percentile(click_seconds, 0.5) * 1000,
+                    'click_p95_ms': _percentile(click_seconds, 0.95) * 1000,
+                    'prefetcher': prefetchers[0].get_metrics(),
+                })
+            finally:
+                if windows:
+                    _close_widget(windows[0])
+        results[mode] = result
+    return results
+
+
+BENCHMARKS = {
+    'message_memory': bench_message_memory,
+    'server_load': bench_server_load,
+    'run_replay': bench_run_replay,
+    'event_bus': bench_event_bus,
+    'fan_out': bench_fan_out,
+    'legacy_upgrade': bench_legacy_upgrade,
+    'sqlite_profile': bench_sqlite_profile,
+    'export_import': bench_export_import,
+    'gui_set_messages': bench_gui_set_messages,
+    'gui_add_chunk': bench_gui_add_chunk,
+    'markdown_render': bench_markdown_render,
+    'gui_table': bench_gui_table,
+    'gui_main_window': bench_gui_main_window,
+    'assistant_selection': bench_assistant_selection,
+}
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Run the benchmarks and print the results as JSON.')
+    parser.add_argument('names', nargs='*', help=f'Benchmarks to run (defaults to all): {", ".join(BENCHMARKS)}')
+    args = parser.parse_args()
+    for name in args.names:
+        if name not in BENCHMARKS:
+            parser.error(f'unknown benchmark: {name}')
+
+    results = {name: BENCHMARKS[name]() for name in (args.names or BENCHMARKS)}
+    print(json.dumps(results, indent=2))
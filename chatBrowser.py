@@ -1,31 +1,109 @@
 from PyQt6.QtCore import Qt, pyqtSignal
-from PyQt6.QtWidgets import QScrollArea, QVBoxLayout, QWidget, QLabel, QHBoxLayout, QTextEdit
+from PyQt6.QtGui import QColor, QTextBlockFormat, QTextCharFormat, QTextCursor, QTextDocument, QTextDocumentFragment, \
+    QTextFrameFormat
+from PyQt6.QtWidgets import QWidget, QHBoxLayout, QTextBrowser, QTextEdit, QPushButton, QFileDialog
 
+from markdown_stream import MarkdownStream, link_citations
+
+_MARKDOWN_FEATURES = QTextDocument.MarkdownFeature.MarkdownDialectGitHub | QTextDocument.MarkdownFeature.MarkdownNoHTML
+
+
+def _markdown_fragment(text):
+    """
+    Parses Markdown into a fragment that keeps the format of its first block when it is inserted.
+
+    :param text: Markdown.
+    :return: QTextDocumentFragment.
+    """
+    document = QTextDocument()
+    document.setMarkdown(text, _MARKDOWN_FEATURES)
+    # An inserted fragment merges its first block into the block at the cursor, which drops the format of headings
+    # and code blocks. An empty first block is merged instead.
+    cursor = QTextCursor(document)
+    cursor.insertBlock()
+    cursor.movePosition(QTextCursor.MoveOperation.Start)
+    cursor.setBlockFormat(QTextBlockFormat())
+    cursor.setBlockCharFormat(QTextCharFormat())
+    return QTextDocumentFragment(document)
+
+
+class ChatBrowser(QTextBrowser):
+    """
+    Conversation shown as one document, a frame per message. Answers are rendered as Markdown.
+
+    A streamed answer is rendered block by block: blocks already finished stay as they are
+    and only the open block at the end is parsed and rendered again on each chunk.
+    """
+    citationClicked = pyqtSignal(object)
+
+    # Inserting a frame scans the frames of its parent, so message frames are grouped in pages of frames
+    PAGE_SIZE = 200
 
-class ChatBrowser(QScrollArea):
     def __init__(self):
         super().__init__()
+        self.__initVal()
         self.__initUi()
 
+    def __initVal(self):
+        self.__page = None
+        self.__pageCount = 0
+        # Answer being streamed: its frame, its Markdown split in blocks and the position of its open block
+        self.__stream = None
+        self.__streamFrame = None
+        self.__openStart = 0
+        self.__messageCount = 0
+        # Citation by anchor, e.g. 'cite:3/0' for the first citation of the 3rd message
+        self.__citations = {}
+        self.__followBottom = True
+
     def __initUi(self):
-        lay = QVBoxLayout()
-        lay.setAlignment(Qt.AlignmentFlag.AlignTop)
-        lay.setSpacing(0)
-        lay.setContentsMargins(0, 0, 0, 0)
-        widget = QWidget()
-        widget.setLayout(lay)
-        self.setWidget(widget)
-        self.setWidgetResizable(True)
+        self.setOpenLinks(False)
+        self.anchorClicked.connect(self.__anchorClicked)
+        # Chunks replace the open block over and over, none of it needs to be undone
+        self.document().setUndoRedoEnabled(False)
+        self.verticalScrollBar().valueChanged.connect(self.__scrolled)
+        self.verticalScrollBar().rangeChanged.connect(self.__rangeChanged)
+
+    def __scrolled(self, value):
+        # Keep following new messages only while the view is at the bottom
+        self.__followBottom = value >= self.verticalScrollBar().maximum() - 4
+
+    def __rangeChanged(self, minimum, maximum):
+        if self.__followBottom:
+            self.verticalScrollBar().setValue(maximum)
+
+    def __insertFrame(self, role):
+        if self.__page is None or self.__pageCount == self.PAGE_SIZE:
+            cursor = QTextCursor(self.document())
+            cursor.movePosition(QTextCursor.MoveOperation.End)
+            pageFormat = QTextFrameFormat()
+            pageFormat.setMargin(0)
+            self.__page = cursor.insertFrame(pageFormat)
+            self.__pageCount = 0
+        frameFormat = QTextFrameFormat()
+        frameFormat.setPadding(12)
+        frameFormat.setMargin(0)
+        if role != 'user':
+            frameFormat.setBackground(QColor('#AAA'))
+        self.__pageCount += 1
+        self.__messageCount += 1
+        return self.__page.lastCursorPosition().insertFrame(frameFormat)
+
+    def __insertMessage(self, role, content):
+        cursor = self.__insertFrame(role).firstCursorPosition()
+        if role == 'user':
+            # What the user typed is shown as typed
+            cursor.insertText(content or '')
+        else:
+            cursor.insertFragment(_markdown_fragment(content or ''))
 
     def setMessages(self, messages):
+        self.__stream = None
+        cursor = QTextCursor(self.document())
+        cursor.beginEditBlock()
         for message in messages:
-            self.addMessage(message)
-
-    def __setAndGetLabel(self, text):
-        chatLbl = QLabel(text)
-        chatLbl.setWordWrap(True)
-        chatLbl.setTextInteractionFlags(Qt.TextInteractionFlag.TextSelectableByMouse)
-        return chatLbl
+            self.__insertMessage(message.role, message.content)
+        cursor.endEditBlock()
 
     def addChunk(self, chunk):
         """
@@ -33,24 +111,57 @@ class ChatBrowser(QScrollArea):
         :param chunk:
         :return:
         """
-        # For temporary measure to add messages in chunks
-        # Currently i don't want to make this application anymore complex
-        if self.widget().layout().count() % 2 == 1:
-            chatLbl = self.__setAndGetLabel(chunk)
-            chatLbl.setStyleSheet('QLabel { background-color: #AAA; padding: 1em }')
-            self.widget().layout().addWidget(chatLbl)
-        else:
-            # The unit is AI
-            chatLbl = self.__getLastUnit()
-            if chatLbl:
-                chatLbl.setText(chatLbl.text() + chunk)
-
-    def __getLastUnit(self) -> QLabel | None:
-        item = self.widget().layout().itemAt(self.widget().layout().count() - 1)
-        if item:
-            return item.widget()
-        else:
-            return None
+        if self.__stream is None:
+            self.__stream = MarkdownStream()
+            self.__streamFrame = self.__insertFrame('assistant')
+            self.__openStart = self.__streamFrame.firstPosition()
+        finished = self.__stream.feed(chunk)
+
+        cursor = self.__clearFrom(self.__openStart)
+        if finished:
+            cursor.insertFragment(_markdown_fragment(finished))
+            self.__openStart = cursor.position()
+        cursor.insertFragment(_markdown_fragment(self.__stream.get_open_block()))
+        cursor.endEditBlock()
+
+    def __clearFrom(self, position):
+        """
+        Removes the end of the frame being streamed from a position.
+
+        :param position: Position in the frame.
+        :return: QTextCursor at the position, in an edit block to end.
+        """
+        cursor = QTextCursor(self.document())
+        cursor.beginEditBlock()
+        cursor.setPosition(position)
+        # The block left at the position would take the format of the last block removed, e.g. of a code block
+        blockFormat = cursor.blockFormat()
+        cursor.setPosition(self.__streamFrame.lastPosition(), QTextCursor.MoveMode.KeepAnchor)
+        cursor.removeSelectedText()
+        cursor.setBlockFormat(blockFormat)
+        return cursor
+
+    def setCitations(self, citations):
+        """
+        Links the citations of the answer being streamed, the answer is rendered once more with its sources.
+        The next chunk starts a new message.
+
+        :param citations: List of CitationRecord.
+        """
+        if self.__stream is None:
+            return
+        href = f'cite:{self.__messageCount}/{{index}}'
+        for citation in citations:
+            self.__citations[href.format(index=citation['index'])] = citation
+        cursor = self.__clearFrom(self.__streamFrame.firstPosition())
+        cursor.insertFragment(_markdown_fragment(link_citations(self.__stream.get_text(), citations, href)))
+        cursor.endEditBlock()
+        self.__stream = None
+
+    def __anchorClicked(self, url):
+        citation = self.__citations.get(url.toString())
+        if citation is not None:
+            self.citationClicked.emit(citation)
 
     def addMessage(self, message):
         """
@@ -58,37 +169,18 @@ class ChatBrowser(QScrollArea):
         :param message:
         :return:
         """
-        content = message['content']
-        role = message['role']
-        chatLbl = self.__setAndGetLabel(content)
-        if role == 'user':
-            chatLbl.setStyleSheet('QLabel { padding: 1em }')
-        else:
-            chatLbl.setStyleSheet('QLabel { background-color: #AAA; padding: 1em }')
-        self.widget().layout().addWidget(chatLbl)
-
-    def event(self, e):
-        if e.type() == 43:
-            self.verticalScrollBar().setSliderPosition(self.verticalScrollBar().maximum())
-        return super().event(e)
+        # A new message ends the answer being streamed
+        self.__stream = None
+        self.__insertMessage(message.role, message.content)
 
     def getAllText(self):
-        all_text_lst = []
-        lay = self.widget().layout()
-        if lay:
-            for i in range(lay.count()):
-                if lay.itemAt(i) and lay.itemAt(i).widget():
-                    widget = lay.itemAt(i).widget()
-                    if isinstance(widget, QLabel):
-                        all_text_lst.append(widget.text())
-
-        return '\n'.join(all_text_lst)
+        return self.toPlainText()
 
     def clearMessages(self):
-        lay = self.widget().layout()
-        if lay:
-            for i in range(lay.count()-1, -1, -1):
-                lay.removeWidget(lay.itemAt(i).widget())
+        self.clear()
+        self.__page = None
+        self.__stream = None
+        self.__citations.clear()
 
 
 class TextEditPrompt(QTextEdit):
@@ -114,24 +206,53 @@ class TextEditPrompt(QTextEdit):
 
 class PromptWidget(QWidget):
     sendPrompt = pyqtSignal(str)
+    fileAttached = pyqtSignal(str)
 
     def __init__(self):
         super().__init__()
+        self.__initVal()
         self.__initUi()
 
+    def __initVal(self):
+        self.__attachment = None
+
     def __initUi(self):
         self.__textEdit = TextEditPrompt()
         self.__textEdit.textChanged.connect(self.updateHeight)
         self.__textEdit.returnPressed.connect(self.__sendPrompt)
+        self.__attachBtn = QPushButton('Attach')
+        self.__attachBtn.setCheckable(True)
+        self.__attachBtn.clicked.connect(self.__attach)
         lay = QHBoxLayout()
         lay.addWidget(self.__textEdit)
+        lay.addWidget(self.__attachBtn, alignment=Qt.AlignmentFlag.AlignBottom)
         lay.setContentsMargins(0, 0, 0, 0)
         self.setLayout(lay)
         self.updateHeight()
 
+    def __attach(self, f):
+        # Clicking again removes the attachment
+        if f:
+            filename, _ = QFileDialog.getOpenFileName(self, 'Attach File', '', 'Text Files (*.txt);;PDF Files (*.pdf);;')
+            if filename:
+                self.__setAttachment(filename)
+                # Lets the file be uploaded while the prompt is still being typed
+                self.fileAttached.emit(filename)
+                return
+        self.__setAttachment(None)
+
+    def __setAttachment(self, filename):
+        self.__attachment = filename
+        self.__attachBtn.setChecked(filename is not None)
+        self.__attachBtn.setToolTip(filename or '')
+
+    def getAttachment(self):
+        return self.__attachment
+
     def __sendPrompt(self, text):
         self.sendPrompt.emit(text)
         self.__textEdit.clear()
+        self.__setAttachment(None)
 
     def updateHeight(self):
         document = self.__textEdit.document()
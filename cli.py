@@ -0,0 +1,264 @@
+"""
+Headless command line interface over GPTAssistantV2Wrapper. It never imports PyQt.
+
+    python -m cli chat --assistant asst_... "Who is yjg30737?"
+    python -m cli chat --assistant asst_... --file prompts.txt --jsonl > answers.jsonl
+    python -m cli compare --assistant asst_... --assistant asst_... "What was the revenue?"
+    python -m cli upload vs_... edgar/goog-10k.pdf edgar/brka-10k.txt
+    python -m cli ls assistants
+    python -m cli rm assistant asst_... asst_... --dry-run
+    python -m cli export history.jsonl.gz
+    python -m cli --db-url postgresql://... import history.jsonl.gz
+    python -m cli usage --by assistant_id,day --since 2024-06-01
+
+The API key is read from --api-key or the OPENAI_API_KEY environment variable, export, import and usage don't need it.
+"""
+import argparse, json, os, sys, time
+
+
+def _to_json(value):
+    if hasattr(value, 'model_dump'):
+        return value.model_dump()
+    return str(value)
+
+
+def _write_jsonl(obj):
+    sys.stdout.write(json.dumps(obj, default=_to_json, ensure_ascii=False) + '\n')
+    sys.stdout.flush()
+
+
+def _get_wrapper(args):
+    # script imports the OpenAI SDK, so it is only imported once a command really runs
+    from script import GPTAssistantV2Wrapper
+
+    api_key = args.api_key or os.environ.get('OPENAI_API_KEY')
+    if not api_key:
+        sys.exit('error: set OPENAI_API_KEY or pass --api-key')
+    return GPTAssistantV2Wrapper(api_key=api_key, db_url=args.db_url)
+
+
+def _iter_prompts(args):
+    if args.prompt:
+        yield ' '.join(args.prompt)
+        return
+    f = open(args.file, 'r', encoding='utf-8') if args.file else sys.stdin
+    try:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield line
+    finally:
+        if args.file:
+            f.close()
+
+
+def chat(args):
+    wrapper = _get_wrapper(args)
+    thread_id = args.thread
+    for prompt in _iter_prompts(args):
+        if not args.thread and (thread_id is None or args.fresh):
+            wrapper.set_current_assistant(args.assistant)
+            thread_id = wrapper.get_current_thread_id()
+        start = time.perf_counter()
+        first_token_at = None
+        response = []
+        for chunk in wrapper.send_message(prompt, instructions=args.instructions, assistant_id=args.assistant,
+                                          thread_id=thread_id, timeout=args.timeout, idle_timeout=args.idle_timeout):
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+            if args.jsonl:
+                response.append(chunk)
+            else:
+                sys.stdout.write(chunk)
+                sys.stdout.flush()
+        if args.jsonl:
+            _write_jsonl({
+                'prompt': prompt,
+                'response': ''.join(response),
+                'assistant_id': args.assistant,
+                'thread_id': thread_id,
+                'ttft': first_token_at - start if first_token_at else None,
+                'seconds': time.perf_counter() - start,
+            })
+        else:
+            sys.stdout.write('\n')
+    return 0
+
+
+def compare(args):
+    wrapper = _get_wrapper(args)
+    prompt = ' '.join(args.prompt)
+    responses = {assistant_id: [] for assistant_id in args.assistant}
+
+    def write_result(result):
+        # One line per assistant as soon as its run is over
+        _write_jsonl({'prompt': prompt, 'response': ''.join(responses[result['assistant_id']]), **dict(result)})
+
+    for assistant_id, chunk in wrapper.send_message_to_assistants(prompt, args.assistant, instructions=args.instructions,
+                                                                  timeout=args.timeout, idle_timeout=args.idle_timeout,
+                                                                  on_result=write_result):
+        responses[assistant_id].append(chunk)
+    return 0
+
+
+def upload(args):
+    wrapper = _get_wrapper(args)
+    result = wrapper.upload_files_to_vector_store(args.vector_store, args.paths)
+    _write_jsonl(dict(result))
+    return 0
+
+
+def ls(args):
+    wrapper = _get_wrapper(args)
+    # Listings are written page by page, so memory stays bounded on large accounts
+    if args.kind == 'assistants':
+        pages = (records for records, _, _ in wrapper.iter_assistants(order=args.order))
+    elif args.kind == 'vector-stores':
+        if args.assistant:
+            pages = [wrapper.get_vector_stores(args.assistant)]
+        else:
+            pages = (records for records, _, _ in wrapper.iter_vector_stores(order=args.order))
+    else:
+        if not args.vector_store:
+            sys.exit('error: ls files needs --vector-store')
+        pages = (records for records, _, _ in wrapper.iter_vector_store_files(args.vector_store, order=args.order))
+    for records in pages:
+        for record in records:
+            if args.jsonl:
+                _write_jsonl(dict(record))
+            else:
+                print('\t'.join(str(value) for value in record.values()[:3]))
+    return 0
+
+
+def rm(args):
+    wrapper = _get_wrapper(args)
+    if args.kind == 'assistant':
+        results = wrapper.delete_assistants(args.ids, max_workers=args.workers, dry_run=args.dry_run)
+    elif args.kind == 'vector-store':
+        results = wrapper.delete_vector_stores(args.ids, max_workers=args.workers, dry_run=args.dry_run)
+    elif args.vector_store:
+        results = wrapper.delete_vector_store_files(args.vector_store, args.ids, max_workers=args.workers, dry_run=args.dry_run)
+    else:
+        results = wrapper.delete_files(args.ids, max_workers=args.workers, dry_run=args.dry_run)
+    for result in results:
+        _write_jsonl({'id': result.item, 'ok': result.ok, 'error': result.error, 'dry_run': args.dry_run})
+    return 0 if all(result.ok for result in results) else 1
+
+
+def _get_db_handler(args):
+    from db_handler import GenericDBHandler
+
+    return GenericDBHandler(args.db_url)
+
+
+def _report_progress(count):
+    sys.stderr.write(f'\r{count} conversations')
+    sys.stderr.flush()
+
+
+def export(args):
+    db_handler = _get_db_handler(args)
+    start = time.perf_counter()
+    count = db_handler.export_conversations(args.path, thread_id=args.thread, assistant_id=args.assistant,
+                                            user_id=args.user, progress=_report_progress)
+    sys.stderr.write(f'\rexported {count} conversations in {time.perf_counter() - start:.1f}s\n')
+    return 0
+
+
+def import_(args):
+    db_handler = _get_db_handler(args)
+    start = time.perf_counter()
+    count = db_handler.import_conversations(args.path, batch_size=args.batch_size, progress=_report_progress)
+    sys.stderr.write(f'\rimported {count} conversations in {time.perf_counter() - start:.1f}s\n')
+    return 0
+
+
+def usage(args):
+    import datetime
+
+    db_handler = _get_db_handler(args)
+    since = datetime.datetime.fromisoformat(args.since) if args.since else None
+    if args.vector_stores:
+        records = db_handler.get_vector_store_usage(since=since)
+    else:
+        records = db_handler.get_usage_summary(group_by=tuple(args.by.split(',')), since=since)
+    for record in records:
+        _write_jsonl(dict(record))
+    return 0
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog='python -m cli', description='OpenAI Assistant V2 manager without GUI.')
+    parser.add_argument('--api-key', help='OpenAI API key (defaults to OPENAI_API_KEY)')
+    parser.add_argument('--db-url', default='sqlite:///conv.db', help='Database URL for storing conversation data, add ?profile=wal for the tuned SQLite profile')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    p = subparsers.add_parser('chat', help='Send prompts and stream the answers')
+    p.add_argument('prompt', nargs='*', help='Prompt (defaults to one prompt per line from --file or stdin)')
+    p.add_argument('--assistant', required=True, help='ID of the assistant')
+    p.add_argument('--thread', help='ID of an existing thread')
+    p.add_argument('--file', help='File with one prompt per line')
+    p.add_argument('--instructions', default='', help='Additional instructions for the run')
+    p.add_argument('--fresh', action='store_true', help='Use a new thread for every prompt')
+    p.add_argument('--jsonl', action='store_true', help='Write one JSON object per answer instead of streaming text')
+    p.add_argument('--timeout', type=float, help='Maximum number of seconds per run')
+    p.add_argument('--idle-timeout', type=float, help='Maximum number of seconds between two events of a run')
+    p.set_defaults(func=chat)
+
+    p = subparsers.add_parser('compare', help='Send one prompt to several assistants at once')
+    p.add_argument('prompt', nargs='+', help='Prompt')
+    p.add_argument('--assistant', action='append', required=True, help='ID of an assistant, repeated for each one')
+    p.add_argument('--instructions', default='', help='Additional instructions for every run')
+    p.add_argument('--timeout', type=float, help='Maximum number of seconds per run')
+    p.add_argument('--idle-timeout', type=float, help='Maximum number of seconds between two events of a run')
+    p.set_defaults(func=compare)
+
+    p = subparsers.add_parser('upload', help='Upload files to a vector store')
+    p.add_argument('vector_store', help='ID of the vector store')
+    p.add_argument('paths', nargs='+', help='Files to upload')
+    p.set_defaults(func=upload)
+
+    p = subparsers.add_parser('ls', help='List assistants, vector stores or files')
+    p.add_argument('kind', choices=['assistants', 'vector-stores', 'files'])
+    p.add_argument('--assistant', help='Only list the vector stores of this assistant')
+    p.add_argument('--vector-store', help='ID of the vector store (for files)')
+    p.add_argument('--order', default='desc', choices=['asc', 'desc'])
+    p.add_argument('--jsonl', action='store_true', help='Write one JSON object per record')
+    p.set_defaults(func=ls)
+
+    p = subparsers.add_parser('rm', help='Delete assistants, vector stores or files')
+    p.add_argument('kind', choices=['assistant', 'vector-store', 'file'])
+    p.add_argument('ids', nargs='+', help='IDs to delete')
+    p.add_argument('--vector-store', help='Only remove the files from this vector store')
+    p.add_argument('--workers', type=int, default=8, help='Maximum number of concurrent requests')
+    p.add_argument('--dry-run', action='store_true', help='Only print what would be deleted')
+    p.set_defaults(func=rm)
+
+    p = subparsers.add_parser('export', help='Export the conversation history to JSON lines')
+    p.add_argument('path', help='Output file, compressed if it ends with .zst or .gz')
+    p.add_argument('--thread', help='Only export this thread')
+    p.add_argument('--assistant', help='Only export the conversations of this assistant')
+    p.add_argument('--user', help='Only export the conversations of this user (server mode)')
+    p.set_defaults(func=export)
+
+    p = subparsers.add_parser('import', help='Append conversations from an export or an archive segment')
+    p.add_argument('path', help='Input file, compressed if it ends with .zst or .gz')
+    p.add_argument('--batch-size', type=int, default=10000, help='Number of conversations per transaction')
+    p.set_defaults(func=import_)
+
+    p = subparsers.add_parser('usage', help='Sum up the token usage and latency of the stored runs')
+    p.add_argument('--by', default='assistant_id', help='Comma-separated keys to group by: assistant_id, model, day')
+    p.add_argument('--since', help='Only count the runs since this date (YYYY-MM-DD, UTC)')
+    p.add_argument('--vector-stores', action='store_true', help='Largest size of each vector store per day instead')
+    p.set_defaults(func=usage)
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,145 @@
+from PyQt6.QtCore import Qt, QThread, pyqtSignal
+from PyQt6.QtWidgets import QDialog, QVBoxLayout, QHBoxLayout, QSplitter, QWidget, QLabel, QPushButton
+
+from chatBrowser import ChatBrowser, TextEditPrompt
+from run_control import CancelToken
+
+
+class FanOutThread(QThread):
+    chunkGenerated = pyqtSignal(str, str)
+    citationsGenerated = pyqtSignal(str, list)
+    resultGenerated = pyqtSignal(object)
+
+    def __init__(self, wrapper, text, assistant_ids, thread_ids=None, idle_timeout=120):
+        super(FanOutThread, self).__init__()
+        self.__wrapper = wrapper
+        self.__text = text
+        self.__assistant_ids = assistant_ids
+        self.__thread_ids = thread_ids
+        self.__idle_timeout = idle_timeout
+        # Only stops the runs, their idle deadlines are on the token of each run
+        self.__token = CancelToken()
+
+    def run(self):
+        for assistant_id, chunk in self.__wrapper.send_message_to_assistants(self.__text, self.__assistant_ids,
+                                                                             thread_ids=self.__thread_ids,
+                                                                             cancel_token=self.__token,
+                                                                             idle_timeout=self.__idle_timeout,
+                                                                             on_result=self.resultGenerated.emit,
+                                                                             on_citations=self.citationsGenerated.emit):
+            self.chunkGenerated.emit(assistant_id, chunk)
+
+    def stop(self):
+        # Only the runs of this comparison are cancelled, not the one of the main chat
+        self.__token.cancel()
+
+
+class CompareDialog(QDialog):
+    """
+    Sends one prompt to several assistants at once and shows their answers side by side,
+    with the time to the first token and the total time of each.
+    Follow-up prompts go on with the thread of each assistant.
+    """
+
+    def __init__(self, wrapper, assistants, parent=None):
+        super().__init__(parent)
+        self.__initVal(wrapper, assistants)
+        self.__initUi()
+
+    def __initVal(self, wrapper, assistants):
+        self.__wrapper = wrapper
+        self.__assistants = assistants
+        self.__threadIds = {}
+        self.__browsers = {}
+        self.__resultLbls = {}
+        self.__t = None
+
+    def __initUi(self):
+        self.setWindowTitle(f'Compare {len(self.__assistants)} Assistants')
+        self.setWindowFlags(Qt.WindowType.Window | Qt.WindowType.WindowCloseButtonHint)
+
+        splitter = QSplitter()
+        splitter.setHandleWidth(1)
+        splitter.setChildrenCollapsible(False)
+        splitter.setStyleSheet(
+            "QSplitterHandle {background-color: lightgray;}")
+        for assistant in self.__assistants:
+            assistant_id = assistant['assistant_id']
+            nameLbl = QLabel(f'{assistant["name"]} ({assistant["model"]})')
+            nameLbl.setToolTip(assistant_id)
+            self.__browsers[assistant_id] = ChatBrowser()
+            self.__resultLbls[assistant_id] = QLabel()
+
+            lay = QVBoxLayout()
+            lay.addWidget(nameLbl)
+            lay.addWidget(self.__browsers[assistant_id])
+            lay.addWidget(self.__resultLbls[assistant_id])
+            lay.setContentsMargins(0, 0, 0, 0)
+
+            columnWidget = QWidget()
+            columnWidget.setLayout(lay)
+            splitter.addWidget(columnWidget)
+
+        self.__promptEdit = TextEditPrompt()
+        self.__promptEdit.setMaximumHeight(80)
+        self.__promptEdit.returnPressed.connect(self.__run)
+
+        self.__stopBtn = QPushButton('Stop')
+        self.__stopBtn.clicked.connect(self.__stop)
+        self.__stopBtn.setEnabled(False)
+
+        lay = QHBoxLayout()
+        lay.addWidget(self.__promptEdit)
+        lay.addWidget(self.__stopBtn, alignment=Qt.AlignmentFlag.AlignBottom)
+        lay.setContentsMargins(0, 0, 0, 0)
+
+        promptWidget = QWidget()
+        promptWidget.setLayout(lay)
+
+        lay = QVBoxLayout()
+        lay.addWidget(splitter)
+        lay.addWidget(promptWidget)
+
+        self.setLayout(lay)
+        self.resize(400 * len(self.__assistants), 600)
+
+    def __run(self, text):
+        if not text.strip() or (self.__t is not None and self.__t.isRunning()):
+            return
+        self.__promptEdit.clear()
+        for assistant_id, browser in self.__browsers.items():
+            browser.addMessage(self.__wrapper.get_message_obj('user', text))
+            self.__resultLbls[assistant_id].setText('Waiting for the first token...')
+
+        self.__t = FanOutThread(self.__wrapper, text, list(self.__browsers), thread_ids=self.__threadIds)
+        self.__t.chunkGenerated.connect(self.__chunkGenerated)
+        self.__t.citationsGenerated.connect(self.__citationsGenerated)
+        self.__t.resultGenerated.connect(self.__resultGenerated)
+        self.__t.finished.connect(lambda: self.__stopBtn.setEnabled(False))
+        self.__stopBtn.setEnabled(True)
+        self.__t.start()
+
+    def __chunkGenerated(self, assistant_id, chunk):
+        self.__browsers[assistant_id].addChunk(chunk)
+
+    def __citationsGenerated(self, assistant_id, citations):
+        self.__browsers[assistant_id].setCitations(citations)
+
+    def __resultGenerated(self, result):
+        # The thread is kept for the follow-up prompts
+        if result['thread_id']:
+            self.__threadIds[result['assistant_id']] = result['thread_id']
+        ttft = f'{result["ttft_seconds"]:.2f}s' if result['ttft_seconds'] is not None else '-'
+        text = f'First token: {ttft}, total: {result["total_seconds"]:.2f}s, {result["chars"]} chars'
+        if result['error']:
+            text += f' ({result["error"]})'
+        self.__resultLbls[result['assistant_id']].setText(text)
+
+    def __stop(self):
+        self.__t.stop()
+
+    def closeEvent(self, e):
+        if self.__t is not None and self.__t.isRunning():
+            self.__t.stop()
+            self.__t.wait()
+        super().closeEvent(e)
@@ -0,0 +1,26 @@
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Conversation bodies bigger than this (in bytes) are stored compressed
+COMPRESSION_THRESHOLD = 1024
+
+
+def compress_content(content):
+    data = content.encode('utf-8')
+    if zstandard is not None:
+        return zstandard.ZstdCompressor().compress(data), 'zstd'
+    return zlib.compress(data), 'zlib'
+
+
+def decompress_content(data, compression):
+    if compression == 'zstd':
+        if zstandard is None:
+            raise ImportError('zstandard is required to read this conversation (pip install zstandard)')
+        data = zstandard.ZstdDecompressor().decompress(data)
+    elif compression == 'zlib':
+        data = zlib.decompress(data)
+    return data.decode('utf-8')
@@ -1,42 +1,134 @@
-import datetime
+import datetime, os, re, threading
 
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, ForeignKey, ARRAY
+from sqlalchemy import create_engine, event, make_url, Column, Integer, Float, String, DateTime, ForeignKey, ARRAY, Text, \
+    LargeBinary, Index, func, insert, inspect, literal, or_, text
 from sqlalchemy.orm import declarative_base, sessionmaker, relationship
 
+from archive import open_compressed, to_jsonl, from_jsonl
+from compression import COMPRESSION_THRESHOLD, compress_content, decompress_content
+from records import ConversationRecord, AssistantRecord, AttachmentRecord, ArchivedConversationRecord, UsageSummaryRecord, \
+    VectorStoreUsageRecord
+
 Base = declarative_base()
 
+# Pragmas of the 'wal' SQLite profile, each one can be overridden in the database URL
+SQLITE_PROFILE = {
+    # Commits are durable at checkpoints, not at each single-row commit, a crash can't corrupt the database
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    # In KiB when negative
+    'cache_size': -64 * 1024,
+    'busy_timeout': 5000,
+    # Pages in the WAL file before it is checkpointed into the database
+    'wal_autocheckpoint': 1000,
+}
+# Pragmas of the read-only connection
+_READ_PRAGMAS = ('mmap_size', 'cache_size', 'busy_timeout')
+_PRAGMA_VALUE = re.compile(r'-?\d+|[A-Za-z]+')
+
+
+def parse_db_url(db_url):
+    """
+    Splits the SQLite profile options off a database URL.
+
+    sqlite:///conv.db?profile=wal turns on WAL with the pragmas of SQLITE_PROFILE, which can be overridden
+    in the URL too, e.g. sqlite:///conv.db?profile=wal&synchronous=FULL&mmap_size=0.
+    A profile is ignored for an in-memory database.
+
+    :param db_url: Database URL.
+    :return: Tuple of the URL without the profile options and the pragmas of the profile, None without a profile.
+    """
+    url = make_url(db_url)
+    profile = url.query.get('profile')
+    if url.get_backend_name() != 'sqlite' or profile is None:
+        return url, None
+    if profile not in ('default', 'wal'):
+        raise ValueError(f'Unknown database profile: {profile}')
+    pragmas = dict(SQLITE_PROFILE)
+    for name in SQLITE_PROFILE:
+        if name in url.query:
+            pragmas[name] = url.query[name]
+            # Pragma values can't be bound as parameters
+            if not _PRAGMA_VALUE.fullmatch(pragmas[name]):
+                raise ValueError(f'Invalid value of {name}: {pragmas[name]}')
+    url = url.difference_update_query(['profile', *SQLITE_PROFILE])
+    if profile == 'default' or url.database in (None, '', ':memory:'):
+        return url, None
+    return url, pragmas
+
+
+def _set_pragmas(engine, pragmas):
+    # Set on every new connection of the pool
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+    event.listen(engine, 'connect', on_connect)
+
 
 class GenericDBHandler:
     def __init__(self, db_url):
-        self.engine = create_engine(db_url)
+        url, pragmas = parse_db_url(db_url)
+        self.engine = create_engine(url)
+        if pragmas is not None:
+            _set_pragmas(self.engine, {'journal_mode': 'WAL', **pragmas})
         Base.metadata.create_all(self.engine)
         self.Session = sessionmaker(bind=self.engine)
+        # Queries of the UI, e.g. loading a history, go through a read-only connection with the WAL profile,
+        # so they neither wait for nor block the writes of a run being streamed
+        self.ReadSession = self.Session
+        if pragmas is not None:
+            read_url = url.set(database=f'file:{os.path.abspath(url.database)}', query={'mode': 'ro', 'uri': 'true'})
+            self.read_engine = create_engine(read_url)
+            _set_pragmas(self.read_engine, {name: pragmas[name] for name in _READ_PRAGMAS})
+            self.ReadSession = sessionmaker(bind=self.read_engine)
+        self.__thread_pks = {}
+        self.__assistant_pks = {}
+        # Several threads may get or create the same row at once (e.g. in server mode)
+        self.__pk_lock = threading.RLock()
+        self.__migrate()
+
+    def __migrate(self):
+        # Apply the pending migrations in order, each one in its own transaction
+        with self.Session() as session:
+            current_version = session.query(SchemaVersion.version).order_by(SchemaVersion.version.desc()).first()
+            current_version = current_version[0] if current_version else 0
+        for version in sorted(MIGRATIONS):
+            if version <= current_version:
+                continue
+            with self.engine.begin() as connection:
+                MIGRATIONS[version](connection)
+                connection.execute(SchemaVersion.__table__.insert().values(version=version))
+
+    def get_schema_version(self):
+        with self.Session() as session:
+            version = session.query(SchemaVersion.version).order_by(SchemaVersion.version.desc()).first()
+            return version[0] if version else 0
 
     def append(self, table, record):
-        session = self.Session()
-        table_instance = table(**record)
-        session.add(table_instance)
-        session.commit()
-        return table_instance.id
+        # Sessions are closed right away, a file database would otherwise run out of pooled connections
+        with self.Session() as session:
+            table_instance = table(**record)
+            session.add(table_instance)
+            session.commit()
+            return table_instance.id
 
     def update(self, table, record_id, update_fields):
-        session = self.Session()
-        record = session.query(table).get(record_id)
-        for field, value in update_fields.items():
-            setattr(record, field, value)
-        session.commit()
+        with self.Session() as session:
+            record = session.query(table).get(record_id)
+            for field, value in update_fields.items():
+                setattr(record, field, value)
+            session.commit()
 
     def delete(self, table, record_id):
-        # If record_id is None, clear all records
-        if record_id is None:
-            session = self.Session()
-            session.query(table).delete()
-            session.commit()
-            return
-        else:
-            session = self.Session()
-            record = session.query(table).get(record_id)
-            session.delete(record)
+        with self.Session() as session:
+            # If record_id is None, clear all records
+            if record_id is None:
+                session.query(table).delete()
+            else:
+                record = session.query(table).get(record_id)
+                session.delete(record)
             session.commit()
 
     def query_table(self, table, conditions=None):
@@ -47,32 +139,440 @@ class GenericDBHandler:
         results = query.all()
         return results
 
-    def get_conversations(self):
-        conversations = self.query_table(Conversation)
-        return [{'role': conversation.role, 'content': conversation.content}
-        for conversation in conversations]
+    def get_assistant_pk(self, assistant_id):
+        # Get or create the local row of an OpenAI assistant ID
+        if assistant_id is None:
+            return None
+        with self.__pk_lock:
+            if assistant_id in self.__assistant_pks:
+                return self.__assistant_pks[assistant_id]
+            with self.Session() as session:
+                assistant = session.query(Assistant).filter_by(assistant_id=assistant_id).first()
+                if assistant is None:
+                    assistant = Assistant(assistant_id=assistant_id)
+                    session.add(assistant)
+                    session.commit()
+                self.__assistant_pks[assistant_id] = assistant.id
+            return self.__assistant_pks[assistant_id]
+
+    def get_thread_pk(self, thread_id, assistant_id=None):
+        # Get or create the local row of an OpenAI thread ID
+        if thread_id is None:
+            return None
+        with self.__pk_lock:
+            if thread_id in self.__thread_pks:
+                return self.__thread_pks[thread_id]
+            assistant_pk = self.get_assistant_pk(assistant_id)
+            with self.Session() as session:
+                thread = session.query(Thread).filter_by(thread_id=thread_id).first()
+                if thread is None:
+                    thread = Thread(thread_id=thread_id, assistant_id=assistant_pk)
+                    session.add(thread)
+                    session.commit()
+                self.__thread_pks[thread_id] = thread.id
+            return self.__thread_pks[thread_id]
+
+    def __filter_conversations(self, query, thread_id=None, assistant_id=None, user_id=None):
+        # Filter by the indexed foreign keys. An unknown ID matches nothing and gives None, comparing with its
+        # missing key would match the unscoped rows (IS NULL) instead.
+        if user_id is not None:
+            query = query.filter(Conversation.user_id == user_id)
+        if thread_id is not None:
+            thread_pk = query.session.query(Thread.id).filter_by(thread_id=thread_id).scalar()
+            if thread_pk is None:
+                return None
+            query = query.filter(Conversation.thread_id == thread_pk)
+        if assistant_id is not None:
+            assistant_pk = query.session.query(Assistant.id).filter_by(assistant_id=assistant_id).scalar()
+            if assistant_pk is None:
+                return None
+            query = query.filter(Conversation.assistant_id == assistant_pk)
+        return query
+
+    def get_conversations(self, thread_id=None, assistant_id=None, user_id=None):
+        # Only the needed columns are selected, compressed bodies stay compressed until they are read
+        with self.ReadSession() as session:
+            query = session.query(Conversation.role, Conversation._content, Conversation.content_blob,
+                                  Conversation.compression)
+            query = self.__filter_conversations(query, thread_id, assistant_id, user_id)
+            if query is None:
+                return []
+            return [ConversationRecord(role, content, blob, compression)
+                    for role, content, blob, compression in query.order_by(Conversation.id)]
+
+    def delete_conversations(self, thread_id=None, assistant_id=None, user_id=None):
+        # If all are None, clear all conversations
+        with self.Session() as session:
+            query = self.__filter_conversations(session.query(Conversation), thread_id, assistant_id, user_id)
+            if query is None:
+                return
+            query.delete(synchronize_session=False)
+            session.commit()
+
+    def archive_conversations(self, archive, older_than=None, max_rows=None, max_bytes=None, batch_size=1000):
+        """
+        Moves conversations to an archive: the ones older than an age, and the oldest ones beyond the number of rows
+        or the stored size the conversation table is kept within.
+
+        :param archive: ConversationArchive.
+        :param older_than: Optional datetime.timedelta.
+        :param max_rows: Optional maximum number of conversations kept in the table.
+        :param max_bytes: Optional maximum total size of the stored bodies kept in the table.
+        :param batch_size: Number of conversations moved per transaction.
+        :return: Number of archived conversations.
+        """
+        # Everything up to the last ID beyond the budgets is archived, plus the older conversations after it
+        last_id = None
+        with self.Session() as session:
+            if max_rows is not None:
+                last_id = session.query(Conversation.id).order_by(Conversation.id.desc()).offset(max_rows).limit(1).scalar()
+            if max_bytes is not None:
+                size = func.coalesce(func.length(Conversation.content_blob), func.length(Conversation._content), 0)
+                total = 0
+                for conversation_id, row_size in session.query(Conversation.id, size).order_by(Conversation.id.desc()):
+                    total += row_size
+                    if total > max_bytes:
+                        last_id = max(last_id or 0, conversation_id)
+                        break
+        conditions = []
+        if last_id is not None:
+            conditions.append(Conversation.id <= last_id)
+        if older_than is not None:
+            conditions.append(Conversation.timestamp < datetime.datetime.utcnow() - older_than)
+        if not conditions:
+            return 0
+
+        archived = 0
+        after = 0
+        while True:
+            with self.Session() as session:
+                records = self.__get_full_conversations(session, after, batch_size, or_(*conditions))
+                if not records:
+                    return archived
+                # Written before the rows are deleted, an interrupted move is archived twice rather than lost
+                archive.append(records)
+                after = records[-1]['conversation_id']
+                session.query(Conversation) \
+                    .filter(Conversation.id.in_([record['conversation_id'] for record in records])) \
+                    .delete(synchronize_session=False)
+                session.commit()
+            archived += len(records)
+
+    def __get_full_conversations(self, session, after, limit, *conditions):
+        # Walks the primary key from where the previous batch ended, with the OpenAI IDs of the thread and assistant
+        query = session.query(Conversation.id, Conversation.role, Conversation._content, Conversation.content_blob,
+                              Conversation.compression, Thread.thread_id, Assistant.assistant_id, Conversation.run_id,
+                              Conversation.user_id, Conversation.timestamp) \
+            .outerjoin(Thread, Conversation.thread_id == Thread.id) \
+            .outerjoin(Assistant, Conversation.assistant_id == Assistant.id) \
+            .filter(Conversation.id > after, *conditions) \
+            .order_by(Conversation.id).limit(limit)
+        return [ArchivedConversationRecord(
+            conversation_id, role, decompress_content(blob, compression) if blob is not None else content,
+            thread_id, assistant_id, run_id, user_id, timestamp)
+            for conversation_id, role, content, blob, compression, thread_id, assistant_id, run_id, user_id, timestamp
+            in query]
+
+    def export_conversations(self, path, thread_id=None, assistant_id=None, user_id=None, batch_size=1000,
+                             progress=None):
+        """
+        Writes conversations to a JSON lines file in the format of the archive segments, zstd compressed if the name
+        ends with .zst, gzip compressed with .gz. They are read in batches, memory stays the same whatever the size
+        of the history.
+
+        :param path: Path of the file.
+        :param thread_id: Optional ID of the thread.
+        :param assistant_id: Optional ID of the assistant.
+        :param user_id: Optional ID of the user (server mode).
+        :param batch_size: Number of conversations read per query.
+        :param progress: Optional callable, called with the number of conversations written so far after each batch.
+        :return: Number of exported conversations.
+        """
+        exported = 0
+        after = 0
+        with open_compressed(path, 'w') as f:
+            while True:
+                with self.ReadSession() as session:
+                    conditions = []
+                    if thread_id is not None:
+                        conditions.append(Thread.thread_id == thread_id)
+                    if assistant_id is not None:
+                        conditions.append(Assistant.assistant_id == assistant_id)
+                    if user_id is not None:
+                        conditions.append(Conversation.user_id == user_id)
+                    records = self.__get_full_conversations(session, after, batch_size, *conditions)
+                if not records:
+                    return exported
+                f.writelines(to_jsonl(record) for record in records)
+                after = records[-1]['conversation_id']
+                exported += len(records)
+                if progress is not None:
+                    progress(exported)
+
+    def import_conversations(self, path, batch_size=10000, progress=None):
+        """
+        Appends the conversations of a file written by export_conversations, or of an archive segment.
+        They are inserted in batches, one transaction per batch, memory stays the same whatever the size of the file.
+
+        :param path: Path of the file, compressed by its name like in export_conversations.
+        :param batch_size: Number of conversations inserted per transaction.
+        :param progress: Optional callable, called with the number of conversations imported so far after each batch.
+        :return: Number of imported conversations.
+        """
+        imported = 0
+        records = []
+        with open_compressed(path) as f:
+            for line in f:
+                if line.strip():
+                    records.append(from_jsonl(line))
+                if len(records) == batch_size:
+                    imported += self.__insert_conversations(records)
+                    records = []
+                    if progress is not None:
+                        progress(imported)
+        if records:
+            imported += self.__insert_conversations(records)
+            if progress is not None:
+                progress(imported)
+        return imported
+
+    def __insert_conversations(self, records):
+        rows = [{
+            'role': record['role'],
+            **_content_columns(record['content']),
+            'thread_id': self.get_thread_pk(record['thread_id'], record['assistant_id']),
+            'assistant_id': self.get_assistant_pk(record['assistant_id']),
+            'run_id': record['run_id'],
+            'user_id': record['user_id'],
+            'timestamp': record['timestamp'],
+        } for record in records]
+        # Multi-row inserts instead of an ORM object per conversation. Without render_nulls, rows are grouped by
+        # their None values, i.e. by compressed or not, which breaks a batch into single-row inserts.
+        with self.Session() as session:
+            session.execute(insert(Conversation).execution_options(render_nulls=True), rows)
+            session.commit()
+        return len(rows)
 
     def get_assistant(self):
         assistant = self.query_table(Assistant)
-        return [{'name': assistant.name, 'instructions': assistant.instructions, 'tools': assistant.tools, 'model': assistant.model}
+        return [AssistantRecord(name=assistant.name, instructions=assistant.instructions, tools=assistant.tools, model=assistant.model)
         for assistant in assistant]
 
+    def get_cached_response(self, cache_key, max_age=None):
+        with self.Session() as session:
+            entry = session.query(ResponseCache).filter_by(cache_key=cache_key).first()
+            if entry is None:
+                return None
+            now = datetime.datetime.utcnow()
+            if max_age is not None and entry.created_at < now - max_age:
+                session.delete(entry)
+                session.commit()
+                return None
+            entry.last_accessed_at = now
+            content = entry.content
+            session.commit()
+            return content
+
+    def put_cached_response(self, record):
+        with self.Session() as session:
+            session.query(ResponseCache).filter_by(cache_key=record['cache_key']).delete()
+            session.add(ResponseCache(size=len(record['content'].encode('utf-8')), **record))
+            session.commit()
+
+    def evict_cached_responses(self, max_entries=None, max_bytes=None, max_age=None):
+        # Drop expired entries first, then the least recently used ones beyond the count/size budget
+        with self.Session() as session:
+            if max_age is not None:
+                session.query(ResponseCache).filter(
+                    ResponseCache.created_at < datetime.datetime.utcnow() - max_age).delete()
+            if max_entries is not None or max_bytes is not None:
+                total_entries = 0
+                total_bytes = 0
+                expired_ids = []
+                query = session.query(ResponseCache.id, ResponseCache.size).order_by(ResponseCache.last_accessed_at.desc())
+                for entry_id, size in query:
+                    total_entries += 1
+                    total_bytes += size
+                    if (max_entries is not None and total_entries > max_entries) or \
+                            (max_bytes is not None and total_bytes > max_bytes):
+                        expired_ids.append(entry_id)
+                if expired_ids:
+                    session.query(ResponseCache).filter(ResponseCache.id.in_(expired_ids)).delete()
+            session.commit()
+
+    def invalidate_cached_responses(self, assistant_id=None, vector_store_id=None):
+        # If both are None, clear the whole cache
+        with self.Session() as session:
+            query = session.query(ResponseCache)
+            if assistant_id is not None:
+                query = query.filter(ResponseCache.assistant_id == assistant_id)
+            if vector_store_id is not None:
+                # The IDs are stored comma-joined, match whole IDs so vs_1 doesn't also drop the answers of vs_10
+                ids = literal(',') + ResponseCache.vector_store_ids + literal(',')
+                query = query.filter(ids.contains(f',{vector_store_id},', autoescape=True))
+            query.delete(synchronize_session=False)
+            session.commit()
+
+
+    def __form_attachment(self, attachment):
+        return AttachmentRecord(attachment.path, attachment.content_hash, attachment.mtime, attachment.size,
+                                attachment.file_id, attachment.last_used_at)
+
+    def get_attachment(self, path=None, mtime=None, size=None, content_hash=None):
+        # Either by path with an unchanged mtime and size, or by content from any path
+        with self.Session() as session:
+            query = session.query(Attachment)
+            if content_hash is not None:
+                query = query.filter_by(content_hash=content_hash)
+            else:
+                query = query.filter_by(path=path, mtime=mtime, size=size)
+            attachment = query.first()
+            if attachment is None:
+                return None
+            attachment.last_used_at = datetime.datetime.utcnow()
+            record = self.__form_attachment(attachment)
+            session.commit()
+            return record
+
+    def put_attachment(self, record):
+        with self.Session() as session:
+            session.query(Attachment).filter_by(content_hash=record['content_hash']).delete()
+            session.add(Attachment(**{key: value for key, value in record.items() if value is not None}))
+            session.commit()
+
+    def get_stale_attachments(self, max_entries=None, max_bytes=None, max_age=None):
+        # Expired attachments, then the least recently used ones beyond the count/size budget
+        with self.Session() as session:
+            stale = []
+            total_entries = 0
+            total_bytes = 0
+            now = datetime.datetime.utcnow()
+            for attachment in session.query(Attachment).order_by(Attachment.last_used_at.desc()):
+                total_entries += 1
+                total_bytes += attachment.size
+                if (max_age is not None and attachment.last_used_at < now - max_age) or \
+                        (max_entries is not None and total_entries > max_entries) or \
+                        (max_bytes is not None and total_bytes > max_bytes):
+                    stale.append(self.__form_attachment(attachment))
+            return stale
+
+    def delete_attachments(self, content_hashes):
+        with self.Session() as session:
+            session.query(Attachment).filter(Attachment.content_hash.in_(content_hashes)).delete(synchronize_session=False)
+            session.commit()
+
+    def get_usage_summary(self, group_by=('assistant_id',), since=None, until=None):
+        """
+        Sums up the usage of the runs by assistant, model and/or day, the groups using the most tokens first.
+
+        :param group_by: Keys to group by, any of 'assistant_id', 'model' and 'day'.
+        :param since: Optional datetime.datetime (UTC) of the oldest run.
+        :param until: Optional datetime.datetime (UTC) the runs are older than.
+        :return: List of UsageSummaryRecord.
+        """
+        columns = {'assistant_id': RunUsage.assistant_id, 'model': RunUsage.model, 'day': func.date(RunUsage.created_at)}
+        for key in group_by:
+            if key not in columns:
+                raise ValueError(f'Unknown usage key: {key}')
+        keys = [columns[key] for key in group_by]
+        with self.ReadSession() as session:
+            query = session.query(*keys, func.count(RunUsage.id), func.sum(RunUsage.prompt_tokens),
+                                  func.sum(RunUsage.completion_tokens), func.sum(RunUsage.total_tokens),
+                                  func.avg(RunUsage.run_seconds), func.max(RunUsage.run_seconds),
+                                  func.avg(RunUsage.ttft_seconds), func.sum(RunUsage.file_search_calls),
+                                  func.sum(RunUsage.code_interpreter_calls))
+            if since is not None:
+                query = query.filter(RunUsage.created_at >= since)
+            if until is not None:
+                query = query.filter(RunUsage.created_at < until)
+            query = query.group_by(*keys).order_by(func.sum(RunUsage.total_tokens).desc())
+            records = []
+            for row in query:
+                record = UsageSummaryRecord(*[None] * 3, *row[len(keys):])
+                for key, value in zip(group_by, row):
+                    # A date on Postgres, a string on SQLite
+                    record[key] = str(value) if key == 'day' and value is not None else value
+                records.append(record)
+            return records
+
+    def append_vector_store_usage(self, vector_store_id, usage_bytes):
+        self.append(VectorStoreUsage, {'vector_store_id': vector_store_id, 'usage_bytes': usage_bytes})
+
+    def get_vector_store_usage(self, since=None, until=None):
+        """
+        Gets the largest size of each vector store per day, the largest first.
+
+        :param since: Optional datetime.datetime (UTC) of the oldest snapshot.
+        :param until: Optional datetime.datetime (UTC) the snapshots are older than.
+        :return: List of VectorStoreUsageRecord.
+        """
+        day = func.date(VectorStoreUsage.recorded_at)
+        with self.ReadSession() as session:
+            query = session.query(VectorStoreUsage.vector_store_id, day, func.max(VectorStoreUsage.usage_bytes))
+            if since is not None:
+                query = query.filter(VectorStoreUsage.recorded_at >= since)
+            if until is not None:
+                query = query.filter(VectorStoreUsage.recorded_at < until)
+            query = query.group_by(VectorStoreUsage.vector_store_id, day) \
+                .order_by(func.max(VectorStoreUsage.usage_bytes).desc())
+            return [VectorStoreUsageRecord(vector_store_id, str(day_value), usage_bytes)
+                    for vector_store_id, day_value, usage_bytes in query]
+
+
+class SchemaVersion(Base):
+    __tablename__ = 'schema_version'
+
+    version = Column(Integer, primary_key=True)
+    applied_at = Column(DateTime, default=datetime.datetime.utcnow)
+
 
 # Conversation table
 class Conversation(Base):
     __tablename__ = 'conversation'
+    __table_args__ = (
+        Index('ix_conversation_thread_id_id', 'thread_id', 'id'),
+        Index('ix_conversation_assistant_id_id', 'assistant_id', 'id'),
+        Index('ix_conversation_user_id_id', 'user_id', 'id'),
+    )
 
     id = Column(Integer, primary_key=True)
     role = Column(String(500))
-    content = Column(String(5000))
+    # Large bodies go to content_blob, compressed with the codec in compression
+    _content = Column('content', Text)
+    content_blob = Column(LargeBinary)
+    compression = Column(String(10))
+    thread_id = Column(Integer, ForeignKey('thread.id'))
+    assistant_id = Column(Integer, ForeignKey('assistant.id'))
+    run_id = Column(String(500))
+    # User of the server mode, None for the desktop app
+    user_id = Column(String(500))
     timestamp = Column(DateTime, default=datetime.datetime.utcnow)
 
+    @property
+    def content(self):
+        if self.content_blob is not None:
+            return decompress_content(self.content_blob, self.compression)
+        return self._content
+
+    @content.setter
+    def content(self, value):
+        for key, column_value in _content_columns(value).items():
+            setattr(self, key, column_value)
+
+
+def _content_columns(content):
+    # Column values of a body, large bodies are stored compressed
+    if content is not None and len(content.encode('utf-8')) > COMPRESSION_THRESHOLD:
+        content_blob, compression = compress_content(content)
+        return {'_content': None, 'content_blob': content_blob, 'compression': compression}
+    return {'_content': content, 'content_blob': None, 'compression': None}
+
 
 class Assistant(Base):
     __tablename__ = 'assistant'
 
     id = Column(Integer, primary_key=True)
-    assistant_id = Column(String(500))
+    assistant_id = Column(String(500), index=True)
     name = Column(String(500))
     instructions = Column(String(5000))
     tools = Column(String(500))
@@ -86,12 +586,120 @@ class Thread(Base):
     __tablename__ = 'thread'
 
     id = Column(Integer, primary_key=True)
-    thread_id = Column(String(500))
+    thread_id = Column(String(500), index=True)
     name = Column(String(500))
     assistant_id = Column(Integer, ForeignKey('assistant.id'))
 
     assistant = relationship("Assistant", back_populates="threads")
 
+
+class ResponseCache(Base):
+    __tablename__ = 'response_cache'
+
+    id = Column(Integer, primary_key=True)
+    cache_key = Column(String(64), unique=True, index=True)
+    assistant_id = Column(String(500), index=True)
+    vector_store_ids = Column(String(5000))
+    content = Column(Text)
+    size = Column(Integer)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    last_accessed_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+
+
+class Attachment(Base):
+    __tablename__ = 'attachment'
+
+    id = Column(Integer, primary_key=True)
+    path = Column(String(4096), index=True)
+    content_hash = Column(String(64), unique=True, index=True)
+    mtime = Column(Float)
+    size = Column(Integer)
+    file_id = Column(String(500))
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    last_used_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+
+
+# Usage of a run, with its run steps and tool calls summed up
+class RunUsage(Base):
+    __tablename__ = 'run_usage'
+
+    id = Column(Integer, primary_key=True)
+    run_id = Column(String(500), index=True)
+    thread_id = Column(String(500))
+    assistant_id = Column(String(500), index=True)
+    user_id = Column(String(500))
+    model = Column(String(500))
+    status = Column(String(50))
+    prompt_tokens = Column(Integer)
+    completion_tokens = Column(Integer)
+    total_tokens = Column(Integer)
+    # From the timestamps of the run: waiting in the queue, then running
+    queue_seconds = Column(Float)
+    run_seconds = Column(Float)
+    # Measured by the client: until the first text delta and until the end of the stream
+    ttft_seconds = Column(Float)
+    wall_seconds = Column(Float)
+    steps = Column(Integer)
+    step_seconds = Column(Float)
+    file_search_calls = Column(Integer)
+    code_interpreter_calls = Column(Integer)
+    function_calls = Column(Integer)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+
+
+# Size of a vector store when it was retrieved, billed per GB and day
+class VectorStoreUsage(Base):
+    __tablename__ = 'vector_store_usage'
+
+    id = Column(Integer, primary_key=True)
+    vector_store_id = Column(String(500), index=True)
+    usage_bytes = Column(Integer)
+    recorded_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+
+
+def _add_missing_columns(connection, table, columns):
+    existing = {column['name'] for column in inspect(connection).get_columns(table.name)}
+    for name in columns:
+        if name not in existing:
+            column = table.c[name]
+            column_type = column.type.compile(dialect=connection.dialect)
+            connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {name} {column_type}'))
+
+
+def _create_missing_indexes(connection, table, names=None):
+    # Only the named indexes if given, the others may be on columns a later migration adds
+    for index in table.indexes:
+        if names is None or index.name in names:
+            index.create(connection, checkfirst=True)
+
+
+def _migrate_1(connection):
+    # Thread-scoped conversations with compressed large bodies
+    table = Conversation.__table__
+    _add_missing_columns(connection, table, ['content_blob', 'compression', 'thread_id', 'assistant_id', 'run_id'])
+    # content used to be String(5000), SQLite doesn't enforce the declared size
+    if connection.dialect.name == 'postgresql':
+        connection.execute(text('ALTER TABLE conversation ALTER COLUMN content TYPE TEXT'))
+    elif connection.dialect.name in ('mysql', 'mariadb'):
+        connection.execute(text('ALTER TABLE conversation MODIFY content TEXT'))
+    _create_missing_indexes(connection, table, ['ix_conversation_thread_id_id', 'ix_conversation_assistant_id_id'])
+    _create_missing_indexes(connection, Thread.__table__)
+    _create_missing_indexes(connection, Assistant.__table__)
+
+
+def _migrate_2(connection):
+    # Per-user conversations for the server mode
+    table = Conversation.__table__
+    _add_missing_columns(connection, table, ['user_id'])
+    _create_missing_indexes(connection, table, ['ix_conversation_user_id_id'])
+
+
+# Schema migrations by version, applied in order by GenericDBHandler
+MIGRATIONS = {
+    1: _migrate_1,
+    2: _migrate_2,
+}
+
 # # ConversationHandler 인스턴스 생성 및 데이터베이스 연결
 # # sqlite
 # conversation_handler = GenericDBHandler('sqlite:///conv.db')
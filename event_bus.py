@@ -0,0 +1,229 @@
+"""
+Event bus for the events of assistant runs, published by the EventHandler of GPTAssistantV2Wrapper.
+
+The bus is disabled until a sink is added: publishing is then a single check and the stream of a run does no I/O.
+With sinks, publishing only appends the event to a queue. A flush thread hands the queued events to the sinks in
+batches, so a slow sink (a log file, a UI) never holds up the stream.
+
+    wrapper.get_event_bus().add_sink(JsonlSink('events.jsonl.gz'))
+    wrapper.get_event_bus().add_sink(CallbackSink(self.runEvents.emit), kinds=(TOOL_CALL_CREATED, ERROR))
+    wrapper.get_event_bus().add_sink(PrintSink())  # what the EventHandler used to print
+"""
+import json, logging, sys, threading, time
+from collections import deque
+
+from archive import open_compressed
+from records import RunEventRecord
+
+# Kinds of events
+TEXT_CREATED = 'text_created'
+TEXT_DELTA = 'text_delta'
+TOOL_CALL_CREATED = 'tool_call_created'
+TOOL_CALL_DELTA = 'tool_call_delta'
+MESSAGE_DONE = 'message_done'
+CITATIONS = 'citations'
+ERROR = 'error'
+
+_logger = logging.getLogger(__name__)
+
+
+class EventBus:
+    """
+    Queues published events and hands them to the sinks in batches, from a flush thread.
+    """
+
+    def __init__(self, interval=0.1, max_pending=100000):
+        """
+        Initializes the EventBus, disabled until a sink is added.
+
+        :param interval: Seconds between two flushes.
+        :param max_pending: Maximum number of queued events, the oldest ones are dropped beyond it.
+        """
+        self.__interval = interval
+        self.__pending = deque(maxlen=max_pending)
+        self.__sinks = []
+        # Kinds any sink wants, None for every kind
+        self.__kinds = frozenset()
+        self.__lock = threading.Lock()
+        self.__wakeup = threading.Event()
+        self.__thread = None
+        # Its own lock, the one of the sinks is held while they write and publish never waits on it
+        self.__published_lock = threading.Lock()
+        self.__published = 0
+        self.__failed = 0
+
+    def is_enabled(self):
+        return bool(self.__sinks)
+
+    def add_sink(self, sink, kinds=None):
+        """
+        Adds a sink, which enables the bus.
+
+        :param sink: Object with a write(events) method, called with a list of RunEventRecord.
+        :param kinds: Optional kinds of events the sink gets, every kind by default.
+        """
+        with self.__lock:
+            self.__sinks.append((sink, frozenset(kinds) if kinds is not None else None))
+            self.__update_kinds()
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__run, name='EventBus', daemon=True)
+                self.__thread.start()
+
+    def remove_sink(self, sink):
+        """
+        Removes a sink after handing it the events queued so far. The bus is disabled without sinks.
+
+        :param sink: Sink added with add_sink.
+        """
+        self.flush()
+        with self.__lock:
+            self.__sinks = [(other, kinds) for other, kinds in self.__sinks if other is not sink]
+            self.__update_kinds()
+
+    def __update_kinds(self):
+        kinds = set()
+        for _, sink_kinds in self.__sinks:
+            if sink_kinds is None:
+                self.__kinds = None
+                return
+            kinds.update(sink_kinds)
+        self.__kinds = frozenset(kinds)
+
+    def publish(self, kind, **data):
+        """
+        Queues an event if a sink wants it. Never blocks and never does I/O.
+
+        :param kind: Kind of the event, e.g. TEXT_DELTA.
+        :param data: Data of the event.
+        """
+        kinds = self.__kinds
+        if kinds is not None and kind not in kinds:
+            return
+        self.__pending.append(RunEventRecord(kind, time.time(), data))
+        with self.__published_lock:
+            self.__published += 1
+
+    def flush(self):
+        """
+        Hands the queued events to the sinks now.
+        """
+        with self.__lock:
+            events = []
+            while self.__pending:
+                events.append(self.__pending.popleft())
+            if not events:
+                return
+            for sink, kinds in self.__sinks:
+                sink_events = events if kinds is None else [event for event in events if event['kind'] in kinds]
+                if not sink_events:
+                    continue
+                try:
+                    sink.write(sink_events)
+                except Exception as e:
+                    # A failing sink doesn't stop the others, it can't be told on the bus itself
+                    self.__failed += 1
+                    _logger.error('Sink %s failed: %s', type(sink).__name__, e)
+
+    def __run(self):
+        while not self.__wakeup.wait(self.__interval):
+            self.flush()
+
+    def close(self):
+        """
+        Flushes the queued events, stops the flush thread and closes the sinks that can be closed.
+        """
+        self.__wakeup.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+        self.__wakeup.clear()
+        self.flush()
+        with self.__lock:
+            for sink, _ in self.__sinks:
+                if hasattr(sink, 'close'):
+                    sink.close()
+            self.__sinks = []
+            self.__update_kinds()
+
+    def get_metrics(self):
+        with self.__published_lock:
+            published = self.__published
+        return {'published': published, 'pending': len(self.__pending), 'failed_writes': self.__failed}
+
+
+class CallbackSink:
+    """
+    Calls a callable with every batch, e.g. the emit of a Qt signal to hand the events to the UI thread.
+    """
+
+    def __init__(self, callback):
+        self.__callback = callback
+
+    def write(self, events):
+        self.__callback(events)
+
+
+class MetricsSink:
+    """
+    Counts the events by kind and the characters of the text deltas.
+    """
+
+    def __init__(self):
+        self.__counts = {}
+        self.__text_chars = 0
+        self.__lock = threading.Lock()
+
+    def write(self, events):
+        with self.__lock:
+            for event in events:
+                self.__counts[event['kind']] = self.__counts.get(event['kind'], 0) + 1
+                if event['kind'] == TEXT_DELTA:
+                    self.__text_chars += len(event['data']['value'])
+
+    def get_metrics(self):
+        with self.__lock:
+            return {'events': dict(self.__counts), 'text_chars': self.__text_chars}
+
+
+class JsonlSink:
+    """
+    Appends the events to a JSON lines file, compressed if its name ends with .zst or .gz.
+    """
+
+    def __init__(self, path):
+        self.__file = open_compressed(path, 'a')
+
+    def write(self, events):
+        self.__file.writelines(json.dumps(dict(event), default=str, ensure_ascii=False) + '\n' for event in events)
+        self.__file.flush()
+
+    def close(self):
+        self.__file.close()
+
+
+class PrintSink:
+    """
+    Prints the answers and tool calls to a stream, one write per batch.
+    """
+
+    def __init__(self, stream=None):
+        self.__stream = stream if stream is not None else sys.stdout
+
+    def write(self, events):
+        parts = []
+        for event in events:
+            data = event['data']
+            if event['kind'] == TEXT_CREATED:
+                parts.append('\nassistant > ')
+            elif event['kind'] == TEXT_DELTA:
+                parts.append(data['value'])
+            elif event['kind'] == TOOL_CALL_CREATED:
+                parts.append(f'\nassistant > {data["type"]}\n')
+            elif event['kind'] == MESSAGE_DONE:
+                parts.append('\n' + data['text'] + '\n')
+            elif event['kind'] == CITATIONS:
+                parts.append('\n'.join(f'[{citation["index"]}] {citation["filename"]}' for citation in data['citations']) + '\n')
+            elif event['kind'] == ERROR:
+                parts.append(f'\nerror > {data["message"]}\n')
+        self.__stream.write(''.join(parts))
+        self.__stream.flush()
@@ -0,0 +1,433 @@
+import glob, hashlib, json, os, re, shutil, struct, time, unicodedata, zlib
+from array import array
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+
+# Size of the blocks read from plain text files
+TXT_BLOCK_SIZE = 64 * 1024
+# PDFs with more pages are split into page ranges of this size, ingested by several workers
+PDF_PAGES_PER_TASK = 32
+
+_HYPHEN_BREAK = re.compile(r'(\w)-\n(\w)')
+_WHITESPACE = re.compile(r'\s+')
+_RECORD_HEADER = struct.Struct('<I')
+
+
+def iter_txt_pages(path, block_size=TXT_BLOCK_SIZE):
+    """
+    Reads a text file block by block.
+
+    :param path: Path of the text file.
+    :param block_size: Number of characters per block.
+    :yield: Blocks of text.
+    """
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            yield block
+
+
+def _open_pdf(f):
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        raise ImportError('pypdf is required to ingest PDF files (pip install pypdf)')
+    # From the open file: given a path, PdfReader reads the whole file into memory first
+    return PdfReader(f)
+
+
+def count_pdf_pages(path):
+    """
+    Counts the pages of a PDF file without extracting them.
+
+    :param path: Path of the PDF file.
+    :return: Number of pages.
+    """
+    with open(path, 'rb') as f:
+        return len(_open_pdf(f).pages)
+
+
+def iter_pdf_pages(path, start=0, stop=None):
+    """
+    Extracts the text of a PDF file page by page.
+    The file is read as pages are extracted, but the objects of the pages already read stay cached in the
+    reader, so the memory grows with the pages of the range and not only with the current page.
+
+    :param path: Path of the PDF file.
+    :param start: Index of the first page.
+    :param stop: Index after the last page, the end of the file without it.
+    :yield: Text of each page.
+    """
+    with open(path, 'rb') as f:
+        pages = _open_pdf(f).pages
+        for index in range(start, len(pages) if stop is None else min(stop, len(pages))):
+            yield pages[index].extract_text() or ''
+
+
+def iter_pages(path, page_range=None):
+    """
+    Picks the page reader for the file type.
+
+    :param path: Path of the .txt or .pdf file.
+    :param page_range: Optional (start, stop) page indexes of a PDF file.
+    :yield: Pages (PDF) or blocks (text) of the file.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.pdf':
+        return iter_pdf_pages(path, *(page_range or ()))
+    elif ext == '.txt':
+        return iter_txt_pages(path)
+    raise ValueError(f'Unsupported file type: {path}')
+
+
+def normalize_text(text):
+    """
+    Normalizes unicode forms, joins hyphenated line breaks and collapses whitespace.
+
+    :param text: Raw extracted text.
+    :return: Normalized text.
+    """
+    text = unicodedata.normalize('NFKC', text)
+    text = _HYPHEN_BREAK.sub(r'\1\2', text)
+    return _WHITESPACE.sub(' ', text)
+
+
+def iter_chunks(pages, chunk_size=2000, overlap=200):
+    """
+    Splits a stream of pages into overlapping chunks.
+    Only the current page and one chunk are kept in memory.
+
+    :param pages: Iterable of normalized text.
+    :param chunk_size: Maximum number of characters per chunk.
+    :param overlap: Number of characters shared by consecutive chunks.
+    :yield: Chunks of text.
+    """
+    if overlap >= chunk_size:
+        raise ValueError('overlap must be smaller than chunk_size')
+    buffer = ''
+    for page in pages:
+        # Normalized pages have no whitespace left at their ends, the last word of a page would run into the next one
+        if buffer and page and not buffer[-1].isspace() and not page[0].isspace():
+            buffer += ' '
+        buffer += page
+        while len(buffer) >= chunk_size:
+            # Cut at the last space so words are not split between chunks
+            cut = buffer.rfind(' ', overlap + 1, chunk_size)
+            if cut == -1:
+                cut = chunk_size
+            chunk = buffer[:cut].strip()
+            if chunk:
+                yield chunk
+            buffer = buffer[cut - overlap:]
+    buffer = buffer.strip()
+    if buffer:
+        yield buffer
+
+
+class ChunkStore:
+    """
+    Compact on-disk store for chunks.
+
+    Every source file gets a ``.chunks`` file of length-prefixed zlib records,
+    a ``.idx`` file with the offset of each record and an entry in ``manifest.json``.
+    """
+
+    def __init__(self, directory):
+        """
+        Initializes the ChunkStore.
+
+        :param directory: Directory of the store. It is created if it does not exist.
+        """
+        self.__directory = directory
+        self.__manifest_path = os.path.join(directory, 'manifest.json')
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def get_name(path):
+        """
+        Gets the name of the chunk file for the source file.
+
+        :param path: Path of the source file.
+        :return: Name of the chunk file without extension.
+        """
+        digest = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()[:8]
+        return f'{os.path.basename(path)}-{digest}'
+
+    def write(self, name, chunks):
+        """
+        Writes chunks to the store.
+
+        :param name: Name of the chunk file.
+        :param chunks: Iterable of chunks.
+        :return: Number of chunks and number of bytes written.
+        """
+        offsets = array('Q')
+        written = 0
+        with open(os.path.join(self.__directory, f'{name}.chunks'), 'wb') as f:
+            for chunk in chunks:
+                data = zlib.compress(chunk.encode('utf-8'))
+                offsets.append(written)
+                f.write(_RECORD_HEADER.pack(len(data)))
+                f.write(data)
+                written += _RECORD_HEADER.size + len(data)
+        with open(os.path.join(self.__directory, f'{name}.idx'), 'wb') as f:
+            offsets.tofile(f)
+        return len(offsets), written
+
+    def merge(self, name, part_names):
+        """
+        Joins chunk files written in parts, e.g. the page ranges of a PDF, into one chunk file and removes the parts.
+
+        :param name: Name of the chunk file.
+        :param part_names: Names of the part chunk files, in order.
+        :return: Number of chunks and number of bytes written.
+        """
+        offsets = array('Q')
+        written = 0
+        with open(os.path.join(self.__directory, f'{name}.chunks'), 'wb') as out:
+            for part_name in part_names:
+                part_offsets = array('Q')
+                with open(os.path.join(self.__directory, f'{part_name}.idx'), 'rb') as f:
+                    part_offsets.frombytes(f.read())
+                offsets.extend(offset + written for offset in part_offsets)
+                with open(os.path.join(self.__directory, f'{part_name}.chunks'), 'rb') as f:
+                    shutil.copyfileobj(f, out)
+                written = out.tell()
+        with open(os.path.join(self.__directory, f'{name}.idx'), 'wb') as f:
+            offsets.tofile(f)
+        for part_name in part_names:
+            os.remove(os.path.join(self.__directory, f'{part_name}.chunks'))
+            os.remove(os.path.join(self.__directory, f'{part_name}.idx'))
+        return len(offsets), written
+
+    def iter_chunks(self, name):
+        """
+        Reads the chunks of a chunk file in order.
+
+        :param name: Name of the chunk file.
+        :yield: Chunks of text.
+        """
+        with open(os.path.join(self.__directory, f'{name}.chunks'), 'rb') as f:
+            while True:
+                header = f.read(_RECORD_HEADER.size)
+                if not header:
+                    break
+                size, = _RECORD_HEADER.unpack(header)
+                yield zlib.decompress(f.read(size)).decode('utf-8')
+
+    def read_chunk(self, name, index):
+        """
+        Reads a single chunk by its index.
+
+        :param name: Name of the chunk file.
+        :param index: Index of the chunk.
+        :return: Chunk of text.
+        """
+        offsets = array('Q')
+        with open(os.path.join(self.__directory, f'{name}.idx'), 'rb') as f:
+            offsets.frombytes(f.read())
+        with open(os.path.join(self.__directory, f'{name}.chunks'), 'rb') as f:
+            f.seek(offsets[index])
+            size, = _RECORD_HEADER.unpack(f.read(_RECORD_HEADER.size))
+            return zlib.decompress(f.read(size)).decode('utf-8')
+
+    def get_manifest(self):
+        """
+        Gets the manifest of the store.
+
+        :return: Dictionary of source file stats by chunk file name.
+        """
+        if not os.path.exists(self.__manifest_path):
+            return {}
+        with open(self.__manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def update_manifest(self, stats_lst):
+        """
+        Adds the stats of ingested files to the manifest.
+
+        :param stats_lst: List of stats returned by the pipeline.
+        """
+        manifest = self.get_manifest()
+        for stats in stats_lst:
+            manifest[stats['name']] = stats
+        tmp_path = self.__manifest_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self.__manifest_path)
+
+
+def ingest_file(path, store_dir, chunk_size=2000, overlap=200, page_range=None):
+    """
+    Extracts, normalizes, chunks and stores a single file, or a page range of a PDF file.
+    This runs in the worker processes of the pipeline.
+
+    :param path: Path of the source file.
+    :param store_dir: Directory of the chunk store.
+    :param chunk_size: Maximum number of characters per chunk.
+    :param overlap: Number of characters shared by consecutive chunks.
+    :param page_range: Optional (start, stop) page indexes of a PDF file, stored in a part chunk file.
+    :return: Dictionary of stats for the file or the page range.
+    """
+    start = time.perf_counter()
+    page_count = 0
+
+    def normalized_pages():
+        nonlocal page_count
+        for page in iter_pages(path, page_range):
+            page_count += 1
+            yield normalize_text(page)
+
+    store = ChunkStore(store_dir)
+    name = store.get_name(path)
+    if page_range is not None:
+        name = f'{name}.part{page_range[0]}'
+    chunk_count, stored_bytes = store.write(name, iter_chunks(normalized_pages(), chunk_size, overlap))
+    return {
+        'name': name,
+        'path': path,
+        'pages': page_count,
+        'chunks': chunk_count,
+        'bytes': os.path.getsize(path),
+        'stored_bytes': stored_bytes,
+        'seconds': time.perf_counter() - start,
+        'worker': os.getpid(),
+    }
+
+
+class IngestionPipeline:
+    """
+    Ingests .txt and .pdf files into a ChunkStore with a process pool.
+    """
+
+    def __init__(self, store_dir='chunks', chunk_size=2000, overlap=200, max_workers=None,
+                 pdf_pages_per_task=PDF_PAGES_PER_TASK):
+        """
+        Initializes the IngestionPipeline.
+
+        :param store_dir: Directory of the chunk store.
+        :param chunk_size: Maximum number of characters per chunk.
+        :param overlap: Number of characters shared by consecutive chunks.
+        :param max_workers: Number of worker processes. Defaults to the number of CPUs.
+        :param pdf_pages_per_task: Number of pages per page range of the PDFs split between the workers.
+        """
+        self.__store = ChunkStore(store_dir)
+        self.__store_dir = store_dir
+        self.__chunk_size = chunk_size
+        self.__overlap = overlap
+        self.__max_workers = max_workers
+        self.__pdf_pages_per_task = pdf_pages_per_task
+
+    def get_store(self):
+        return self.__store
+
+    def run(self, file_paths):
+        """
+        Ingests files in parallel, large PDFs split into page ranges so they use several workers too.
+        Chunks don't overlap across two page ranges. The manifest is updated as each file is done.
+
+        :param file_paths: List of .txt or .pdf file paths.
+        :yield: Stats of each file as soon as it is done.
+        """
+        # Biggest files first so a large PDF doesn't end up alone at the tail
+        file_paths = sorted(file_paths, key=os.path.getsize, reverse=True)
+        tasks = []
+        # Path -> number of page ranges of the split PDFs
+        range_counts = {}
+        for path in file_paths:
+            if os.path.splitext(path)[1].lower() == '.pdf':
+                page_count = count_pdf_pages(path)
+                if page_count > self.__pdf_pages_per_task:
+                    starts = range(0, page_count, self.__pdf_pages_per_task)
+                    tasks.extend((path, (start, start + self.__pdf_pages_per_task)) for start in starts)
+                    range_counts[path] = len(starts)
+                    continue
+            tasks.append((path, None))
+
+        parts = {}
+        with ProcessPoolExecutor(max_workers=self.__max_workers) as executor:
+            futures = {executor.submit(ingest_file, path, self.__store_dir, self.__chunk_size, self.__overlap,
+                                       page_range): (path, page_range) for path, page_range in tasks}
+            for future in as_completed(futures):
+                stats = future.result()
+                path, page_range = futures[future]
+                if page_range is not None:
+                    parts.setdefault(path, []).append((page_range[0], stats))
+                    if len(parts[path]) < range_counts[path]:
+                        continue
+                    stats = self.__merge_parts(path, [part for _, part in sorted(parts.pop(path))])
+                # Written as each file is done, a crash only loses the files in progress
+                self.__store.update_manifest([stats])
+                yield stats
+
+    def __merge_parts(self, path, part_stats_lst):
+        # Stats of a PDF from the stats of its page ranges, in order
+        name = self.__store.get_name(path)
+        chunk_count, stored_bytes = self.__store.merge(name, [stats['name'] for stats in part_stats_lst])
+        page_count = sum(stats['pages'] for stats in part_stats_lst)
+        for stats in part_stats_lst:
+            # Each range gets its share of the file size, for the MB/sec of its worker
+            stats['bytes'] = stats['bytes'] * stats['pages'] / (page_count or 1)
+            del stats['name']
+        return {
+            'name': name,
+            'path': path,
+            'pages': page_count,
+            'chunks': chunk_count,
+            'bytes': os.path.getsize(path),
+            'stored_bytes': stored_bytes,
+            'seconds': sum(stats['seconds'] for stats in part_stats_lst),
+            'worker': part_stats_lst[0]['worker'],
+            'parts': part_stats_lst,
+        }
+
+    @staticmethod
+    def summarize(stats_lst):
+        """
+        Aggregates file stats per worker process.
+
+        :param stats_lst: List of stats returned by run().
+        :return: Dictionary of pages/sec and MB/sec by worker.
+        """
+        workers = {}
+        for file_stats in stats_lst:
+            # A split PDF counts as a file for each worker that ingested one of its page ranges
+            for stats in file_stats.get('parts', [file_stats]):
+                worker = workers.setdefault(stats['worker'], {'files': 0, 'pages': 0, 'bytes': 0, 'seconds': 0.0})
+                worker['files'] += 1
+                worker['pages'] += stats['pages']
+                worker['bytes'] += stats['bytes']
+                worker['seconds'] += stats['seconds']
+        for worker in workers.values():
+            seconds = worker['seconds'] or 1e-9
+            worker['pages_per_sec'] = worker['pages'] / seconds
+            worker['mb_per_sec'] = worker['bytes'] / (1024 * 1024) / seconds
+        return workers
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Ingest .txt and .pdf files into a local chunk store.')
+    parser.add_argument('paths', nargs='*', help='Files to ingest (defaults to the edgar filings)')
+    parser.add_argument('--store', default='chunks', help='Directory of the chunk store')
+    parser.add_argument('--chunk-size', type=int, default=2000)
+    parser.add_argument('--overlap', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--pages-per-task', type=int, default=PDF_PAGES_PER_TASK,
+                        help='Pages per page range of the PDFs split between the workers')
+    args = parser.parse_args()
+
+    paths = args.paths or sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'edgar', '*')))
+    pipeline = IngestionPipeline(args.store, args.chunk_size, args.overlap, args.workers, args.pages_per_task)
+    start = time.perf_counter()
+    stats_lst = []
+    for stats in pipeline.run(paths):
+        stats_lst.append(stats)
+        print(f"{stats['path']}: {stats['pages']} pages, {stats['chunks']} chunks in {stats['seconds']:.2f}s", flush=True)
+    for worker, summary in IngestionPipeline.summarize(stats_lst).items():
+        print(f"worker {worker}: {summary['files']} files, "
+              f"{summary['pages_per_sec']:.1f} pages/sec, {summary['mb_per_sec']:.2f} MB/sec")
+    print(f'total: {time.perf_counter() - start:.2f}s')
@@ -1,13 +1,19 @@
-import os
+import datetime, os
 
-from PyQt6.QtCore import QSettings, Qt, QThread, pyqtSignal
+from PyQt6.QtCore import QSettings, Qt, QThread, QTimer, pyqtSignal
 from PyQt6.QtGui import QFont, QIcon
 from PyQt6.QtWidgets import QMainWindow, QApplication, QVBoxLayout, QSplitter, QWidget, QLabel, QSizePolicy, \
     QPushButton, QDialog, QMessageBox, QHBoxLayout, QSpacerItem, QFileDialog
 
 from apiWidget import ApiWidget
+from archive import ConversationArchive
 from chatBrowser import ChatBrowser, PromptWidget
+from compareWidget import CompareDialog
 from script import GPTAssistantV2Wrapper
+from run_control import CancelToken, RunCancelled
+from sync_engine import SyncEngine, ASSISTANTS, VECTOR_STORES, FILES
+from prefetcher import Prefetcher
+from event_bus import CallbackSink, TOOL_CALL_CREATED, ERROR
 from tableWidget import TableWidget
 from assistantInputDialog import AssistantInputDialog
 from vectorstoreInputDialog import VectorStoreInputDialog
@@ -17,21 +23,108 @@ QApplication.setFont(QFont('Arial', 12))
 
 class Thread(QThread):
     afterGenerated = pyqtSignal(str)
+    citationsGenerated = pyqtSignal(list)
+    errorGenerated = pyqtSignal(str)
 
-    def __init__(self, wrapper, text):
+    def __init__(self, wrapper, text, message_file=None, idle_timeout=120):
         super(Thread, self).__init__()
         self.__wrapper = wrapper
         self.__text = text
+        self.__message_file = message_file
+        # The run of this thread only, the runs of a CompareDialog go on when it is stopped
+        self.__token = CancelToken(idle_timeout=idle_timeout)
 
     def run(self):
         try:
-            for chunk in self.__wrapper.send_message(self.__text):
+            for chunk in self.__wrapper.send_message(self.__text, message_file=self.__message_file,
+                                                     cancel_token=self.__token,
+                                                     on_citations=self.citationsGenerated.emit):
                 self.afterGenerated.emit(chunk)
+        except RunCancelled as e:
+            self.errorGenerated.emit(str(e))
         except Exception as e:
-            raise Exception(e)
+            # Shown in the window, raising here would only end the thread
+            self.errorGenerated.emit(f'The run failed: {e}')
+
+    def stop(self):
+        self.__token.cancel()
+
+
+class SyncThread(QThread):
+    diffGenerated = pyqtSignal(object)
+
+    def __init__(self, engine):
+        super(SyncThread, self).__init__()
+        self.__engine = engine
+
+    def run(self):
+        self.__engine.run(self.__onResult)
+
+    def __onResult(self, result):
+        # A failed pass is simply retried at the next interval
+        if not isinstance(result, Exception):
+            self.diffGenerated.emit(result)
+
+    def stop(self):
+        self.__engine.stop()
+
+
+class UploadThread(QThread):
+    batchCreated = pyqtSignal(object, list)
+    errorGenerated = pyqtSignal(str)
+
+    def __init__(self, wrapper, vector_store_id, file_paths):
+        super(UploadThread, self).__init__()
+        self.__wrapper = wrapper
+        self.__vector_store_id = vector_store_id
+        self.__file_paths = file_paths
+
+    def run(self):
+        # Only the upload runs here, the indexing is followed by the batch tracker
+        try:
+            files = self.__wrapper.upload_files(self.__file_paths)
+            batch = self.__wrapper.create_file_batch(self.__vector_store_id, [file['file_id'] for file in files])
+            self.batchCreated.emit(batch, files)
+        except Exception as e:
+            self.errorGenerated.emit(str(e))
+
+
+class DeleteThread(QThread):
+    resultsGenerated = pyqtSignal(list)
+    errorGenerated = pyqtSignal(str)
+
+    def __init__(self, delete_fn, ids):
+        super(DeleteThread, self).__init__()
+        self.__delete_fn = delete_fn
+        self.__ids = ids
+
+    def run(self):
+        try:
+            self.resultsGenerated.emit(self.__delete_fn(self.__ids))
+        except Exception as e:
+            self.errorGenerated.emit(str(e))
+
+
+class VectorStoreThread(QThread):
+    vectorStoreGenerated = pyqtSignal(object)
+
+    def __init__(self, wrapper, vector_store_id):
+        super(VectorStoreThread, self).__init__()
+        self.__wrapper = wrapper
+        self.__vector_store_id = vector_store_id
+
+    def run(self):
+        # A failed refresh is simply caught up by the next sync
+        try:
+            self.vectorStoreGenerated.emit(self.__wrapper.get_vector_store(self.__vector_store_id))
+        except Exception:
+            pass
 
 
 class MainWindow(QMainWindow):
+    batchUpdated = pyqtSignal(object)
+    runEventsPublished = pyqtSignal(list)
+
     def __init__(self):
         super(MainWindow, self).__init__()
         self.__initVal()
@@ -42,21 +135,56 @@ class MainWindow(QMainWindow):
         if not self.__settings_ini.contains('API_KEY'):
             self.__settings_ini.setValue('API_KEY', '')
         self.__api_key = self.__settings_ini.value('API_KEY', type=str)
-
-        self.__wrapper = GPTAssistantV2Wrapper(self.__api_key)
-        self.__assistant_list = self.__wrapper.get_assistants()
+        # Background sync of the assistants, vector stores and files
+        if not self.__settings_ini.contains('SYNC_INTERVAL'):
+            self.__settings_ini.setValue('SYNC_INTERVAL', 30)
+        if not self.__settings_ini.contains('SYNC_CALLS_PER_MINUTE'):
+            self.__settings_ini.setValue('SYNC_CALLS_PER_MINUTE', 30)
+        # Vector stores and files of the assistants around the selection are listed ahead of a click
+        if not self.__settings_ini.contains('PREFETCH_CALLS_PER_MINUTE'):
+            self.__settings_ini.setValue('PREFETCH_CALLS_PER_MINUTE', 120)
+        # WAL lets the history be loaded while the answer of a run is being saved
+        if not self.__settings_ini.contains('DB_URL'):
+            self.__settings_ini.setValue('DB_URL', 'sqlite:///conv.db?profile=wal')
+
+        # Conversations older than this are moved to the archive at startup, 0 keeps them in the database
+        if not self.__settings_ini.contains('ARCHIVE_AFTER_DAYS'):
+            self.__settings_ini.setValue('ARCHIVE_AFTER_DAYS', 90)
+
+        self.__wrapper = GPTAssistantV2Wrapper(self.__api_key, db_url=self.__settings_ini.value('DB_URL', type=str))
+        archive_after_days = self.__settings_ini.value('ARCHIVE_AFTER_DAYS', type=int)
+        if archive_after_days > 0:
+            self.__wrapper.enable_archive(ConversationArchive('archive'), older_than=datetime.timedelta(days=archive_after_days))
+        self.__syncEngine = SyncEngine(self.__wrapper,
+                                       interval=self.__settings_ini.value('SYNC_INTERVAL', type=int),
+                                       calls_per_minute=self.__settings_ini.value('SYNC_CALLS_PER_MINUTE', type=int))
+        self.__syncThread = SyncThread(self.__syncEngine)
+        self.__syncThread.diffGenerated.connect(self.__applySyncDiff)
+        self.__prefetcher = Prefetcher(self.__wrapper, calls_per_minute=self.__settings_ini.value('PREFETCH_CALLS_PER_MINUTE', type=int))
+
+        # Indexing progress of the uploaded files, the tracker calls back from its own thread
+        self.__uploadThreads = []
+        self.__refreshThreads = []
+        self.__deleteThreads = []
+        self.__pendingFiles = {}
+        self.batchUpdated.connect(self.__batchUpdated)
+        self.__wrapper.get_batch_tracker().add_callback(self.batchUpdated.emit)
+
+        # Tool calls and errors of the runs go to the status bar, the text comes from the stream itself
+        self.runEventsPublished.connect(self.__runEventsPublished)
+        self.__wrapper.get_event_bus().add_sink(CallbackSink(self.runEventsPublished.emit), kinds=(TOOL_CALL_CREATED, ERROR))
 
     def __initUi(self):
         self.setWindowTitle('PyQt GPT Assistant V2 Example')
 
         columns = ['vector_store_id', 'name', 'created_at', 'file_counts', 'last_activate_at']
-        self.__vectorStoreTableWidget = TableWidget(columns=columns)
+        self.__vectorStoreTableWidget = TableWidget(columns=columns, id_key='vector_store_id')
         self.__vectorStoreTableWidget.selectedRecord.connect(self.__vectorStoreSelected)
         self.__vectorStoreTableWidget.setSortingEnabled(True)
         self.__vectorStoreTableWidget.sortByColumn(2, Qt.SortOrder.DescendingOrder)
 
         columns = ['file_id', 'filename', 'created_at', 'bytes']
-        self.__fileTableWidget = TableWidget(columns=columns)
+        self.__fileTableWidget = TableWidget(columns=columns, id_key='file_id')
         self.__fileTableWidget.setSortingEnabled(True)
         self.__fileTableWidget.sortByColumn(2, Qt.SortOrder.DescendingOrder)
 
@@ -66,25 +194,32 @@ class MainWindow(QMainWindow):
         self.__apiWidget.apiKeyAccepted.connect(self.__api_key_accepted)
 
         columns = ['assistant_id', 'name', 'tools', 'model', 'instructions', 'created_at']
-        self.__assistantTableWidget = TableWidget(columns=columns)
+        self.__assistantTableWidget = TableWidget(columns=columns, id_key='assistant_id')
         self.__assistantTableWidget.setSortingEnabled(True)
         self.__assistantTableWidget.sortByColumn(5, Qt.SortOrder.DescendingOrder)
-        if self.__assistant_list:
-            for obj in self.__assistant_list:
-                self.__assistantTableWidget.addRecord(obj)
+        self.__fetchAssistants()
         self.__assistantTableWidget.selectedRecord.connect(self.__assistantSelected)
+        # Scrolling warms the rows coming into view once it settles
+        self.__prefetchTimer = QTimer(self)
+        self.__prefetchTimer.setSingleShot(True)
+        self.__prefetchTimer.setInterval(200)
+        self.__prefetchTimer.timeout.connect(self.__prefetchAssistants)
+        self.__assistantTableWidget.verticalScrollBar().valueChanged.connect(self.__prefetchTimer.start)
 
         self.__assistantTableWidgetAddBtn = QPushButton('Add')
         self.__assistantTableWidgetDelBtn = QPushButton('Delete')
+        self.__assistantTableWidgetCompareBtn = QPushButton('Compare')
 
         self.__assistantTableWidgetAddBtn.clicked.connect(self.__addAssistant)
         self.__assistantTableWidgetDelBtn.clicked.connect(self.__deleteAssistant)
+        self.__assistantTableWidgetCompareBtn.clicked.connect(self.__compareAssistants)
 
         lay = QHBoxLayout()
         lay.addWidget(QLabel('Assistants'))
         lay.addSpacerItem(QSpacerItem(10, 10, QSizePolicy.Policy.MinimumExpanding))
         lay.addWidget(self.__assistantTableWidgetAddBtn)
         lay.addWidget(self.__assistantTableWidgetDelBtn)
+        lay.addWidget(self.__assistantTableWidgetCompareBtn)
 
         assistantMenuWidget = QWidget()
         assistantMenuWidget.setLayout(lay)
@@ -170,15 +305,33 @@ class MainWindow(QMainWindow):
         clearConvBtn = QPushButton('Clear Conversation')
         clearConvBtn.clicked.connect(self.__clearConversation)
 
+        loadArchivedBtn = QPushButton('Load Archived')
+        loadArchivedBtn.clicked.connect(self.__loadArchived)
+        loadArchivedBtn.setEnabled(self.__wrapper.get_archive() is not None)
+
+        self.__stopBtn = QPushButton('Stop')
+        self.__stopBtn.clicked.connect(self.__stop)
+        self.__stopBtn.setEnabled(False)
+
         self.__chatBrowser = ChatBrowser()
+        self.__chatBrowser.citationClicked.connect(self.__citationClicked)
         self.__promptWidget = PromptWidget()
         self.__promptWidget.sendPrompt.connect(self.__run)
+        self.__promptWidget.fileAttached.connect(lambda path: self.__wrapper.get_attachment_manager().prefetch(path))
 
-        messages = self.__wrapper.get_conversations()
-        self.__chatBrowser.setMessages(messages)
+        # The conversations are loaded per assistant once one is selected
 
-        lay = QVBoxLayout()
+        lay = QHBoxLayout()
         lay.addWidget(clearConvBtn)
+        lay.addWidget(loadArchivedBtn)
+        lay.addWidget(self.__stopBtn)
+        lay.setContentsMargins(0, 0, 0, 0)
+
+        chatMenuWidget = QWidget()
+        chatMenuWidget.setLayout(lay)
+
+        lay = QVBoxLayout()
+        lay.addWidget(chatMenuWidget)
         lay.addWidget(self.__chatBrowser)
         lay.addWidget(self.__promptWidget)
 
@@ -213,7 +366,13 @@ class MainWindow(QMainWindow):
     def __assistantSelected(self, obj):
         self.__currentAssistantLbl.setText(f'Current Assistant: {obj["name"]} ({obj["assistant_id"]})')
         self.__wrapper.set_current_assistant(obj['assistant_id'])
-        vector_stores = self.__wrapper.get_vector_stores(obj['assistant_id'])
+        self.__syncEngine.watch(obj['assistant_id'])
+        self.__prefetcher.select(obj['assistant_id'])
+        self.__prefetchAssistants()
+        # Show the conversations of the selected assistant only
+        self.__chatBrowser.clearMessages()
+        self.__chatBrowser.setMessages(self.__wrapper.get_conversations(assistant_id=obj['assistant_id']))
+        vector_stores = self.__prefetcher.get_vector_stores(obj['assistant_id'])
 
         # vector_store_and_files = self.__wrapper.get_vector_store_and_files(obj['assistant_id'])
         # if len(vector_store_and_files) == 0:
@@ -227,27 +386,64 @@ class MainWindow(QMainWindow):
         #     file_id = file.id
         #     self.__fileListWidget.addItem(file_id)
         self.__vectorStoreTableWidget.clearRecord()
-        for vector_store in vector_stores:
-            self.__vectorStoreTableWidget.addRecord(vector_store)
+        self.__vectorStoreTableWidget.addRecords(vector_stores)
         self.__fileTableWidget.clearRecord()
         self.__toggleVectorStoreBtn()
         self.__toggleFileBtn()
         self.__vectorStoreTableWidget.selectRow(0)
 
     def __vectorStoreSelected(self, obj):
-        files = self.__wrapper.get_vector_store_files(obj['vector_store_id'])
+        self.__syncEngine.watch(self.__getCurrentId(self.__assistantTableWidget, 'assistant_id'), obj['vector_store_id'])
         self.__fileTableWidget.clearRecord()
-        for file in files:
-            self.__fileTableWidget.addRecord(file)
+        self.__fileTableWidget.setFetcher(records for records, _, _ in self.__prefetcher.iter_vector_store_files(obj['vector_store_id']))
         self.__setAiEnabled(self.__wrapper.is_available())
 
+    def __prefetchAssistants(self):
+        # The visible rows and a page of rows above and below them, the neighbours of the selection first
+        # as the next click is most likely one of them
+        if not self.__wrapper.is_available():
+            return
+        rows = self.__assistantTableWidget.getVisibleRows()
+        if rows:
+            page = len(rows)
+            rows = list(range(max(rows[0] - page, 0), min(rows[-1] + page + 1, self.__assistantTableWidget.rowCount())))
+        current = self.__assistantTableWidget.currentRow()
+        if current != -1:
+            rows.sort(key=lambda row: abs(row - current))
+        self.__prefetcher.prefetch([self.__assistantTableWidget.getRecord(row)['assistant_id'] for row in rows if row != current])
+
     def __api_key_accepted(self, api_key, f):
         # Enable AI related features if API key is valid
         self.__setAiEnabled(f)
-        self.__assistant_list = self.__wrapper.get_assistants()
-        if self.__assistant_list:
-            for obj in self.__assistant_list:
-                self.__assistantTableWidget.addRecord(obj)
+        self.__assistantTableWidget.clearRecord()
+        self.__fetchAssistants()
+
+    def __fetchAssistants(self):
+        # Only the first page is listed now, the next ones when the table is scrolled to the bottom
+        if self.__wrapper.is_available():
+            self.__assistantTableWidget.setFetcher(records for records, _, _ in self.__wrapper.iter_assistants())
+            if not self.__syncThread.isRunning():
+                self.__syncThread.start()
+
+    def __getCurrentId(self, tableWidget, id_key):
+        r_idx = tableWidget.currentRow()
+        return tableWidget.getRecord(r_idx)[id_key] if r_idx != -1 else None
+
+    def __applySyncDiff(self, diff):
+        if diff.scope == VECTOR_STORES:
+            self.__prefetcher.invalidate(assistant_id=diff.parent_id)
+        elif diff.scope == FILES:
+            self.__prefetcher.invalidate(vector_store_id=diff.parent_id)
+        # Only the changes of the listings on screen are applied
+        if diff.scope == ASSISTANTS:
+            self.__assistantTableWidget.applyDiff(diff)
+            self.__toggleVectorStoreBtn()
+        elif diff.scope == VECTOR_STORES and diff.parent_id == self.__getCurrentId(self.__assistantTableWidget, 'assistant_id'):
+            self.__vectorStoreTableWidget.applyDiff(diff)
+            self.__toggleFileBtn()
+        elif diff.scope == FILES and diff.parent_id == self.__getCurrentId(self.__vectorStoreTableWidget, 'vector_store_id'):
+            self.__fileTableWidget.applyDiff(diff)
+            self.__setAiEnabled(self.__wrapper.is_available())
 
     def __setAiEnabled(self, f):
         # If Files and Vector Stores are not enabled, disable the AI features
@@ -263,16 +459,49 @@ class MainWindow(QMainWindow):
             self.__assistantTableWidget.addRecord(obj)
             self.__toggleVectorStoreBtn()
 
-    def __deleteAssistant(self):
+    def __deleteRecords(self, tableWidget, id_key, delete_fn, onDeleted=None):
+        # Delete every selected row at once and keep the rows that failed
+        rows = tableWidget.getSelectedRows()
+        if not rows:
+            return
         # Show "Are you sure?" dialog
-        dialog = QMessageBox.information(self, 'Delete', 'Are you sure you want to delete?', QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
+        dialog = QMessageBox.information(self, 'Delete', f'Are you sure you want to delete {len(rows)} item(s)?', QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
         if dialog == QMessageBox.StandardButton.Yes:
-            r_idx = self.__assistantTableWidget.currentRow()
-            self.__wrapper.delete_assistant(self.__assistantTableWidget.getRecord(r_idx)['assistant_id'])
-            self.__assistantTableWidget.deleteRecord(r_idx)
-            self.__toggleVectorStoreBtn()
-        else:
+            ids = [tableWidget.getRecord(r_idx)[id_key] for r_idx in rows]
+            # The requests run in a thread, the window stays responsive during a bulk delete
+            t = DeleteThread(delete_fn, ids)
+            t.resultsGenerated.connect(lambda results: self.__recordsDeleted(tableWidget, id_key, results, onDeleted))
+            t.errorGenerated.connect(lambda msg: QMessageBox.warning(self, 'Delete', msg))
+            t.finished.connect(lambda: self.__deleteThreads.remove(t))
+            self.__deleteThreads.append(t)
+            t.start()
+            self.statusBar().showMessage(f'Deleting {len(ids)} item(s)...')
+
+    def __recordsDeleted(self, tableWidget, id_key, results, onDeleted=None):
+        # The rows are found again by ID, the table may have changed while deleting
+        deleted = {result.item for result in results if result.ok}
+        tableWidget.deleteRecords([r_idx for r_idx in range(tableWidget.rowCount())
+                                   if tableWidget.getRecord(r_idx)[id_key] in deleted])
+        self.statusBar().showMessage(f'Deleted {len(deleted)} item(s)', 3000)
+        if onDeleted is not None:
+            onDeleted()
+        failed = [f'{result.item}: {result.error}' for result in results if not result.ok]
+        if failed:
+            QMessageBox.warning(self, 'Delete', 'Some items could not be deleted.\n\n' + '\n'.join(failed))
+
+    def __deleteAssistant(self):
+        self.__deleteRecords(self.__assistantTableWidget, 'assistant_id', self.__wrapper.delete_assistants,
+                             self.__toggleVectorStoreBtn)
+
+    def __compareAssistants(self):
+        # One prompt to every selected assistant at once, the answers side by side
+        assistants = self.__assistantTableWidget.getSelectedRecords()
+        if len(assistants) < 2:
+            QMessageBox.information(self, 'Compare', 'Select two or more assistants to compare.')
             return
+        dialog = CompareDialog(self.__wrapper, assistants, self)
+        dialog.setAttribute(Qt.WidgetAttribute.WA_DeleteOnClose)
+        dialog.show()
 
     def __addVectorStores(self):
         dialog = VectorStoreInputDialog('Add', self)
@@ -280,39 +509,69 @@ class MainWindow(QMainWindow):
         if reply == QDialog.DialogCode.Accepted:
             obj = dialog.getAttribute()
             obj = self.__wrapper.create_vector_store(obj)
+            self.__prefetcher.invalidate(assistant_id=self.__getCurrentId(self.__assistantTableWidget, 'assistant_id'))
             self.__vectorStoreTableWidget.addRecord(obj)
             self.__toggleFileBtn()
 
     def __deleteVectorStores(self):
-        # Show "Are you sure?" dialog
-        dialog = QMessageBox.information(self, 'Delete', 'Are you sure you want to delete?', QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
-        if dialog == QMessageBox.StandardButton.Yes:
-            r_idx = self.__vectorStoreTableWidget.currentRow()
-            self.__wrapper.delete_vector_store(self.__vectorStoreTableWidget.getRecord(r_idx)['vector_store_id'])
-            self.__vectorStoreTableWidget.deleteRecord(r_idx)
-            self.__toggleFileBtn()
-        else:
-            return
+        self.__deleteRecords(self.__vectorStoreTableWidget, 'vector_store_id', self.__wrapper.delete_vector_stores,
+                             self.__vectorStoresDeleted)
+
+    def __vectorStoresDeleted(self):
+        self.__prefetcher.invalidate(assistant_id=self.__getCurrentId(self.__assistantTableWidget, 'assistant_id'))
+        self.__toggleFileBtn()
 
     def __addFile(self):
         files, _ = QFileDialog.getOpenFileNames(None, "Select Files", "", "Text Files (*.txt);;PDF Files (*.pdf);;")
         if files:
             current_vector_store_id = self.__vectorStoreTableWidget.getRecord(self.__vectorStoreTableWidget.currentRow())['vector_store_id']
-            obj = self.__wrapper.upload_files_to_vector_store(current_vector_store_id, files)
-            self.__vectorStoreTableWidget.addRecord(obj)
-
-    def __deleteFile(self):
-        # Show "Are you sure?" dialog
-        dialog = QMessageBox.information(self, 'Delete', 'Are you sure you want to delete?',
-                                         QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
-        if dialog == QMessageBox.StandardButton.Yes:
-            vector_store_id = self.__vectorStoreTableWidget.getRecord(self.__vectorStoreTableWidget.currentRow())['vector_store_id']
-            r_idx = self.__fileTableWidget.currentRow()
-            file_id = self.__fileTableWidget.getRecord(self.__fileTableWidget.currentRow())['file_id']
-            self.__wrapper.delete_files_from_vector_store(vector_store_id, file_id)
-            self.__fileTableWidget.deleteRecord(r_idx)
+            t = UploadThread(self.__wrapper, current_vector_store_id, files)
+            t.batchCreated.connect(self.__batchCreated)
+            t.errorGenerated.connect(lambda msg: QMessageBox.warning(self, 'Upload', msg))
+            t.finished.connect(lambda: self.__uploadThreads.remove(t))
+            self.__uploadThreads.append(t)
+            t.start()
+            self.statusBar().showMessage(f'Uploading {len(files)} file(s)...')
+
+    def __batchCreated(self, batch, files):
+        self.__pendingFiles[batch['batch_id']] = files
+        self.__wrapper.get_batch_tracker().track(batch)
+        self.__batchUpdated(batch)
+
+    def __runEventsPublished(self, events):
+        # Only the last event of a batch is still worth showing
+        event = events[-1]
+        if event['kind'] == TOOL_CALL_CREATED:
+            self.statusBar().showMessage(f'Assistant is using {event["data"]["type"]}...', 3000)
         else:
+            self.statusBar().showMessage(f'Run error: {event["data"]["message"]}')
+
+    def __batchUpdated(self, batch):
+        self.statusBar().showMessage(f'Indexing {batch["total"]} file(s) in {batch["vector_store_id"]}: '
+                                     f'{batch["completed"]} completed, {batch["failed"]} failed, '
+                                     f'{batch["in_progress"]} in progress')
+        if not batch.is_done() or batch['batch_id'] not in self.__pendingFiles:
             return
+        files = self.__pendingFiles.pop(batch['batch_id'])
+        self.__prefetcher.invalidate(assistant_id=self.__getCurrentId(self.__assistantTableWidget, 'assistant_id'),
+                                     vector_store_id=batch['vector_store_id'])
+        if batch['vector_store_id'] == self.__getCurrentId(self.__vectorStoreTableWidget, 'vector_store_id'):
+            self.__fileTableWidget.addRecords(files)
+            self.__setAiEnabled(self.__wrapper.is_available())
+        # Refresh the file counts of the vector store, without waiting for the API on the UI thread
+        t = VectorStoreThread(self.__wrapper, batch['vector_store_id'])
+        t.vectorStoreGenerated.connect(self.__vectorStoreTableWidget.updateRecord)
+        t.finished.connect(lambda: self.__refreshThreads.remove(t))
+        self.__refreshThreads.append(t)
+        t.start()
+
+    def __deleteFile(self):
+        vector_store_id = self.__vectorStoreTableWidget.getRecord(self.__vectorStoreTableWidget.currentRow())['vector_store_id']
+        assistant_id = self.__getCurrentId(self.__assistantTableWidget, 'assistant_id')
+        self.__deleteRecords(self.__fileTableWidget, 'file_id',
+                             lambda file_ids: self.__wrapper.delete_vector_store_files(vector_store_id, file_ids),
+                             lambda: self.__prefetcher.invalidate(assistant_id=assistant_id,
+                                                                  vector_store_id=vector_store_id))
 
     def __toggleVectorStoreBtn(self):
         f = self.__assistantTableWidget.rowCount() > 0
@@ -328,27 +587,63 @@ class MainWindow(QMainWindow):
         # Add user message
         self.__chatBrowser.addMessage(self.__wrapper.get_message_obj('user', text))
 
-        self.__t = Thread(self.__wrapper, text)
+        self.__t = Thread(self.__wrapper, text, message_file=self.__promptWidget.getAttachment())
         self.__t.started.connect(self.__started)
         self.__t.afterGenerated.connect(self.__afterGenerated)
+        self.__t.citationsGenerated.connect(self.__chatBrowser.setCitations)
+        self.__t.errorGenerated.connect(self.__errorGenerated)
         self.__t.finished.connect(self.__finished)
         self.__t.start()
 
     def __started(self):
-        print('started')
+        self.__stopBtn.setEnabled(True)
+
+    def __stop(self):
+        self.__t.stop()
+
+    def __errorGenerated(self, msg):
+        QMessageBox.warning(self, 'Stopped', msg)
 
     def __afterGenerated(self, chunk):
         # Add assistant message by chunk
         self.__chatBrowser.addChunk(chunk)
 
+    def __citationClicked(self, citation):
+        # Select the cited file if it is in the vector store shown
+        for row in range(self.__fileTableWidget.rowCount()):
+            if self.__fileTableWidget.getRecord(row)['file_id'] == citation['file_id']:
+                self.__fileTableWidget.selectRow(row)
+                break
+        self.statusBar().showMessage(f'[{citation["index"]}] {citation["filename"]} ({citation["file_id"]})')
+
     def __finished(self):
         # Put the feature such as DB thingy here
-        pass
+        self.__stopBtn.setEnabled(False)
 
     def __clearConversation(self):
         self.__chatBrowser.clearMessages()
-        self.__wrapper.clear_messages()
-
+        r_idx = self.__assistantTableWidget.currentRow()
+        if r_idx != -1:
+            self.__wrapper.clear_messages(assistant_id=self.__assistantTableWidget.getRecord(r_idx)['assistant_id'])
+
+    def __loadArchived(self):
+        # The archived history of the assistant is only read on demand, shown before its recent conversations
+        r_idx = self.__assistantTableWidget.currentRow()
+        if r_idx == -1:
+            return
+        assistant_id = self.__assistantTableWidget.getRecord(r_idx)['assistant_id']
+        archived = self.__wrapper.get_archived_conversations(assistant_id=assistant_id)
+        self.__chatBrowser.clearMessages()
+        self.__chatBrowser.setMessages(archived + self.__wrapper.get_conversations(assistant_id=assistant_id))
+        self.statusBar().showMessage(f'{len(archived)} archived messages loaded')
+
+    def closeEvent(self, e):
+        self.__wrapper.get_batch_tracker().stop()
+        self.__wrapper.get_event_bus().close()
+        self.__syncThread.stop()
+        self.__syncThread.wait()
+        self.__prefetcher.stop()
+        super().closeEvent(e)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,116 @@
+import re
+
+# Opening or closing line of a fenced code block
+_FENCE = re.compile(r' {0,3}(`{3,}|~{3,})')
+_LIST_ITEM = re.compile(r' {0,3}([-+*]|\d{1,9}[.)])(\s|$)')
+_ESCAPED = re.compile(r'([\\`*_\[\]])')
+
+
+class MarkdownStream:
+    """
+    Splits Markdown streamed in deltas into finished blocks and the trailing open block.
+
+    A block is finished once a line shows it can't change anymore: a blank line followed by a line that doesn't
+    continue it, the closing line of a code block, or the opening line of the next one. Only complete lines are
+    looked at, so the open block is all a renderer has to parse again when a delta arrives.
+    """
+
+    def __init__(self):
+        self.__finished = []
+        self.__open = ''
+        # Offset in the open block of the first line not scanned yet
+        self.__scanned = 0
+        self.__has_content = False
+        self.__is_list = False
+        self.__blank = False
+        # Fence of the code block being streamed and whether the code block is a block of its own
+        self.__fence = None
+        self.__fence_block = False
+
+    def feed(self, delta):
+        """
+        Adds a delta.
+
+        :param delta: Text of the delta.
+        :return: Text of the blocks finished by the delta, '' if none.
+        """
+        self.__open += delta
+        end = 0
+        while True:
+            newline = self.__open.find('\n', self.__scanned)
+            if newline == -1:
+                break
+            start = self.__scanned
+            self.__scanned = newline + 1
+            boundary = self.__scan_line(self.__open[start:newline], start, newline + 1)
+            if boundary is not None:
+                end = boundary
+        if not end:
+            return ''
+        finished = self.__open[:end]
+        self.__open = self.__open[end:]
+        self.__scanned -= end
+        self.__finished.append(finished)
+        return finished
+
+    def __scan_line(self, line, start, end):
+        # Returns the offset where a block ends, if the line shows one
+        if self.__fence is not None:
+            stripped = line.strip()
+            if stripped.startswith(self.__fence) and stripped == stripped[0] * len(stripped):
+                self.__fence = None
+                if self.__fence_block:
+                    self.__has_content = False
+                    self.__blank = False
+                    return end
+            return None
+
+        if not line.strip():
+            self.__blank = self.__has_content
+            return None
+
+        fence = _FENCE.match(line)
+        continues = line[0] in ' \t' or (self.__is_list and _LIST_ITEM.match(line) is not None)
+        boundary = None
+        if self.__has_content and (fence or self.__blank) and not continues:
+            boundary = start
+            self.__has_content = False
+        if not self.__has_content:
+            self.__is_list = _LIST_ITEM.match(line) is not None
+        if fence:
+            self.__fence = fence.group(1)
+            self.__fence_block = not self.__has_content
+        self.__has_content = True
+        self.__blank = False
+        return boundary
+
+    def get_open_block(self):
+        return self.__open
+
+    def get_text(self):
+        return ''.join(self.__finished) + self.__open
+
+
+def escape_markdown(text):
+    return _ESCAPED.sub(r'\\\1', text)
+
+
+def link_citations(text, citations, href='cite:{index}'):
+    """
+    Replaces the citation markers of an answer with Markdown links and lists the cited files below the answer.
+
+    :param text: Markdown of the answer.
+    :param citations: List of CitationRecord.
+    :param href: Format of the link of a citation, with the index of the citation.
+    :return: Markdown of the answer with its sources.
+    """
+    sources = []
+    for citation in citations:
+        link = f'[\\[{citation["index"]}\\]]({href.format(index=citation["index"])})'
+        if citation['marker']:
+            text = text.replace(citation['marker'], link)
+        sources.append(f'{link} {escape_markdown(citation["filename"] or citation["file_id"] or "")}')
+    if not sources:
+        return text
+    # Hard line breaks, one source per line
+    return text.rstrip() + '\n\n' + '  \n'.join(sources) + '\n'
@@ -0,0 +1,236 @@
+"""
+Prefetcher of the listings shown when an assistant is selected: its vector stores and the first files of its
+newest vector store.
+
+The assistants around the selection, the rest of the visible ones and the recently selected ones are warmed in
+the background, at bulk priority and within a budget of API calls per minute, so selecting one of them is served
+from memory. Listings are kept for a short time only and dropped as soon as they are known to have changed.
+
+    prefetcher = Prefetcher(wrapper)
+    prefetcher.prefetch(['asst_...', 'asst_...'])  # visible assistants, the most important first
+    prefetcher.get_vector_stores('asst_...')
+    for records, _, _ in prefetcher.iter_vector_store_files('vs_...'): ...
+"""
+import logging, threading, time
+from collections import OrderedDict, deque
+
+from scheduler import TokenBucket, BULK
+
+VECTOR_STORES = 'vector_stores'
+FILES = 'files'
+
+_logger = logging.getLogger(__name__)
+
+
+class Prefetcher:
+    """
+    Warms the vector stores of assistants and the first page of files of vector stores in an LRU cache,
+    from its own thread.
+    """
+
+    def __init__(self, wrapper, calls_per_minute=120, max_entries=256, max_age=60, max_recent=8, files_page_size=20):
+        """
+        Initializes the Prefetcher, its thread starts with the first prefetch.
+
+        :param wrapper: GPTAssistantV2Wrapper to list with.
+        :param calls_per_minute: Maximum number of API calls per minute of the prefetches.
+        :param max_entries: Maximum number of cached listings, the least recently used ones are dropped beyond it.
+        :param max_age: Seconds a listing is served from memory.
+        :param max_recent: Number of recently selected assistants kept warm besides the visible ones.
+        :param files_page_size: Number of files of the first page, the next pages are listed on demand.
+        """
+        self.__wrapper = wrapper
+        self.__budget = TokenBucket(calls_per_minute, calls_per_minute / 60)
+        self.__max_entries = max_entries
+        self.__max_age = max_age
+        self.__files_page_size = files_page_size
+        # Listings by (kind, ID), each with the monotonic time it was fetched at
+        self.__cache = OrderedDict()
+        # Keys to prefetch, the first one first
+        self.__queue = deque()
+        self.__recent = deque(maxlen=max_recent)
+        self.__lock = threading.Lock()
+        self.__wakeup = threading.Event()
+        self.__stop = threading.Event()
+        self.__thread = None
+        self.__hits = 0
+        self.__misses = 0
+        self.__prefetched = 0
+
+    def set_calls_per_minute(self, calls_per_minute):
+        with self.__lock:
+            self.__budget = TokenBucket(calls_per_minute, calls_per_minute / 60)
+
+    def select(self, assistant_id):
+        """
+        Marks an assistant as the most recently selected one.
+
+        :param assistant_id: ID of the assistant.
+        """
+        with self.__lock:
+            if assistant_id in self.__recent:
+                self.__recent.remove(assistant_id)
+            self.__recent.appendleft(assistant_id)
+
+    def prefetch(self, assistant_ids):
+        """
+        Replaces what is left to prefetch with the listings of these assistants, then of the recently selected ones.
+
+        :param assistant_ids: IDs of the assistants, the most important first.
+        """
+        with self.__lock:
+            ids = list(dict.fromkeys(list(assistant_ids) + list(self.__recent)))
+            self.__queue = deque((VECTOR_STORES, assistant_id) for assistant_id in ids)
+            if self.__thread is None and not self.__stop.is_set():
+                self.__thread = threading.Thread(target=self.__run, name='Prefetcher', daemon=True)
+                self.__thread.start()
+        self.__wakeup.set()
+
+    def __get(self, key):
+        # Cached value if it is still fresh, the lock must be held
+        entry = self.__cache.get(key)
+        if entry is None:
+            return None
+        fetched_at, value = entry
+        if time.monotonic() - fetched_at > self.__max_age:
+            del self.__cache[key]
+            return None
+        self.__cache.move_to_end(key)
+        return value
+
+    def __put(self, key, value):
+        with self.__lock:
+            self.__cache[key] = (time.monotonic(), value)
+            self.__cache.move_to_end(key)
+            while len(self.__cache) > self.__max_entries:
+                self.__cache.popitem(last=False)
+
+    def get_vector_stores(self, assistant_id):
+        """
+        Gets the vector stores of an assistant, from memory if they were prefetched.
+
+        :param assistant_id: ID of the assistant.
+        :return: List of VectorStoreRecord.
+        """
+        key = (VECTOR_STORES, assistant_id)
+        with self.__lock:
+            records = self.__get(key)
+            if records is not None:
+                self.__hits += 1
+                return list(records)
+            self.__misses += 1
+        records = self.__wrapper.get_vector_stores(assistant_id)
+        self.__put(key, list(records))
+        return records
+
+    def iter_vector_store_files(self, vector_store_id):
+        """
+        Iterates over the files of a vector store page by page, the first page from memory if it was prefetched.
+
+        :param vector_store_id: ID of the vector store.
+        :yield: Tuple of the FileRecord list of the page, the cursor of the next page and whether there are more pages.
+        """
+        key = (FILES, vector_store_id)
+        with self.__lock:
+            page = self.__get(key)
+            if page is not None:
+                self.__hits += 1
+            else:
+                self.__misses += 1
+        if page is None:
+            for i, page in enumerate(self.__wrapper.iter_vector_store_files(vector_store_id)):
+                if i == 0:
+                    self.__put(key, page)
+                yield page
+            return
+        records, after, has_more = page
+        if records:
+            yield list(records), after, has_more
+        if has_more:
+            yield from self.__wrapper.iter_vector_store_files(vector_store_id, after=after)
+
+    def invalidate(self, assistant_id=None, vector_store_id=None):
+        """
+        Drops the listings known to have changed, e.g. after a vector store or a file was added or deleted.
+
+        :param assistant_id: Optional ID of the assistant whose vector stores changed.
+        :param vector_store_id: Optional ID of the vector store whose files changed.
+        """
+        with self.__lock:
+            if assistant_id is not None:
+                self.__cache.pop((VECTOR_STORES, assistant_id), None)
+            if vector_store_id is not None:
+                self.__cache.pop((FILES, vector_store_id), None)
+
+    def __spend(self, calls=1):
+        # Waits for the budget, the stop event cuts the wait short
+        while True:
+            with self.__lock:
+                wait = self.__budget.get_wait(calls)
+                if wait <= 0:
+                    self.__budget.acquire(calls)
+                    return True
+            if self.__stop.wait(wait):
+                return False
+
+    def __charge(self, calls):
+        # Calls made on top of the listing itself, e.g. file details, the next prefetches wait for them
+        if calls > 0:
+            with self.__lock:
+                self.__budget.acquire(calls)
+
+    def __next_key(self):
+        with self.__lock:
+            while self.__queue:
+                key = self.__queue.popleft()
+                if self.__get(key) is None:
+                    return key
+        return None
+
+    def __fetch(self, key):
+        kind, parent_id = key
+        if not self.__spend():
+            return
+        if kind == VECTOR_STORES:
+            records = self.__wrapper.get_vector_stores(parent_id, priority=BULK)
+            self.__charge(len(records))
+            self.__put(key, list(records))
+            if records:
+                # The files table shows the newest vector store first, its files are warmed right after
+                newest = max(records, key=lambda record: record['created_at'])
+                with self.__lock:
+                    self.__queue.appendleft((FILES, newest['vector_store_id']))
+        else:
+            pages = self.__wrapper.iter_vector_store_files(parent_id, page_size=self.__files_page_size, priority=BULK)
+            try:
+                page = next(pages, ([], None, False))
+            finally:
+                pages.close()
+            self.__charge(len(page[0]))
+            self.__put(key, page)
+        self.__prefetched += 1
+
+    def __run(self):
+        while not self.__stop.is_set():
+            self.__wakeup.clear()
+            key = self.__next_key()
+            if key is None:
+                self.__wakeup.wait()
+                continue
+            try:
+                self.__fetch(key)
+            except Exception as e:
+                # A failed prefetch is simply fetched again on demand
+                _logger.error('Prefetch of %s %s failed: %s', *key, e)
+
+    def stop(self):
+        self.__stop.set()
+        self.__wakeup.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+
+    def get_metrics(self):
+        with self.__lock:
+            return {'hits': self.__hits, 'misses': self.__misses, 'prefetched': self.__prefetched,
+                    'cached': len(self.__cache), 'queued': len(self.__queue)}
@@ -0,0 +1,199 @@
+from compression import decompress_content
+
+
+class Record:
+    """
+    Lightweight record with ``__slots__`` instead of a dictionary per instance.
+    It also supports the dictionary access the widgets used to rely on (record['name'], items(), dict(record)).
+    """
+
+    __slots__ = ()
+    # Public fields in column order, also used as the keys of the record
+    _fields = ()
+
+    def __init__(self, *args, **kwargs):
+        for field, value in zip(self._fields, args):
+            setattr(self, field, value)
+        for field in self._fields[len(args):]:
+            setattr(self, field, kwargs.pop(field, None))
+        if kwargs:
+            raise TypeError(f'Unknown fields for {type(self).__name__}: {", ".join(kwargs)}')
+
+    def __getitem__(self, key):
+        if key not in self._fields:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self._fields:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self._fields
+
+    def __eq__(self, other):
+        if not isinstance(other, Record):
+            return NotImplemented
+        return type(self) is type(other) and self.values() == other.values()
+
+    # Unhashable on purpose: records compare by value but are mutable (record['name'] = ...) and hold lists and
+    # dicts, so a hash would change under a set or dict key. Key them by their ID instead
+    __hash__ = None
+
+    def __repr__(self):
+        fields = ', '.join(f'{field}={getattr(self, field)!r}' for field in self._fields)
+        return f'{type(self).__name__}({fields})'
+
+    def get(self, key, default=None):
+        return getattr(self, key, default) if key in self._fields else default
+
+    def keys(self):
+        return self._fields
+
+    def values(self):
+        return [getattr(self, field) for field in self._fields]
+
+    def items(self):
+        return [(field, getattr(self, field)) for field in self._fields]
+
+
+class ConversationRecord(Record):
+    """
+    Conversation message. Compressed bodies are only decoded when content is read.
+    """
+
+    __slots__ = ('role', '_content', '_blob', '_compression')
+    _fields = ('role', 'content')
+
+    def __init__(self, role, content=None, blob=None, compression=None):
+        self.role = role
+        self._content = content
+        self._blob = blob
+        self._compression = compression
+
+    @property
+    def content(self):
+        if self._blob is not None:
+            self._content = decompress_content(self._blob, self._compression)
+            self._blob = None
+            self._compression = None
+        return self._content
+
+    @content.setter
+    def content(self, value):
+        self._content = value
+        self._blob = None
+        self._compression = None
+
+
+class AssistantRecord(Record):
+    __slots__ = ('assistant_id', 'name', 'instructions', 'tools', 'model', 'created_at', 'thread')
+    _fields = __slots__
+
+
+class VectorStoreRecord(Record):
+    __slots__ = ('vector_store_id', 'name', 'created_at', 'file_counts', 'last_activate_at')
+    _fields = __slots__
+
+
+class FileRecord(Record):
+    __slots__ = ('file_id', 'filename', 'bytes', 'created_at')
+    _fields = __slots__
+
+
+class BulkResult(Record):
+    """
+    Outcome of one item of a bulk operation.
+    """
+
+    __slots__ = ('item', 'ok', 'result', 'error')
+    _fields = __slots__
+
+
+class SyncDiff(Record):
+    """
+    Changes of one listing found by the sync engine.
+    The parent is the assistant of a vector store listing or the vector store of a file listing.
+    """
+
+    __slots__ = ('scope', 'parent_id', 'added', 'removed', 'updated')
+    _fields = __slots__
+
+
+class FileBatchRecord(Record):
+    """
+    Indexing status of a file batch of a vector store, with its file counts.
+    """
+
+    __slots__ = ('batch_id', 'vector_store_id', 'status', 'in_progress', 'completed', 'failed', 'cancelled', 'total')
+    _fields = __slots__
+
+    def is_done(self):
+        return self.status in ('completed', 'failed', 'cancelled')
+
+
+class AttachmentRecord(Record):
+    """
+    Local file uploaded as a message attachment, reused while its content doesn't change.
+    """
+
+    __slots__ = ('path', 'content_hash', 'mtime', 'size', 'file_id', 'last_used_at')
+    _fields = __slots__
+
+
+class CitationRecord(Record):
+    """
+    File cited by an answer. The marker is the text of the citation in the answer, e.g. 【4:0†source】.
+    """
+
+    __slots__ = ('index', 'marker', 'file_id', 'filename')
+    _fields = __slots__
+
+
+class ArchivedConversationRecord(Record):
+    """
+    Conversation message moved to the archive, with the OpenAI IDs of its thread and assistant.
+    """
+
+    __slots__ = ('conversation_id', 'role', 'content', 'thread_id', 'assistant_id', 'run_id', 'user_id', 'timestamp')
+    _fields = __slots__
+
+
+class UsageSummaryRecord(Record):
+    """
+    Token usage and latency of the runs of a group, e.g. of an assistant on a day. Keys not grouped by are None.
+    """
+
+    __slots__ = ('assistant_id', 'model', 'day', 'runs', 'prompt_tokens', 'completion_tokens', 'total_tokens',
+                 'avg_run_seconds', 'max_run_seconds', 'avg_ttft_seconds', 'file_search_calls',
+                 'code_interpreter_calls')
+    _fields = __slots__
+
+
+class VectorStoreUsageRecord(Record):
+    """
+    Largest size of a vector store on a day, as reported by the API.
+    """
+
+    __slots__ = ('vector_store_id', 'day', 'usage_bytes')
+    _fields = __slots__
+
+
+class RunEventRecord(Record):
+    """
+    Event of a run published on the event bus, with the time it was published at (seconds since the epoch).
+    """
+
+    __slots__ = ('kind', 'timestamp', 'data')
+    _fields = __slots__
+
+
+class FanOutResultRecord(Record):
+    """
+    Outcome of one run of a message sent to several assistants, timed from the moment the message was sent.
+    error is None for a complete answer.
+    """
+
+    __slots__ = ('assistant_id', 'thread_id', 'ttft_seconds', 'total_seconds', 'chars', 'error')
+    _fields = __slots__
@@ -0,0 +1,108 @@
+import threading, time
+
+
+class RunCancelled(Exception):
+    """
+    Raised when a run is stopped before the assistant finished its answer.
+    """
+
+
+class RunDeadlineExceeded(RunCancelled, TimeoutError):
+    """
+    Raised when a run is stopped by its wall-clock or idle-gap deadline.
+    """
+
+
+class CancelToken:
+    """
+    Cancellation token of a run with optional wall-clock and idle-gap deadlines.
+
+    Callbacks bound to the token are called once, on a background thread, when it is cancelled
+    so the caller (e.g. the UI thread) never waits for the server-side cancel.
+    """
+
+    def __init__(self, timeout=None, idle_timeout=None):
+        """
+        Initializes the CancelToken.
+
+        :param timeout: Maximum number of seconds for the whole run.
+        :param idle_timeout: Maximum number of seconds without any event from the run.
+        """
+        self.__timeout = timeout
+        self.__idle_timeout = idle_timeout
+        self.__event = threading.Event()
+        # Wakes the deadline watcher up when the token is cancelled or closed
+        self.__stop = threading.Event()
+        self.__lock = threading.Lock()
+        self.__callbacks = []
+        self.__reason = None
+        self.__started_at = time.monotonic()
+        self.__last_activity_at = self.__started_at
+        if timeout is not None or idle_timeout is not None:
+            threading.Thread(target=self.__watch, daemon=True).start()
+
+    def __watch(self):
+        # Wake up at the nearest deadline until the token is cancelled or closed
+        while not self.__stop.is_set():
+            now = time.monotonic()
+            remaining = []
+            if self.__timeout is not None:
+                remaining.append((self.__started_at + self.__timeout - now, 'timeout'))
+            if self.__idle_timeout is not None:
+                remaining.append((self.__last_activity_at + self.__idle_timeout - now, 'idle timeout'))
+            wait, reason = min(remaining)
+            if wait <= 0:
+                self.cancel(reason)
+                return
+            self.__stop.wait(wait)
+
+    def touch(self):
+        """
+        Records activity of the run, which pushes back the idle-gap deadline.
+        """
+        self.__last_activity_at = time.monotonic()
+
+    def cancel(self, reason='cancelled'):
+        """
+        Cancels the run and calls the bound callbacks.
+
+        :param reason: Reason of the cancellation.
+        """
+        with self.__lock:
+            if self.__event.is_set():
+                return
+            self.__reason = reason
+            self.__event.set()
+            self.__stop.set()
+            callbacks, self.__callbacks = self.__callbacks, []
+        for callback in callbacks:
+            threading.Thread(target=callback, daemon=True).start()
+
+    def bind(self, callback):
+        """
+        Binds a callback called when the token is cancelled. It is called right away if it already is.
+
+        :param callback: Callable without arguments.
+        """
+        with self.__lock:
+            if not self.__event.is_set():
+                self.__callbacks.append(callback)
+                return
+        threading.Thread(target=callback, daemon=True).start()
+
+    def close(self):
+        """
+        Stops the deadline watcher and drops the callbacks once the run is over.
+        """
+        with self.__lock:
+            self.__stop.set()
+            self.__callbacks = []
+
+    def is_cancelled(self):
+        return self.__event.is_set()
+
+    def get_reason(self):
+        return self.__reason
+
+    def is_deadline_exceeded(self):
+        return self.__reason in ('timeout', 'idle timeout')
@@ -0,0 +1,195 @@
+"""
+Recording and replay of assistant run event streams.
+
+A RunRecorder given to the wrapper (set_run_recorder) appends every run to a gzip file, one JSON line per run
+with the raw events and their offsets from the start of the run. A ReplayClient given to the wrapper
+(set_client) plays those runs back through send_message, the EventHandler and whatever consumes the answer,
+at the recorded speed, faster, or as fast as possible.
+
+    wrapper.set_run_recorder(RunRecorder('runs.jsonl.gz'))
+    ...
+    wrapper = GPTAssistantV2Wrapper(db_url='sqlite:///replay.db')  # a file, sqlite:// is not shared between threads
+    wrapper.set_client(ReplayClient('runs.jsonl.gz', speed=None))
+    for chunk in wrapper.send_message('replayed', assistant_id='asst_replay', thread_id='thread_replay'):
+        ...
+"""
+import gzip, json, threading, time, types
+
+from openai._models import construct_type
+from openai.lib.streaming import AssistantStreamManager
+from openai.types.beta import AssistantStreamEvent
+
+
+class RunRecorder:
+    """
+    Appends recorded runs to a gzip JSON lines file. Runs are written whole, so concurrent runs don't interleave.
+    """
+
+    def __init__(self, path):
+        self.__path = path
+        self.__lock = threading.Lock()
+
+    def get_path(self):
+        return self.__path
+
+    def write_run(self, events):
+        """
+        Appends a run.
+
+        :param events: List of [seconds since the start of the run, event name, event data].
+        """
+        line = json.dumps(events, separators=(',', ':'), ensure_ascii=False) + '\n'
+        with self.__lock, gzip.open(self.__path, 'at', encoding='utf-8') as f:
+            f.write(line)
+
+
+class RunCapture:
+    """
+    Collects the raw events of one run for a RunRecorder. Used by the EventHandler.
+    """
+
+    def __init__(self, recorder):
+        self.__recorder = recorder
+        self.__events = []
+        self.__started_at = None
+
+    def capture(self, event):
+        # Dumped right away, the SDK keeps updating the message snapshot of thread.message.created
+        now = time.perf_counter()
+        if self.__started_at is None:
+            self.__started_at = now
+        self.__events.append([round(now - self.__started_at, 6), event.event,
+                              event.data.model_dump(mode='json', exclude_unset=True)])
+
+    def close(self):
+        if self.__events:
+            self.__recorder.write_run(self.__events)
+            self.__events = []
+
+
+def load_runs(path):
+    """
+    Loads the recorded runs of a file.
+
+    :param path: Path of a file written by RunRecorder.
+    :return: List of runs, each a list of [seconds, event name, event data].
+    """
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class ReplayStream:
+    """
+    Iterable of the events of a recorded run, in place of the HTTP event stream of the SDK.
+    """
+
+    def __init__(self, events, speed=1.0):
+        """
+        Initializes the ReplayStream.
+
+        :param events: Recorded events of the run.
+        :param speed: 1 for the recorded timing, 10 for ten times faster, None for no waits at all.
+        """
+        self.__events = events
+        self.__speed = speed
+        self.__closed = threading.Event()
+
+    def __iter__(self):
+        start = time.perf_counter()
+        for offset, name, data in self.__events:
+            if self.__closed.is_set():
+                return
+            if self.__speed:
+                wait = offset / self.__speed - (time.perf_counter() - start)
+                if wait > 0 and self.__closed.wait(wait):
+                    return
+            yield construct_type(type_=AssistantStreamEvent, value={'event': name, 'data': data})
+
+    def close(self):
+        self.__closed.set()
+
+
+class ReplayClient:
+    """
+    Stand-in for the OpenAI client with just what send_message needs. Every run streamed replays the next
+    recorded run, starting over after the last one. Nothing is sent anywhere.
+    """
+
+    def __init__(self, runs, speed=1.0):
+        """
+        Initializes the ReplayClient.
+
+        :param runs: Path of a file written by RunRecorder, or a list of runs.
+        :param speed: 1 for the recorded timing, 10 for ten times faster, None for no waits at all.
+        """
+        self.__runs = load_runs(runs) if isinstance(runs, str) else runs
+        if not self.__runs:
+            raise ValueError('No recorded runs to replay')
+        self.__speed = speed
+        self.__lock = threading.Lock()
+        self.__next_run = 0
+        self.__next_id = 0
+
+        runs_ns = types.SimpleNamespace(stream=self.__stream, cancel=lambda **kwargs: None)
+        messages_ns = types.SimpleNamespace(create=lambda **kwargs: types.SimpleNamespace(id=self.__new_id('msg')))
+        threads_ns = types.SimpleNamespace(runs=runs_ns, messages=messages_ns,
+                                           create=lambda **kwargs: types.SimpleNamespace(id=self.__new_id('thread')))
+        self.beta = types.SimpleNamespace(threads=threads_ns)
+        # Citations are shown with the file ID as the file name
+        self.files = types.SimpleNamespace(retrieve=lambda file_id, **kwargs: types.SimpleNamespace(id=file_id, filename=file_id))
+
+    def __new_id(self, prefix):
+        with self.__lock:
+            self.__next_id += 1
+            return f'{prefix}_replay_{self.__next_id}'
+
+    def __stream(self, event_handler, **kwargs):
+        with self.__lock:
+            events = self.__runs[self.__next_run % len(self.__runs)]
+            self.__next_run += 1
+        return AssistantStreamManager(lambda: ReplayStream(events, self.__speed), event_handler=event_handler)
+
+
+def synthesize_run(text, chunk_size=4, interval=0.02, citations=0):
+    """
+    Builds a run shaped like a recorded one, for benchmarks without any recording.
+
+    :param text: Answer of the run.
+    :param chunk_size: Number of characters per text delta.
+    :param interval: Seconds between two text deltas.
+    :param citations: Number of file citations in the completed message.
+    :return: List of [seconds, event name, event data].
+    """
+    now = int(time.time())
+    run = {'id': 'run_synthetic', 'object': 'thread.run', 'status': 'in_progress', 'thread_id': 'thread_synthetic',
+           'assistant_id': 'asst_synthetic', 'model': 'gpt-4o', 'created_at': now, 'started_at': now}
+    # The file search step before the answer
+    step = {'id': 'step_synthetic', 'object': 'thread.run.step', 'type': 'tool_calls', 'status': 'in_progress',
+            'run_id': run['id'], 'thread_id': run['thread_id'], 'assistant_id': run['assistant_id'], 'created_at': now,
+            'step_details': {'type': 'tool_calls',
+                             'tool_calls': [{'id': 'call_synthetic', 'type': 'file_search', 'file_search': {}}]}}
+    message = {'id': 'msg_synthetic', 'object': 'thread.message', 'role': 'assistant', 'status': 'in_progress',
+               'run_id': run['id'], 'thread_id': run['thread_id'], 'content': []}
+    events = [[0.0, 'thread.run.created', run], [0.0, 'thread.run.step.created', step],
+              [0.0, 'thread.run.step.completed', {**step, 'status': 'completed', 'completed_at': now}],
+              [0.0, 'thread.message.created', message]]
+    offset = 0.0
+    for i in range(0, len(text), chunk_size):
+        offset += interval
+        events.append([round(offset, 6), 'thread.message.delta', {
+            'id': message['id'], 'object': 'thread.message.delta',
+            'delta': {'content': [{'index': 0, 'type': 'text', 'text': {'value': text[i:i + chunk_size]}}]},
+        }])
+    annotations = [{'type': 'file_citation', 'text': f'【{i}†source】', 'start_index': 0, 'end_index': 0,
+                    'file_citation': {'file_id': f'file_synthetic_{i}'}} for i in range(citations)]
+    value = text + ''.join(annotation['text'] for annotation in annotations)
+    events.append([round(offset, 6), 'thread.message.completed', {
+        **message, 'status': 'completed',
+        'content': [{'type': 'text', 'text': {'value': value, 'annotations': annotations}}],
+    }])
+    completion_tokens = len(text) // 4
+    events.append([round(offset, 6), 'thread.run.completed', {
+        **run, 'status': 'completed', 'completed_at': now + int(offset),
+        'usage': {'prompt_tokens': 1000, 'completion_tokens': completion_tokens, 'total_tokens': 1000 + completion_tokens},
+    }])
+    return events
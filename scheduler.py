@@ -0,0 +1,267 @@
+import random, re, threading, time
+from collections import deque
+
+import openai
+
+# Priority classes, a lower value is served first
+INTERACTIVE = 0
+METADATA = 1
+BULK = 2
+
+PRIORITY_NAMES = {
+    INTERACTIVE: 'interactive',
+    METADATA: 'metadata',
+    BULK: 'bulk',
+}
+
+_DURATION_PART = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+_DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+
+def parse_reset_duration(value):
+    """
+    Parses a rate-limit reset duration such as '1s', '6m0s' or '20ms'.
+
+    :param value: Header value.
+    :return: Number of seconds, or None if it can't be parsed.
+    """
+    if not value:
+        return None
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously, corrected by the remaining budget reported by the server.
+    """
+
+    def __init__(self, capacity=None, refill_per_sec=None):
+        """
+        Initializes the TokenBucket. Without capacity the bucket never runs out.
+
+        :param capacity: Maximum number of tokens.
+        :param refill_per_sec: Number of tokens added per second.
+        """
+        self.capacity = capacity
+        self.refill_per_sec = refill_per_sec
+        self.tokens = capacity
+        self.__updated_at = time.monotonic()
+
+    def __refill(self):
+        now = time.monotonic()
+        if self.capacity is not None and self.refill_per_sec:
+            self.tokens = min(self.capacity, self.tokens + (now - self.__updated_at) * self.refill_per_sec)
+        self.__updated_at = now
+
+    def update(self, limit, remaining, reset_seconds):
+        """
+        Updates the bucket from the rate-limit headers of a response.
+
+        :param limit: Limit of the window.
+        :param remaining: Remaining budget in the window.
+        :param reset_seconds: Seconds until the budget is fully restored.
+        """
+        self.__refill()
+        self.capacity = limit
+        if reset_seconds:
+            self.refill_per_sec = max(limit - remaining, 1) / reset_seconds
+        elif self.refill_per_sec is None:
+            self.refill_per_sec = limit / 60
+        self.tokens = remaining if self.tokens is None else min(self.tokens, remaining)
+
+    def get_wait(self, amount=1):
+        """
+        Gets the time until the bucket has enough tokens.
+
+        :param amount: Number of tokens.
+        :return: Number of seconds to wait, 0 if the tokens are available.
+        """
+        if self.capacity is None or amount <= 0:
+            return 0
+        self.__refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0
+        if not self.refill_per_sec:
+            return 1
+        return (amount - self.tokens) / self.refill_per_sec
+
+    def acquire(self, amount=1):
+        """
+        Takes tokens from the bucket. Call get_wait() first.
+
+        :param amount: Number of tokens.
+        """
+        if self.capacity is not None and amount > 0:
+            self.tokens -= min(amount, self.capacity)
+
+
+class RequestScheduler:
+    """
+    Central scheduler of the API requests of the wrappers.
+
+    Requests wait for a concurrency slot and for the request/token buckets fed by the x-ratelimit-* headers.
+    Higher priority classes are always served first. Failed requests are retried with jittered exponential backoff.
+    """
+
+    def __init__(self, max_concurrency=8, max_retries=5, base_delay=0.5, max_delay=30):
+        """
+        Initializes the RequestScheduler.
+
+        :param max_concurrency: Maximum number of requests in flight.
+        :param max_retries: Maximum number of retries of a request.
+        :param base_delay: Delay of the first retry in seconds.
+        :param max_delay: Maximum delay between retries in seconds.
+        """
+        self.__max_concurrency = max_concurrency
+        self.__max_retries = max_retries
+        self.__base_delay = base_delay
+        self.__max_delay = max_delay
+
+        self.__condition = threading.Condition()
+        self.__in_flight = 0
+        self.__waiting = {priority: 0 for priority in PRIORITY_NAMES}
+        self.__paused_until = 0
+        self.__request_bucket = TokenBucket()
+        self.__token_bucket = TokenBucket()
+
+        self.__wait_times = {priority: deque(maxlen=1000) for priority in PRIORITY_NAMES}
+        self.__counts = {priority: 0 for priority in PRIORITY_NAMES}
+        self.__retries = 0
+        self.__rate_limited = 0
+
+    def observe_response(self, response):
+        """
+        Feeds the buckets with the rate-limit headers of a response. It is registered as an httpx response hook.
+
+        :param response: httpx response.
+        """
+        headers = response.headers
+        with self.__condition:
+            for bucket, kind in ((self.__request_bucket, 'requests'), (self.__token_bucket, 'tokens')):
+                limit = headers.get(f'x-ratelimit-limit-{kind}')
+                remaining = headers.get(f'x-ratelimit-remaining-{kind}')
+                if limit is None or remaining is None:
+                    continue
+                try:
+                    bucket.update(int(limit), int(remaining), parse_reset_duration(headers.get(f'x-ratelimit-reset-{kind}')))
+                except ValueError:
+                    continue
+            self.__condition.notify_all()
+
+    def __can_start(self, priority):
+        if self.__in_flight >= self.__max_concurrency:
+            return False
+        return all(self.__waiting[p] == 0 for p in PRIORITY_NAMES if p < priority)
+
+    def __acquire(self, priority, cost_tokens):
+        start = time.monotonic()
+        with self.__condition:
+            self.__waiting[priority] += 1
+            try:
+                while True:
+                    wait = self.__paused_until - time.monotonic()
+                    if wait <= 0 and self.__can_start(priority):
+                        wait = max(self.__request_bucket.get_wait(1), self.__token_bucket.get_wait(cost_tokens))
+                        if wait <= 0:
+                            self.__request_bucket.acquire(1)
+                            self.__token_bucket.acquire(cost_tokens)
+                            break
+                    self.__condition.wait(timeout=wait if wait > 0 else None)
+                self.__in_flight += 1
+            finally:
+                self.__waiting[priority] -= 1
+                # Lower priorities may be able to start now
+                self.__condition.notify_all()
+            self.__wait_times[priority].append(time.monotonic() - start)
+            self.__counts[priority] += 1
+
+    def __release(self):
+        with self.__condition:
+            self.__in_flight -= 1
+            self.__condition.notify_all()
+
+    def __get_retry_delay(self, error, attempt):
+        delay = None
+        response = getattr(error, 'response', None)
+        if response is not None:
+            retry_after_ms = response.headers.get('retry-after-ms')
+            retry_after = response.headers.get('retry-after')
+            if retry_after_ms:
+                delay = float(retry_after_ms) / 1000
+            elif retry_after:
+                delay = parse_reset_duration(retry_after)
+        if delay is None:
+            delay = min(self.__max_delay, self.__base_delay * 2 ** attempt)
+        # Full jitter so concurrent callers don't retry in lockstep
+        return random.uniform(delay / 2, delay)
+
+    @staticmethod
+    def __is_retryable(error):
+        if isinstance(error, openai.APIConnectionError):
+            return True
+        if isinstance(error, openai.APIStatusError):
+            return error.status_code in (408, 409, 429) or error.status_code >= 500
+        return False
+
+    def call(self, priority, fn, *args, cost_tokens=0, **kwargs):
+        """
+        Calls an API function when its priority class is allowed to, and retries it on failure.
+
+        :param priority: INTERACTIVE, METADATA or BULK.
+        :param fn: API function.
+        :param cost_tokens: Estimated number of tokens used by the request.
+        :return: Result of the API function.
+        """
+        attempt = 0
+        while True:
+            self.__acquire(priority, cost_tokens)
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                if attempt >= self.__max_retries or not self.__is_retryable(e):
+                    raise
+                delay = self.__get_retry_delay(e, attempt)
+                with self.__condition:
+                    self.__retries += 1
+                    if isinstance(e, openai.RateLimitError):
+                        # Pause every priority class, the whole organization is over its limit
+                        self.__rate_limited += 1
+                        self.__paused_until = max(self.__paused_until, time.monotonic() + delay)
+            finally:
+                self.__release()
+            time.sleep(delay)
+            attempt += 1
+
+    def get_metrics(self):
+        """
+        Gets the queue depth and wait-time metrics of the scheduler.
+
+        :return: Dictionary of metrics.
+        """
+        with self.__condition:
+            metrics = {
+                'in_flight': self.__in_flight,
+                'retries': self.__retries,
+                'rate_limited': self.__rate_limited,
+                'paused_for': max(0, self.__paused_until - time.monotonic()),
+                'requests_remaining': self.__request_bucket.tokens,
+                'tokens_remaining': self.__token_bucket.tokens,
+                'priorities': {},
+            }
+            for priority, name in PRIORITY_NAMES.items():
+                wait_times = sorted(self.__wait_times[priority])
+                metrics['priorities'][name] = {
+                    'queue_depth': self.__waiting[priority],
+                    'requests': self.__counts[priority],
+                    'wait_p50': wait_times[len(wait_times) // 2] if wait_times else 0,
+                    'wait_p95': wait_times[int(len(wait_times) * 0.95)] if wait_times else 0,
+                    'wait_max': wait_times[-1] if wait_times else 0,
+                }
+            return metrics
@@ -1,8 +1,20 @@
-import os, requests, datetime
-
-from openai import OpenAI, AssistantEventHandler
-
-from db_handler import GenericDBHandler, Conversation
+import os, re, json, hashlib, datetime, queue, threading, time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from openai import OpenAI, AssistantEventHandler, DefaultHttpxClient
+
+from db_handler import GenericDBHandler, Conversation, RunUsage
+from records import ConversationRecord, AssistantRecord, VectorStoreRecord, FileRecord, FileBatchRecord, BulkResult, \
+    CitationRecord, FanOutResultRecord
+from token_counter import TokenCounter
+from run_control import CancelToken, RunDeadlineExceeded
+from scheduler import RequestScheduler, INTERACTIVE, METADATA, BULK
+from batch_tracker import BatchTracker
+from attachment_manager import AttachmentManager
+from run_recorder import RunCapture
+from event_bus import EventBus, TEXT_CREATED, TEXT_DELTA, TOOL_CALL_CREATED, TOOL_CALL_DELTA, MESSAGE_DONE, \
+    CITATIONS, ERROR
 
 def timestamp_to_datetime(timestamp):
     return datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
@@ -24,22 +36,35 @@ class GPTWrapper:
     def __init__(self, api_key=None, db_url='sqlite:///conv.db'):
         super().__init__()
         self._client = None
+        # Every request of the V2 wrapper goes through the scheduler, which also owns the retries
+        self._scheduler = RequestScheduler()
         # Initialize OpenAI client
         self._is_available = True if api_key else False
         if api_key and self._is_available:
             self.set_api(api_key)
         self._db_handler = ''
         self.init_db(db_url)
+        # Archive of old conversations and how long the conversation table keeps them
+        self._archive = None
+        self._archive_retention = {}
 
     def is_available(self):
         return self._is_available
 
     def set_api(self, api_key):
         self._api_key = api_key
-        self._client = OpenAI(api_key=api_key)
+        self._client = OpenAI(api_key=api_key, max_retries=0,
+                              http_client=DefaultHttpxClient(event_hooks={'response': [self._scheduler.observe_response]}))
         os.environ['OPENAI_API_KEY'] = api_key
 
+    def set_client(self, client):
+        # Any object with the API of the OpenAI client, e.g. a run_recorder.ReplayClient
+        self._client = client
+        self._is_available = True
+
     def request_and_set_api(self, api_key):
+        # Imported here to keep the headless entry point fast to start
+        import requests
         try:
             response = requests.get('https://api.openai.com/v1/models', headers={'Authorization': f'Bearer {api_key}'})
             self._is_available = response.status_code == 200
@@ -50,14 +75,53 @@ class GPTWrapper:
             print(e)
             return False
 
+    def _schedule(self, priority, fn, *args, **kwargs):
+        return self._scheduler.call(priority, fn, *args, **kwargs)
+
+    def get_scheduler_metrics(self):
+        return self._scheduler.get_metrics()
+
     def get_message_obj(self, role, content):
-        return {"role": role, "content": content}
+        return ConversationRecord(role, content)
 
     def init_db(self, db_url):
         self._db_handler = GenericDBHandler(db_url)
 
-    def get_conversations(self):
-        return self._db_handler.get_conversations()
+    def get_conversations(self, thread_id=None, assistant_id=None, user_id=None):
+        return self._db_handler.get_conversations(thread_id=thread_id, assistant_id=assistant_id, user_id=user_id)
+
+    def enable_archive(self, archive, older_than=datetime.timedelta(days=90), max_rows=None, max_bytes=None):
+        """
+        Moves old conversations to an archive to keep the conversation table small, now and on every
+        archive_conversations call.
+
+        :param archive: ConversationArchive.
+        :param older_than: Age after which conversations are archived (datetime.timedelta), None for no age limit.
+        :param max_rows: Optional maximum number of conversations kept in the table.
+        :param max_bytes: Optional maximum total size of the conversation bodies kept in the table.
+        :return: Number of archived conversations.
+        """
+        self._archive = archive
+        self._archive_retention = {'older_than': older_than, 'max_rows': max_rows, 'max_bytes': max_bytes}
+        return self.archive_conversations()
+
+    def archive_conversations(self):
+        """
+        Moves the conversations beyond the retention of enable_archive to the archive.
+
+        :return: Number of archived conversations.
+        """
+        if self._archive is None:
+            return 0
+        return self._db_handler.archive_conversations(self._archive, **self._archive_retention)
+
+    def get_archive(self):
+        return self._archive
+
+    def get_archived_conversations(self, thread_id=None, assistant_id=None, user_id=None):
+        if self._archive is None:
+            return []
+        return self._archive.load(thread_id=thread_id, assistant_id=assistant_id, user_id=user_id)
 
     def append(self, message):
         self._db_handler.append(message)
@@ -73,15 +137,15 @@ class GPTAssistantWrapper(GPTWrapper):
     def get_assistants(self, order='desc', limit=None):
         if self._client is None:
             return None
-        assistants = self._client.beta.assistants.list(order=order, limit=limit)
-        assistants = [{
-            "assistant_id": assistant.id,
-            "name": assistant.name,
-            "instructions": assistant.instructions,
-            "tools": assistant.tools,
-            "model": assistant.model,
-            "thread": '',
-        } for assistant in assistants]
+        assistants = self._schedule(METADATA, self._client.beta.assistants.list, order=order, limit=limit)
+        assistants = [AssistantRecord(
+            assistant_id=assistant.id,
+            name=assistant.name,
+            instructions=assistant.instructions,
+            tools=assistant.tools,
+            model=assistant.model,
+            thread='',
+        ) for assistant in assistants]
         self.__assistants = assistants
         return self.__assistants
 
@@ -98,7 +162,7 @@ class GPTAssistantWrapper(GPTWrapper):
             #     print(f"Thread {name} already exists")
             #     self.__thread_id = thread[0].thread_id
             # else:
-            thread = self._client.beta.threads.create()
+            thread = self._schedule(INTERACTIVE, self._client.beta.threads.create)
             self.__thread_id = thread.id
             for assistant in self.__assistants:
                 if assistant["assistant_id"] == self.__assistant_id:
@@ -110,27 +174,28 @@ class GPTAssistantWrapper(GPTWrapper):
         user_obj = self.get_message_obj("user", message_str)
         self._db_handler.append(Conversation, user_obj)
 
-        self._client.beta.threads.messages.create(
+        self._schedule(INTERACTIVE, self._client.beta.threads.messages.create,
             thread_id=self.__thread_id,
             role="user",
             content=message_str
         )
 
-        run = self._client.beta.threads.runs.create(
+        run = self._schedule(INTERACTIVE, self._client.beta.threads.runs.create,
             thread_id=self.__thread_id,
             assistant_id=self.__assistant_id,
             instructions=instructions,
         )
 
-        response = self._client.beta.threads.runs.retrieve(
+        response = self._schedule(INTERACTIVE, self._client.beta.threads.runs.retrieve,
           thread_id=self.__thread_id,
           run_id=run.id
         )
 
         while response.status == "in_progress" or response.status == "queued":
-            response = self._client.beta.threads.runs.retrieve(thread_id=self.__thread_id, run_id=run.id)
+            response = self._schedule(INTERACTIVE, self._client.beta.threads.runs.retrieve, thread_id=self.__thread_id,
+                                      run_id=run.id)
 
-        response = self._client.beta.threads.messages.list(thread_id=self.__thread_id)
+        response = self._schedule(INTERACTIVE, self._client.beta.threads.messages.list, thread_id=self.__thread_id)
         response = response.dict()["data"][0]
         response = self.get_message_obj(response['role'], response['content'][0]['text']['value'])
         self._db_handler.append(Conversation, response)
@@ -147,59 +212,100 @@ class GPTAssistantV2Wrapper(GPTAssistantWrapper):
         Initializes the GPTAssistantV2Wrapper.
 
         :param api_key: API key for authentication.
-        :param db_url: Database URL for storing conversation data.
+        :param db_url: Database URL for storing conversation data, e.g. sqlite:///conv.db?profile=wal for the tuned
+            SQLite profile (see parse_db_url in db_handler.py).
         """
         super().__init__(api_key=api_key, db_url=db_url)
         self.__assistant_id = None
         self.__thread_id = None
         self.__assistants = []
+        self.__batch_tracker = None
+        self.__attachment_manager = None
+        self.__run_recorder = None
+        # Response cache settings, None while the cache is disabled
+        self.__response_cache = None
+        self.__cache_fingerprints = {}
+        # Token budget settings, None while threads grow without limit
+        self.__token_budget = None
+        self.__token_counter = TokenCounter()
+        self.__thread_contexts = {}
+        # Cancel tokens of the runs being streamed
+        self.__active_tokens = set()
+        # Last stored size and day of each vector store
+        self.__vector_store_usage = {}
+        # Run events for logs, metrics or the UI, disabled until a sink is added
+        self.__event_bus = EventBus()
 
     def __form_assistant_obj(self, assistant):
         """
-        Forms a dictionary object representing an assistant.
+        Forms a record representing an assistant.
 
         :param assistant: Assistant object from the API.
-        :return: Dictionary representing the assistant.
-        """
-        obj = {
-            "assistant_id": assistant.id,
-            "name": assistant.name,
-            "instructions": assistant.instructions,
-            "tools": assistant.tools,
-            "model": assistant.model,
-            "created_at": timestamp_to_datetime(assistant.created_at),
-        }
+        :return: AssistantRecord representing the assistant.
+        """
+        obj = AssistantRecord(
+            assistant_id=assistant.id,
+            name=assistant.name,
+            instructions=assistant.instructions,
+            tools=assistant.tools,
+            model=assistant.model,
+            created_at=timestamp_to_datetime(assistant.created_at),
+        )
         return obj
 
     def __form_vectorstore_obj(self, vector):
         """
-        Forms a dictionary object representing a vector store.
+        Forms a record representing a vector store.
 
         :param vector: Vector store object from the API.
-        :return: Dictionary representing the vector store.
-        """
-        obj = {
-            "vector_store_id": vector.id,
-            "name": vector.name,
-            "created_at": timestamp_to_datetime(vector.created_at),
-            "file_counts": vector.file_counts,
-            "last_activate_at": timestamp_to_datetime(vector.last_active_at),
-        }
+        :return: VectorStoreRecord representing the vector store.
+        """
+        # A snapshot of the size is only stored when it changed, or once a day
+        snapshot = (vector.usage_bytes, datetime.datetime.utcnow().date())
+        if self.__vector_store_usage.get(vector.id) != snapshot:
+            self.__vector_store_usage[vector.id] = snapshot
+            self._db_handler.append_vector_store_usage(vector.id, vector.usage_bytes)
+        obj = VectorStoreRecord(
+            vector_store_id=vector.id,
+            name=vector.name,
+            created_at=timestamp_to_datetime(vector.created_at),
+            file_counts=vector.file_counts,
+            last_activate_at=timestamp_to_datetime(vector.last_active_at),
+        )
+        return obj
+
+    def __form_file_batch_obj(self, file_batch):
+        """
+        Forms a record representing a file batch.
+
+        :param file_batch: Vector store file batch object from the API.
+        :return: FileBatchRecord representing the file batch.
+        """
+        obj = FileBatchRecord(
+            batch_id=file_batch.id,
+            vector_store_id=file_batch.vector_store_id,
+            status=file_batch.status,
+            in_progress=file_batch.file_counts.in_progress,
+            completed=file_batch.file_counts.completed,
+            failed=file_batch.file_counts.failed,
+            cancelled=file_batch.file_counts.cancelled,
+            total=file_batch.file_counts.total,
+        )
         return obj
 
     def __form_files_obj(self, file):
         """
-        Forms a dictionary object representing a file.
+        Forms a record representing a file.
 
         :param file: File object from the API.
-        :return: Dictionary representing the file.
+        :return: FileRecord representing the file.
         """
-        obj = {
-            "file_id": file.id,
-            "filename": file.filename,
-            "bytes": file.bytes,
-            "created_at": timestamp_to_datetime(file.created_at),
-        }
+        obj = FileRecord(
+            file_id=file.id,
+            filename=file.filename,
+            bytes=file.bytes,
+            created_at=timestamp_to_datetime(file.created_at),
+        )
         return obj
 
     def get_assistants(self, order='desc', limit=None):
@@ -212,19 +318,103 @@ class GPTAssistantV2Wrapper(GPTAssistantWrapper):
         """
         if self._client is None:
             return None
-        assistants = self._client.beta.assistants.list(order=order, limit=limit)
-        assistants = [self.__form_assistant_obj(assistant) for assistant in assistants]
+        assistants = []
+        for records, _, _ in self.iter_assistants(order=order):
+            assistants.extend(records)
+            if limit is not None and len(assistants) >= limit:
+                del assistants[limit:]
+                break
         self.__assistants = assistants
         return self.__assistants
 
+    def __iter_pages(self, list_fn, form_fn, order='desc', page_size=100, after=None, priority=METADATA, **kwargs):
+        """
+        Iterates over the pages of a list endpoint, one request per page.
+
+        :param list_fn: List function of the client.
+        :param form_fn: Function forming the records of the objects of a page.
+        :param order: Order of retrieval, either 'asc' or 'desc'.
+        :param page_size: Number of objects per page (at most 100).
+        :param after: Cursor to start after, e.g. the cursor of the last page seen.
+        :param priority: Scheduler priority of the requests.
+        :yield: Tuple of the records of the page, the cursor of the next page and whether there are more pages.
+        """
+        while True:
+            page = self._schedule(priority, list_fn, order=order, limit=page_size, after=after, **kwargs)
+            # Only the current page is kept, the auto-paginator of the SDK is not used
+            objs = page.data
+            if not objs:
+                return
+            after = objs[-1].id
+            has_more = bool(page.has_more)
+            yield form_fn(objs), after, has_more
+            if not has_more:
+                return
+
+    def iter_assistants(self, order='desc', page_size=100, after=None, priority=METADATA):
+        """
+        Iterates over the assistants page by page.
+
+        :param order: Order of retrieval, either 'asc' or 'desc'.
+        :param page_size: Number of assistants per page (at most 100).
+        :param after: Cursor to start after.
+        :param priority: Scheduler priority of the requests.
+        :yield: Tuple of the AssistantRecord list of the page, the cursor of the next page and whether there are more pages.
+        """
+        def form(assistants):
+            return [self.__form_assistant_obj(assistant) for assistant in assistants]
+        return self.__iter_pages(self._client.beta.assistants.list, form, order, page_size, after, priority)
+
+    def iter_vector_stores(self, order='desc', page_size=100, after=None, priority=METADATA):
+        """
+        Iterates over every vector store of the account page by page.
+
+        :param order: Order of retrieval, either 'asc' or 'desc'.
+        :param page_size: Number of vector stores per page (at most 100).
+        :param after: Cursor to start after.
+        :param priority: Scheduler priority of the requests.
+        :yield: Tuple of the VectorStoreRecord list of the page, the cursor of the next page and whether there are more pages.
+        """
+        def form(vector_stores):
+            return [self.__form_vectorstore_obj(vector_store) for vector_store in vector_stores]
+        return self.__iter_pages(self._client.beta.vector_stores.list, form, order, page_size, after, priority)
+
+    def iter_vector_store_files(self, vector_store_id, order='desc', page_size=100, after=None, max_workers=8,
+                                known_files=None, priority=METADATA):
+        """
+        Iterates over the files of a vector store page by page.
+        The file details of a page are retrieved concurrently.
+
+        :param vector_store_id: ID of the vector store.
+        :param order: Order of retrieval, either 'asc' or 'desc'.
+        :param page_size: Number of files per page (at most 100).
+        :param after: Cursor to start after.
+        :param max_workers: Maximum number of concurrent requests for the file details.
+        :param known_files: Optional dictionary of FileRecord by file ID, whose details are not retrieved again.
+        :param priority: Scheduler priority of the requests.
+        :yield: Tuple of the FileRecord list of the page, the cursor of the next page and whether there are more pages.
+        """
+        known_files = known_files or {}
+
+        def retrieve(file):
+            if file.id in known_files:
+                return known_files[file.id]
+            return self.__form_files_obj(self._schedule(priority, self._client.files.retrieve, file_id=file.id))
+
+        def form(files):
+            with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(files)))) as executor:
+                return list(executor.map(retrieve, files))
+        return self.__iter_pages(self._client.beta.vector_stores.files.list, form, order, page_size, after, priority,
+                                 vector_store_id=vector_store_id)
+
     def create_assistant(self, args):
         """
         Creates a new assistant.
 
         :param args: Arguments for creating the assistant.
-        :return: Dictionary representing the newly created assistant.
+        :return: AssistantRecord representing the newly created assistant.
         """
-        assistant = self._client.beta.assistants.create(
+        assistant = self._schedule(METADATA, self._client.beta.assistants.create,
             **args
         )
 
@@ -237,11 +427,13 @@ class GPTAssistantV2Wrapper(GPTAssistantWrapper):
     def set_current_assistant(self, assistant_id):
         """
         Sets the current assistant by ID.
+        Its thread is only created when a message is sent or the thread ID is asked for, so selecting an
+        assistant costs no request.
 
         :param assistant_id: ID of the assistant to set as current.
         """
         self.__assistant_id = assistant_id
-        self.__set_current_thread()
+        self.__thread_id = None
 
     def delete_assistant(self, assistant_id):
         """
@@ -249,7 +441,21 @@ class GPTAssistantV2Wrapper(GPTAssistantWrapper):
 
         :param assistant_id: ID of the assistant to delete.
         """
-        self._client.beta.assistants.delete(assistant_id=assistant_id)
+        self._schedule(METADATA, self._client.beta.assistants.delete, assistant_id=assistant_id)
+        self.__invalidate_response_cache(assistant_id=assistant_id)
+
+    def create_thread(self, messages=None):
+        """
+        Creates a thread without changing the current one.
+
+        :param messages: Optional initial messages for the thread.
+        :return: ID of the new thread.
+        """
+        if messages:
+            thread = self._schedule(INTERACTIVE, self._client.beta.threads.create, messages=messages)
+        else:
+            thread = self._schedule(INTERACTIVE, self._client.beta.threads.create)
+        return thread.id
 
     def __set_current_thread(self, messages=None):
         """
@@ -259,9 +465,9 @@ class GPTAssistantV2Wrapper(GPTAssistantWrapper):
         :return: Thread object.
         """
         if messages:
-            thread = self._client.beta.threads.create(messages=messages)
+            thread = self._schedule(INTERACTIVE, self._client.beta.threads.create, messages=messages)
         else:
-            thread = self._client.beta.threads.create()
+            thread = self._schedule(INTERACTIVE, self._client.beta.threads.create)
         self.__thread_id = thread.id
         for assistant in self.__assistants:
             if assistant["assistant_id"] == self.__assistant_id:
@@ -269,74 +475,624 @@ class GPTAssistantV2Wrapper(GPTAssistantWrapper):
                 break
         return thread
 
-    def send_message(self, message_str, instructions='', message_file=None, assistant_id=None, thread_id=None):
+    def send_message(self, message_str, instructions='', message_file=None, assistant_id=None, thread_id=None,
+                     cancel_token=None, timeout=None, idle_timeout=None, user_id=None, on_citations=None):
         """
         Sends a message to the assistant and handles streaming responses.
+        If the response cache is enabled, a cached answer is replayed instead of starting a run.
+
+        When the run is cancelled (cancel_token.cancel() or cancel()), the stream is closed, the run is cancelled
+        on the server and the generator stops. The partial answer is kept in the database.
 
         :param message_str: The message content.
         :param instructions: Additional instructions for the assistant.
-        :param message_file: Optional file to attach to the message.
+        :param message_file: Optional file to attach to the message, a local path or an uploaded file object.
+            A path is only uploaded once as long as its content doesn't change, see get_attachment_manager().
         :param assistant_id: ID of the assistant to use.
         :param thread_id: ID of the thread to use.
+        :param cancel_token: Optional CancelToken to stop the run with.
+        :param timeout: Maximum number of seconds for the whole run, ignored if cancel_token is given.
+        :param idle_timeout: Maximum number of seconds between two events of the run, ignored if cancel_token is given.
+        :param user_id: Optional ID of the user the conversation belongs to (server mode).
+        :param on_citations: Optional callable called with the CitationRecord list of each completed message
+            that cites files, before the generator ends.
         :yield: Streamed text responses.
+        :raises RunDeadlineExceeded: If the run was stopped by one of its deadlines.
         """
+        if not thread_id and self.__thread_id is None:
+            self.__set_current_thread()
+        if not thread_id and self.__token_budget is not None:
+            # Start over on a seeded thread before the context of the current one gets too big
+            context = self.__get_thread_context(self.__thread_id)
+            if context['tokens'] + self.__token_counter.count_message(message_str) > self.__token_budget['max_tokens']:
+                self.__rollover_thread()
+
+        thread_id = thread_id if thread_id else self.__thread_id
+        assistant_id = assistant_id if assistant_id else self.__assistant_id
+
         user_obj = self.get_message_obj("user", message_str)
-        self._db_handler.append(Conversation, user_obj)
+        self.__append_conversation(user_obj, thread_id, assistant_id, user_id=user_id)
         args = {
-            'thread_id': thread_id if thread_id else self.__thread_id,
+            'thread_id': thread_id,
             'role': "user",
             'content': message_str
         }
 
         if message_file:
+            if isinstance(message_file, (str, os.PathLike)):
+                file_id = self.get_attachment_manager().get_file_id(message_file)
+            else:
+                file_id = message_file.id
             args['attachments'] = [
-                {"file_id": message_file.id, "tools": [{"type": "file_search"}]}
+                {"file_id": file_id, "tools": [{"type": "file_search"}]}
             ]
 
-        self._client.beta.threads.messages.create(**args)
+        cache_key = None
+        if self.__response_cache is not None and not message_file:
+            cache_key, vs_ids = self.__get_cache_key(message_str, instructions, assistant_id)
+            response = self._db_handler.get_cached_response(cache_key, max_age=self.__response_cache['max_age'])
+            if response is not None:
+                # Keep the thread in sync with what the user sees without starting a run
+                self._schedule(INTERACTIVE, self._client.beta.threads.messages.create, **args)
+                self._schedule(INTERACTIVE, self._client.beta.threads.messages.create,
+                               thread_id=thread_id, role="assistant", content=response)
+                yield from self.__replay_response(response)
+                ai_obj = self.get_message_obj("assistant", response)
+                self.__append_conversation(ai_obj, thread_id, assistant_id, user_id=user_id)
+                self.__track_message(thread_id, user_obj)
+                self.__track_message(thread_id, ai_obj)
+                return
+
+        self._schedule(INTERACTIVE, self._client.beta.threads.messages.create, **args)
+        self.__track_message(thread_id, user_obj)
 
         response = ''
-
-        with self._client.beta.threads.runs.stream(
-                thread_id=thread_id if thread_id else self.__thread_id,
-                assistant_id=assistant_id if assistant_id else self.__assistant_id,
+        run_id = None
+        run = None
+        started_at = time.perf_counter()
+        first_text_at = None
+        token = cancel_token if cancel_token else CancelToken(timeout=timeout, idle_timeout=idle_timeout)
+        self.__active_tokens.add(token)
+
+        event_handler = self.EventHandler(self._client, schedule=self._schedule, cancel_token=token,
+                                          capture=RunCapture(self.__run_recorder) if self.__run_recorder else None,
+                                          on_citations=on_citations, event_bus=self.__event_bus)
+        try:
+            stream_manager = self._client.beta.threads.runs.stream(
+                thread_id=thread_id,
+                assistant_id=assistant_id,
                 instructions=instructions,
-                event_handler=self.EventHandler(self._client),
-        ) as stream:
-            for text in stream.text_deltas:
-                response += text
-                yield text
+                event_handler=event_handler,
+            )
+            # The run is started when the stream manager is entered
+            stream = self._schedule(INTERACTIVE, stream_manager.__enter__, cost_tokens=self.__token_counter.count(message_str))
+            try:
+                token.bind(lambda: self.__cancel_run(stream, thread_id))
+                try:
+                    for text in stream.text_deltas:
+                        if token.is_cancelled():
+                            break
+                        if first_text_at is None:
+                            first_text_at = time.perf_counter()
+                        response += text
+                        yield text
+                except Exception:
+                    # Closing the stream from another thread breaks the read in progress
+                    if not token.is_cancelled():
+                        raise
+                run = stream.current_run
+                run_id = run.id if run else None
+            finally:
+                stream_manager.__exit__(None, None, None)
+        finally:
+            token.close()
+            self.__active_tokens.discard(token)
 
         ai_obj = self.get_message_obj("assistant", response)
-        self._db_handler.append(Conversation, ai_obj)
+        self.__append_conversation(ai_obj, thread_id, assistant_id, run_id, user_id)
+        self.__track_message(thread_id, ai_obj)
+        if run is not None:
+            self.__append_run_usage(run, event_handler.get_run_steps(), user_id,
+                                    ttft_seconds=first_text_at - started_at if first_text_at else None,
+                                    wall_seconds=time.perf_counter() - started_at)
+
+        if token.is_cancelled():
+            if token.is_deadline_exceeded():
+                raise RunDeadlineExceeded(f'Run stopped by its {token.get_reason()}')
+            return
+
+        if cache_key is not None and response:
+            self._db_handler.put_cached_response({
+                'cache_key': cache_key,
+                'assistant_id': assistant_id,
+                'vector_store_ids': ','.join(vs_ids),
+                'content': response,
+            })
+            self._db_handler.evict_cached_responses(max_entries=self.__response_cache['max_entries'],
+                                                    max_bytes=self.__response_cache['max_bytes'],
+                                                    max_age=self.__response_cache['max_age'])
+
+    def send_message_to_assistants(self, message_str, assistant_ids, instructions='', thread_ids=None, cancel_token=None,
+                                   timeout=None, idle_timeout=None, user_id=None, on_result=None, on_citations=None):
+        """
+        Sends the same message to several assistants at once, each run on its own thread, and yields the streamed
+        answers as they arrive. The current assistant and thread are not changed.
+        Closing the generator early cancels the runs still streaming, so do cancel_token.cancel() and cancel().
+
+        :param message_str: The message content.
+        :param assistant_ids: IDs of the assistants.
+        :param instructions: Additional instructions for every run.
+        :param thread_ids: Optional dictionary of thread IDs by assistant ID, e.g. for a follow-up question.
+            A new thread is created for every other assistant.
+        :param cancel_token: Optional CancelToken to stop every run with.
+        :param timeout: Maximum number of seconds for each run.
+        :param idle_timeout: Maximum number of seconds between two events of each run.
+        :param user_id: Optional ID of the user the conversations belong to (server mode).
+        :param on_result: Optional callable called with the FanOutResultRecord of each run once it is over.
+        :param on_citations: Optional callable called with the assistant ID and the CitationRecord list of each
+            completed message that cites files, from the thread of its run.
+        :yield: Tuples of the assistant ID and a streamed text response.
+        """
+        thread_ids = thread_ids or {}
+        assistant_ids = list(dict.fromkeys(assistant_ids))
+        tokens = {assistant_id: CancelToken(timeout=timeout, idle_timeout=idle_timeout) for assistant_id in assistant_ids}
+        # Text of every run and the result of each finished one, in the order they arrive
+        events = queue.Queue()
+        if cancel_token:
+            cancel_token.bind(lambda: [token.cancel(cancel_token.get_reason()) for token in tokens.values()])
+        started_at = time.perf_counter()
+
+        def run(assistant_id):
+            thread_id = thread_ids.get(assistant_id)
+            first_text_at = None
+            chars = 0
+            error = None
+            try:
+                thread_id = thread_id or self.create_thread()
+                for text in self.send_message(message_str, instructions=instructions, assistant_id=assistant_id,
+                                              thread_id=thread_id, cancel_token=tokens[assistant_id], user_id=user_id,
+                                              on_citations=(lambda citations: on_citations(assistant_id, citations))
+                                              if on_citations else None):
+                    if first_text_at is None:
+                        first_text_at = time.perf_counter()
+                    chars += len(text)
+                    events.put((assistant_id, text))
+            except Exception as e:
+                error = str(e)
+            if error is None and tokens[assistant_id].is_cancelled():
+                error = tokens[assistant_id].get_reason()
+            events.put(FanOutResultRecord(assistant_id, thread_id,
+                                          first_text_at - started_at if first_text_at else None,
+                                          time.perf_counter() - started_at, chars, error))
+
+        running = set(assistant_ids)
+        for assistant_id in assistant_ids:
+            threading.Thread(target=run, args=(assistant_id,), name=f'FanOut-{assistant_id}', daemon=True).start()
+        try:
+            while running:
+                event = events.get()
+                if isinstance(event, FanOutResultRecord):
+                    running.discard(event['assistant_id'])
+                    if on_result:
+                        on_result(event)
+                else:
+                    yield event
+        finally:
+            # Left over when the generator is closed early
+            for assistant_id in running:
+                tokens[assistant_id].cancel()
+
+    def cancel(self):
+        """
+        Cancels every run being streamed by send_message.
+        """
+        for token in list(self.__active_tokens):
+            token.cancel()
+
+    def __cancel_run(self, stream, thread_id):
+        """
+        Closes the stream of a run and cancels the run on the server so the thread is unlocked.
+
+        :param stream: Stream of the run.
+        :param thread_id: ID of the thread of the run.
+        """
+        stream.close()
+        run = stream.current_run
+        if run and run.status in ('queued', 'in_progress', 'requires_action'):
+            try:
+                self._schedule(INTERACTIVE, self._client.beta.threads.runs.cancel, thread_id=thread_id, run_id=run.id)
+            except Exception as e:
+                # The run may have finished in the meantime
+                self.__event_bus.publish(ERROR, run_id=run.id, message=f'Could not cancel the run: {e}')
+
+    def __append_run_usage(self, run, run_steps, user_id=None, ttft_seconds=None, wall_seconds=None):
+        """
+        Stores the token usage, durations and tool calls of a run.
+
+        :param run: Last state of the run.
+        :param run_steps: Completed run steps of the run.
+        :param user_id: Optional ID of the user the run belongs to.
+        :param ttft_seconds: Seconds until the first text delta, measured by the client.
+        :param wall_seconds: Seconds until the end of the stream, measured by the client.
+        """
+        tool_calls = [tool_call.type for step in run_steps if step.step_details.type == 'tool_calls'
+                      for tool_call in step.step_details.tool_calls]
+        step_seconds = [step.completed_at - step.created_at for step in run_steps if step.completed_at]
+        usage = run.usage
+        self._db_handler.append(RunUsage, {
+            'run_id': run.id,
+            'thread_id': run.thread_id,
+            'assistant_id': run.assistant_id,
+            'user_id': user_id,
+            'model': run.model,
+            'status': run.status,
+            'prompt_tokens': usage.prompt_tokens if usage else None,
+            'completion_tokens': usage.completion_tokens if usage else None,
+            'total_tokens': usage.total_tokens if usage else None,
+            'queue_seconds': run.started_at - run.created_at if run.started_at and run.created_at else None,
+            'run_seconds': (run.completed_at or run.failed_at or run.cancelled_at) - run.started_at
+            if run.started_at and (run.completed_at or run.failed_at or run.cancelled_at) else None,
+            'ttft_seconds': ttft_seconds,
+            'wall_seconds': wall_seconds,
+            'steps': len(run_steps),
+            'step_seconds': sum(step_seconds) if step_seconds else None,
+            'file_search_calls': tool_calls.count('file_search'),
+            'code_interpreter_calls': tool_calls.count('code_interpreter'),
+            'function_calls': tool_calls.count('function'),
+            'created_at': datetime.datetime.utcfromtimestamp(run.created_at) if run.created_at else None,
+        })
+
+    def get_usage_summary(self, group_by=('assistant_id',), since=None, until=None):
+        """
+        Sums up the token usage and latency of the stored runs, to find the assistants, models or days driving them.
+
+        :param group_by: Keys to group by, any of 'assistant_id', 'model' and 'day'.
+        :param since: Optional datetime.datetime (UTC) of the oldest run.
+        :param until: Optional datetime.datetime (UTC) the runs are older than.
+        :return: List of UsageSummaryRecord, the groups using the most tokens first.
+        """
+        return self._db_handler.get_usage_summary(group_by=group_by, since=since, until=until)
+
+    def get_vector_store_usage(self, since=None, until=None):
+        """
+        Gets the largest size of each vector store per day, from the snapshots taken whenever a vector store is
+        retrieved. File search storage is billed per GB and day.
+
+        :param since: Optional datetime.datetime (UTC) of the oldest snapshot.
+        :param until: Optional datetime.datetime (UTC) the snapshots are older than.
+        :return: List of VectorStoreUsageRecord, the largest first.
+        """
+        return self._db_handler.get_vector_store_usage(since=since, until=until)
+
+    def __append_conversation(self, obj, thread_id, assistant_id, run_id=None, user_id=None):
+        """
+        Stores a message in the conversation database, scoped to its thread and assistant.
+
+        :param obj: Message object.
+        :param thread_id: ID of the thread.
+        :param assistant_id: ID of the assistant.
+        :param run_id: Optional ID of the run that produced the message.
+        :param user_id: Optional ID of the user the conversation belongs to.
+        """
+        record = dict(obj)
+        record['thread_id'] = self._db_handler.get_thread_pk(thread_id, assistant_id)
+        record['assistant_id'] = self._db_handler.get_assistant_pk(assistant_id)
+        record['run_id'] = run_id
+        record['user_id'] = user_id
+        self._db_handler.append(Conversation, record)
+
+    def set_token_budget(self, max_tokens=16000, keep_last_turns=4, summary_tokens=500, model='gpt-4o'):
+        """
+        Sets the token budget of the current thread. Once the approximate context of the thread exceeds it,
+        the next message goes to a new thread seeded with a compact summary and the last turns.
+
+        :param max_tokens: Maximum approximate number of tokens in the context of a thread.
+        :param keep_last_turns: Number of question/answer turns copied verbatim to the new thread.
+        :param summary_tokens: Maximum approximate number of tokens of the summary of older messages.
+        :param model: Model to pick the tokenizer for.
+        """
+        self.__token_budget = {
+            'max_tokens': max_tokens,
+            'keep_last_turns': keep_last_turns,
+            'summary_tokens': summary_tokens,
+        }
+        self.__token_counter = TokenCounter(model)
+        self.__thread_contexts.clear()
+
+    def disable_token_budget(self):
+        """
+        Disables the token budget. Threads grow without limit.
+        """
+        self.__token_budget = None
+        self.__thread_contexts.clear()
+
+    def get_thread_tokens(self, thread_id=None):
+        """
+        Gets the approximate number of tokens in the context of a thread.
+        Only messages sent through this wrapper while the token budget is set are counted.
+
+        :param thread_id: Optional ID of the thread.
+        :return: Number of tokens.
+        """
+        return self.__get_thread_context(thread_id if thread_id else self.__thread_id)['tokens']
+
+    def __get_thread_context(self, thread_id):
+        """
+        Gets the tracked context of a thread.
+
+        :param thread_id: ID of the thread.
+        :return: Dictionary of the token count, the last messages and the summary lines of older messages.
+        """
+        if thread_id not in self.__thread_contexts:
+            keep_last_turns = self.__token_budget['keep_last_turns'] if self.__token_budget else 0
+            self.__thread_contexts[thread_id] = {
+                'tokens': 0,
+                'messages': deque(maxlen=keep_last_turns * 2),
+                'summary': deque(),
+                'summary_tokens': 0,
+            }
+        return self.__thread_contexts[thread_id]
+
+    def __track_message(self, thread_id, obj):
+        """
+        Adds a message to the tracked context of a thread.
+        Messages pushed out of the last turns are kept as one summary line each, within the summary budget.
+
+        :param thread_id: ID of the thread.
+        :param obj: Message object.
+        """
+        if self.__token_budget is None:
+            return
+        context = self.__get_thread_context(thread_id)
+        context['tokens'] += self.__token_counter.count_message(obj.content)
+        messages = context['messages']
+        if messages.maxlen and len(messages) == messages.maxlen:
+            line = self.__summarize_message(messages[0])
+            context['summary'].append(line)
+            context['summary_tokens'] += self.__token_counter.count(line)
+            while context['summary_tokens'] > self.__token_budget['summary_tokens'] and context['summary']:
+                context['summary_tokens'] -= self.__token_counter.count(context['summary'].popleft())
+        if messages.maxlen:
+            messages.append(obj)
+
+    @staticmethod
+    def __summarize_message(obj, max_chars=200):
+        """
+        Compacts a message to its first sentence.
+
+        :param obj: Message object.
+        :param max_chars: Maximum number of characters of the line.
+        :return: Summary line.
+        """
+        content = ' '.join(obj.content.split())
+        sentence = re.split(r'(?<=[.!?])\s', content, maxsplit=1)[0]
+        if len(sentence) > max_chars:
+            sentence = sentence[:max_chars - 3] + '...'
+        return f'{obj.role}: {sentence}'
+
+    def __rollover_thread(self):
+        """
+        Replaces the current thread with a new one seeded with the summary and the last turns of the old one.
+        """
+        context = self.__thread_contexts.pop(self.__thread_id, None)
+        messages = []
+        if context:
+            if context['summary']:
+                messages.append({
+                    "role": "user",
+                    "content": 'Summary of the earlier conversation:\n' + '\n'.join(context['summary']),
+                })
+            messages.extend({"role": obj.role, "content": obj.content} for obj in context['messages'])
+        self.__set_current_thread(messages=messages)
+        new_context = self.__get_thread_context(self.__thread_id)
+        new_context['tokens'] = sum(self.__token_counter.count_message(message['content']) for message in messages)
+        if context:
+            new_context['messages'].extend(context['messages'])
+            new_context['summary'] = context['summary']
+            new_context['summary_tokens'] = context['summary_tokens']
+
+    def enable_response_cache(self, max_entries=500, max_bytes=50 * 1024 * 1024, max_age=datetime.timedelta(days=7)):
+        """
+        Enables the response cache for repeated questions. It is stored in the local database.
+
+        :param max_entries: Maximum number of cached responses.
+        :param max_bytes: Maximum total size of cached responses in bytes.
+        :param max_age: Maximum age of a cached response (datetime.timedelta).
+        """
+        self.__response_cache = {'max_entries': max_entries, 'max_bytes': max_bytes, 'max_age': max_age}
+        self._db_handler.evict_cached_responses(max_entries=max_entries, max_bytes=max_bytes, max_age=max_age)
+
+    def disable_response_cache(self):
+        """
+        Disables the response cache. Cached responses are kept in the database.
+        """
+        self.__response_cache = None
+
+    def clear_response_cache(self):
+        """
+        Deletes every cached response.
+        """
+        self.__cache_fingerprints.clear()
+        self._db_handler.invalidate_cached_responses()
+
+    def __get_fingerprint(self, assistant_id):
+        """
+        Gets the model, instructions and file set fingerprint of an assistant.
+        It is kept in memory until the assistant's files change.
+
+        :param assistant_id: ID of the assistant.
+        :return: Tuple of model, instructions, vector store IDs and fingerprint.
+        """
+        if assistant_id not in self.__cache_fingerprints:
+            assistant = self._schedule(INTERACTIVE, self._client.beta.assistants.retrieve, assistant_id=assistant_id)
+            tool_resources = assistant.dict()['tool_resources'] or {}
+            file_search = tool_resources.get('file_search') or {}
+            vs_ids = sorted(file_search.get('vector_store_ids') or [])
+            digest = hashlib.sha256()
+            for vs_id in vs_ids:
+                digest.update(vs_id.encode('utf-8'))
+                # Page by page through the scheduler, the auto-paginator would fetch the next pages around it
+                file_ids = []
+                for ids, _, _ in self.__iter_pages(self._client.beta.vector_stores.files.list,
+                                                   lambda files: [file.id for file in files], priority=INTERACTIVE,
+                                                   vector_store_id=vs_id):
+                    file_ids.extend(ids)
+                file_ids.sort()
+                for file_id in file_ids:
+                    digest.update(file_id.encode('utf-8'))
+            self.__cache_fingerprints[assistant_id] = (assistant.model, assistant.instructions, vs_ids, digest.hexdigest())
+        return self.__cache_fingerprints[assistant_id]
+
+    def __get_cache_key(self, message_str, instructions, assistant_id):
+        """
+        Builds the response cache key of a message.
+
+        :param message_str: The message content.
+        :param instructions: Additional instructions for the assistant.
+        :param assistant_id: ID of the assistant.
+        :return: Tuple of the cache key and the vector store IDs of the assistant.
+        """
+        model, assistant_instructions, vs_ids, fingerprint = self.__get_fingerprint(assistant_id)
+        prompt = ' '.join(message_str.split()).casefold()
+        key = json.dumps([assistant_id, model, assistant_instructions, instructions, fingerprint, prompt])
+        return hashlib.sha256(key.encode('utf-8')).hexdigest(), vs_ids
+
+    def __invalidate_response_cache(self, assistant_id=None, vector_store_id=None):
+        """
+        Invalidates cached responses after an assistant or its files changed.
+
+        :param assistant_id: ID of the changed assistant.
+        :param vector_store_id: ID of the changed vector store.
+        """
+        if assistant_id is not None:
+            self.__cache_fingerprints.pop(assistant_id, None)
+        else:
+            self.__cache_fingerprints.clear()
+        self._db_handler.invalidate_cached_responses(assistant_id=assistant_id, vector_store_id=vector_store_id)
+
+    @staticmethod
+    def __replay_response(response):
+        """
+        Replays a cached response word by word, like the deltas of a run.
+
+        :param response: The cached response.
+        :yield: Text chunks.
+        """
+        for match in re.finditer(r'\s*\S+\s*', response):
+            yield match.group()
 
     def create_vector_store(self, args):
         """
         Creates a new vector store.
 
         :param args: Arguments for creating the vector store.
-        :return: Dictionary representing the newly created vector store.
+        :return: VectorStoreRecord representing the newly created vector store.
         """
-        vector_store = self._client.beta.vector_stores.create(**args)
+        vector_store = self._schedule(METADATA, self._client.beta.vector_stores.create, **args)
         vector_store = self.__form_vectorstore_obj(vector_store)
         return vector_store
 
-    def upload_files_to_vector_store(self, vector_store_id, file_paths):
+    def upload_files(self, file_paths, max_workers=8):
         """
-        Uploads local files to the vector store.
+        Uploads local files concurrently for use by the assistants.
 
-        :param vector_store_id: ID of the vector store.
         :param file_paths: List of file paths to upload.
-        :return: Dictionary representing the uploaded files.
+        :param max_workers: Maximum number of concurrent uploads.
+        :return: List of FileRecord of the uploaded files.
         """
-        file_streams = [open(path, "rb") for path in file_paths]
-        file_batch = self._client.beta.vector_stores.file_batches.upload_and_poll(
-                vector_store_id=vector_store_id, files=file_streams
-        )
+        def upload(path):
+            with open(path, 'rb') as f:
+                def create():
+                    # Rewound on every attempt, a retry would send an empty file otherwise
+                    f.seek(0)
+                    return self._client.files.create(file=f, purpose='assistants')
+                return self.__form_files_obj(self._schedule(BULK, create))
+
+        if not file_paths:
+            return []
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(file_paths)))) as executor:
+            return list(executor.map(upload, file_paths))
+
+    def create_file_batch(self, vector_store_id, file_ids):
+        """
+        Adds uploaded files to a vector store without waiting for the indexing.
+
+        :param vector_store_id: ID of the vector store.
+        :param file_ids: List of uploaded file IDs.
+        :return: FileBatchRecord of the new batch, see get_batch_tracker() to follow it.
+        """
+        file_batch = self._schedule(BULK, self._client.beta.vector_stores.file_batches.create,
+                                    vector_store_id=vector_store_id, file_ids=file_ids)
+        self.__invalidate_response_cache(vector_store_id=vector_store_id)
+        return self.__form_file_batch_obj(file_batch)
+
+    def get_file_batch(self, vector_store_id, batch_id):
+        """
+        Retrieves the status of a file batch. Cached answers of the vector store are dropped once it is done.
+
+        :param vector_store_id: ID of the vector store.
+        :param batch_id: ID of the file batch.
+        :return: FileBatchRecord of the batch.
+        """
+        file_batch = self._schedule(METADATA, self._client.beta.vector_stores.file_batches.retrieve,
+                                    batch_id=batch_id, vector_store_id=vector_store_id)
+        obj = self.__form_file_batch_obj(file_batch)
+        if obj.is_done():
+            self.__invalidate_response_cache(vector_store_id=vector_store_id)
+        return obj
+
+    def get_batch_tracker(self):
+        """
+        Gets the tracker polling the file batches of this wrapper.
+
+        :return: BatchTracker.
+        """
+        if self.__batch_tracker is None:
+            self.__batch_tracker = BatchTracker(self)
+        return self.__batch_tracker
+
+    def get_event_bus(self):
+        """
+        Gets the bus the events of every run are published on, see event_bus.
+
+        :return: EventBus.
+        """
+        return self.__event_bus
+
+    def set_run_recorder(self, recorder):
+        """
+        Records the raw event stream of every run, see run_recorder.
 
-        result_obj = self.__form_files_obj(file_batch)
+        :param recorder: RunRecorder, or None to stop recording.
+        """
+        self.__run_recorder = recorder
+
+    def get_attachment_manager(self):
+        """
+        Gets the manager of the files attached to messages by path.
+
+        :return: AttachmentManager.
+        """
+        if self.__attachment_manager is None:
+            self.__attachment_manager = AttachmentManager(self, self._db_handler)
+        return self.__attachment_manager
+
+    def upload_files_to_vector_store(self, vector_store_id, file_paths, wait=True, max_workers=8):
+        """
+        Uploads local files to the vector store.
 
-        return result_obj
+        :param vector_store_id: ID of the vector store.
+        :param file_paths: List of file paths to upload.
+        :param wait: If True, blocks until the files are indexed.
+        :param max_workers: Maximum number of concurrent uploads.
+        :return: FileBatchRecord with the file counts of the batch.
+        :raises RuntimeError: If the batch tracker is stopped while waiting.
+        """
+        files = self.upload_files(file_paths, max_workers=max_workers)
+        file_batch = self.create_file_batch(vector_store_id, [file['file_id'] for file in files])
+        if wait:
+            file_batch = self.get_batch_tracker().wait(file_batch)
+        return file_batch
 
     def delete_vector_store(self, vector_store_id):
         """
@@ -344,7 +1100,8 @@ class GPTAssistantV2Wrapper(GPTAssistantWrapper):
 
         :param vector_store_id: ID of the vector store to delete.
         """
-        self._client.beta.vector_stores.delete(vector_store_id=vector_store_id)
+        self._schedule(METADATA, self._client.beta.vector_stores.delete, vector_store_id=vector_store_id)
+        self.__invalidate_response_cache(vector_store_id=vector_store_id)
 
     def delete_files_from_vector_store(self, vector_store_id, file_id):
         """
@@ -353,7 +1110,8 @@ class GPTAssistantV2Wrapper(GPTAssistantWrapper):
         :param vector_store_id: ID of the vector store.
         :param file_id: ID of the file to delete.
         """
-        self._client.beta.vector_stores.files.delete(vector_store_id=vector_store_id, file_id=file_id)
+        self._schedule(METADATA, self._client.beta.vector_stores.files.delete, vector_store_id=vector_store_id, file_id=file_id)
+        self.__invalidate_response_cache(vector_store_id=vector_store_id)
 
     def update_assistant(self, tool_resources, assistant_id=None):
         """
@@ -363,10 +1121,12 @@ class GPTAssistantV2Wrapper(GPTAssistantWrapper):
         :param assistant_id: Optional assistant ID.
         :return: Updated assistant object.
         """
-        assistant = self._client.beta.assistants.update(
-            assistant_id=assistant_id if assistant_id else self.__assistant_id,
+        assistant_id = assistant_id if assistant_id else self.__assistant_id
+        assistant = self._schedule(METADATA, self._client.beta.assistants.update,
+            assistant_id=assistant_id,
             tool_resources=tool_resources
         )
+        self.__invalidate_response_cache(assistant_id=assistant_id)
         return assistant
 
     def delete_file(self, file_id):
@@ -375,26 +1135,159 @@ class GPTAssistantV2Wrapper(GPTAssistantWrapper):
 
         :param file_id: ID of the file to delete.
         """
-        self._client.files.delete(file_id=file_id)
+        self._schedule(METADATA, self._client.files.delete, file_id=file_id)
+        # The file may be in any vector store
+        self.__invalidate_response_cache()
+
+    def __run_bulk(self, fn, items, max_workers=8, dry_run=False):
+        """
+        Runs a function on every item with bounded concurrency.
+
+        :param fn: Function called with each item.
+        :param items: List of items.
+        :param max_workers: Maximum number of concurrent requests.
+        :param dry_run: If True, nothing is called and every item is reported as it would be processed.
+        :return: List of BulkResult in the order of the items.
+        """
+        if dry_run:
+            return [BulkResult(item, True, 'dry run', None) for item in items]
+
+        def run(item):
+            try:
+                return BulkResult(item, True, fn(item), None)
+            except Exception as e:
+                return BulkResult(item, False, None, str(e))
+
+        if not items:
+            return []
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(items)))) as executor:
+            return list(executor.map(run, items))
+
+    def create_assistants(self, args_lst, max_workers=8, dry_run=False):
+        """
+        Creates several assistants concurrently. The current assistant is not changed.
+
+        :param args_lst: List of arguments for creating each assistant.
+        :param max_workers: Maximum number of concurrent requests.
+        :param dry_run: If True, nothing is created.
+        :return: List of BulkResult with the AssistantRecord of each created assistant.
+        """
+        def create(args):
+            return self.__form_assistant_obj(self._schedule(BULK, self._client.beta.assistants.create, **args))
+        return self.__run_bulk(create, args_lst, max_workers, dry_run)
 
-    def get_vector_stores(self, assistant_id=None):
+    def delete_assistants(self, assistant_ids, max_workers=8, dry_run=False):
+        """
+        Deletes several assistants concurrently.
+
+        :param assistant_ids: List of IDs of the assistants to delete.
+        :param max_workers: Maximum number of concurrent requests.
+        :param dry_run: If True, nothing is deleted.
+        :return: List of BulkResult for each assistant ID.
+        """
+        def delete(assistant_id):
+            self._schedule(BULK, self._client.beta.assistants.delete, assistant_id=assistant_id)
+        results = self.__run_bulk(delete, assistant_ids, max_workers, dry_run)
+        if not dry_run:
+            for result in results:
+                if result.ok:
+                    self.__invalidate_response_cache(assistant_id=result.item)
+        return results
+
+    def create_vector_stores(self, args_lst, max_workers=8, dry_run=False):
+        """
+        Creates several vector stores concurrently.
+
+        :param args_lst: List of arguments for creating each vector store.
+        :param max_workers: Maximum number of concurrent requests.
+        :param dry_run: If True, nothing is created.
+        :return: List of BulkResult with the VectorStoreRecord of each created vector store.
+        """
+        def create(args):
+            return self.__form_vectorstore_obj(self._schedule(BULK, self._client.beta.vector_stores.create, **args))
+        return self.__run_bulk(create, args_lst, max_workers, dry_run)
+
+    def delete_vector_stores(self, vector_store_ids, max_workers=8, dry_run=False):
+        """
+        Deletes several vector stores concurrently.
+
+        :param vector_store_ids: List of IDs of the vector stores to delete.
+        :param max_workers: Maximum number of concurrent requests.
+        :param dry_run: If True, nothing is deleted.
+        :return: List of BulkResult for each vector store ID.
+        """
+        def delete(vector_store_id):
+            self._schedule(BULK, self._client.beta.vector_stores.delete, vector_store_id=vector_store_id)
+        results = self.__run_bulk(delete, vector_store_ids, max_workers, dry_run)
+        if not dry_run:
+            for result in results:
+                if result.ok:
+                    self.__invalidate_response_cache(vector_store_id=result.item)
+        return results
+
+    def delete_vector_store_files(self, vector_store_id, file_ids, max_workers=8, dry_run=False):
+        """
+        Deletes several files from a vector store concurrently.
+
+        :param vector_store_id: ID of the vector store.
+        :param file_ids: List of IDs of the files to delete.
+        :param max_workers: Maximum number of concurrent requests.
+        :param dry_run: If True, nothing is deleted.
+        :return: List of BulkResult for each file ID.
+        """
+        def delete(file_id):
+            self._schedule(BULK, self._client.beta.vector_stores.files.delete, vector_store_id=vector_store_id, file_id=file_id)
+        results = self.__run_bulk(delete, file_ids, max_workers, dry_run)
+        if not dry_run:
+            self.__invalidate_response_cache(vector_store_id=vector_store_id)
+        return results
+
+    def delete_files(self, file_ids, max_workers=8, dry_run=False):
+        """
+        Deletes several files from OpenAI files storage concurrently. They are deleted in every vector store.
+
+        :param file_ids: List of IDs of the files to delete.
+        :param max_workers: Maximum number of concurrent requests.
+        :param dry_run: If True, nothing is deleted.
+        :return: List of BulkResult for each file ID.
+        """
+        def delete(file_id):
+            self._schedule(BULK, self._client.files.delete, file_id=file_id)
+        results = self.__run_bulk(delete, file_ids, max_workers, dry_run)
+        if not dry_run:
+            self.__invalidate_response_cache()
+        return results
+
+    def get_vector_store(self, vector_store_id):
+        """
+        Retrieves a vector store.
+
+        :param vector_store_id: ID of the vector store.
+        :return: VectorStoreRecord of the vector store.
+        """
+        vs_instance = self._schedule(METADATA, self._client.beta.vector_stores.retrieve, vector_store_id=vector_store_id)
+        return self.__form_vectorstore_obj(vs_instance)
+
+    def get_vector_stores(self, assistant_id=None, priority=METADATA):
         """
         Retrieves vector stores in the assistant.
 
         :param assistant_id: Optional assistant ID.
+        :param priority: Scheduler priority of the requests.
         :return: List of vector stores.
         """
         vs_obj_lst = []
 
         assistant_id = assistant_id if assistant_id else self.__assistant_id
 
-        tool_resources = self._client.beta.assistants.retrieve(assistant_id=assistant_id).dict()['tool_resources']
+        assistant = self._schedule(priority, self._client.beta.assistants.retrieve, assistant_id=assistant_id)
+        tool_resources = assistant.dict()['tool_resources']
         if tool_resources:
             file_search = tool_resources['file_search']
             if file_search:
                 vs_ids = file_search['vector_store_ids']
                 for vs_id in vs_ids:
-                    vs_instance = self._client.beta.vector_stores.retrieve(vector_store_id=vs_id)
+                    vs_instance = self._schedule(priority, self._client.beta.vector_stores.retrieve, vector_store_id=vs_id)
                     vs_obj_lst.append(self.__form_vectorstore_obj(vs_instance))
 
         return vs_obj_lst
@@ -408,18 +1301,34 @@ class GPTAssistantV2Wrapper(GPTAssistantWrapper):
         """
         files_lst = []
 
-        vector_store_files = self._client.beta.vector_stores.files.list(vector_store_id=vector_store_id)
-        for file in vector_store_files:
-            file = self._client.files.retrieve(file_id=file.id)
-            files_lst.append(self.__form_files_obj(file))
+        for records, _, _ in self.iter_vector_store_files(vector_store_id):
+            files_lst.extend(records)
 
         return files_lst
 
-    def clear_messages(self):
+    def get_current_thread_id(self):
+        """
+        Gets the ID of the current thread, created first if the current assistant has none yet.
+
+        :return: ID of the current thread.
         """
-        Clears all messages from the conversation database.
+        if self.__thread_id is None and self.__assistant_id is not None:
+            self.__set_current_thread()
+        return self.__thread_id
+
+    def clear_messages(self, thread_id=None, assistant_id=None):
         """
-        self._db_handler.delete(Conversation, None)
+        Clears messages from the conversation database.
+        Without arguments, only the messages of the current thread are cleared.
+
+        :param thread_id: Optional ID of the thread to clear.
+        :param assistant_id: Optional ID of the assistant to clear every thread of.
+        """
+        if thread_id is None and assistant_id is None:
+            thread_id = self.__thread_id
+            if thread_id is None:
+                return
+        self._db_handler.delete_conversations(thread_id=thread_id, assistant_id=assistant_id)
 
     # Declaration as an inner class
     class EventHandler(AssistantEventHandler):
@@ -427,14 +1336,66 @@ class GPTAssistantV2Wrapper(GPTAssistantWrapper):
         Event handler class for handling assistant events.
         """
 
-        def __init__(self, client):
+        def __init__(self, client, schedule=None, cancel_token=None, capture=None, on_citations=None, event_bus=None):
             """
             Initializes the EventHandler.
 
             :param client: The client instance.
+            :param schedule: Optional function making the requests of the handler through a scheduler, e.g. the
+                _schedule of the wrapper. They are made directly without it.
+            :param cancel_token: Optional CancelToken of the run, notified of every event.
+            :param capture: Optional RunCapture recording the raw events of the run.
+            :param on_citations: Optional callable called with the CitationRecord list of a completed message.
+            :param event_bus: Optional EventBus the events of the run are published on.
             """
             super().__init__()
             self._client = client
+            self._schedule = schedule if schedule is not None else lambda priority, fn, *args, **kwargs: fn(*args, **kwargs)
+            self._cancel_token = cancel_token
+            self._capture = capture
+            self._on_citations = on_citations
+            self._event_bus = event_bus if event_bus is not None else EventBus()
+            self._run_steps = []
+
+        def on_event(self, event) -> None:
+            """
+            Handles every event of the run.
+
+            :param event: The event.
+            """
+            if self._cancel_token is not None:
+                self._cancel_token.touch()
+            if self._capture is not None:
+                self._capture.capture(event)
+            if event.event in ('thread.run.failed', 'thread.run.expired') and event.data.last_error:
+                self._event_bus.publish(ERROR, run_id=event.data.id, message=event.data.last_error.message)
+
+        def on_exception(self, exception) -> None:
+            """
+            Handles an exception raised while the stream is read.
+
+            :param exception: The exception.
+            """
+            self._event_bus.publish(ERROR, run_id=self.current_run.id if self.current_run else None,
+                                    message=str(exception))
+
+        def on_end(self) -> None:
+            """
+            Handles the end of the stream, also when it failed or was closed.
+            """
+            if self._capture is not None:
+                self._capture.close()
+
+        def on_run_step_done(self, run_step) -> None:
+            """
+            Handles the event when a run step is done.
+
+            :param run_step: The completed run step.
+            """
+            self._run_steps.append(run_step)
+
+        def get_run_steps(self):
+            return self._run_steps
 
         def on_text_created(self, text) -> None:
             """
@@ -442,7 +1403,7 @@ class GPTAssistantV2Wrapper(GPTAssistantWrapper):
 
             :param text: The created text.
             """
-            print(f"\nassistant onTextCreated > ", end="", flush=True)
+            self._event_bus.publish(TEXT_CREATED)
 
         def on_text_delta(self, delta, snapshot):
             """
@@ -451,7 +1412,8 @@ class GPTAssistantV2Wrapper(GPTAssistantWrapper):
             :param delta: The text delta.
             :param snapshot: The snapshot of the current state.
             """
-            print(delta.value, end="", flush=True)
+            # Runs for every token, the bus returns right away while it is disabled
+            self._event_bus.publish(TEXT_DELTA, value=delta.value)
 
         def on_tool_call_created(self, tool_call):
             """
@@ -459,7 +1421,7 @@ class GPTAssistantV2Wrapper(GPTAssistantWrapper):
 
             :param tool_call: The created tool call.
             """
-            print(f"\nassistant onToolCallCreated > {tool_call.type}\n", flush=True)
+            self._event_bus.publish(TOOL_CALL_CREATED, id=tool_call.id, type=tool_call.type)
 
         def on_tool_call_delta(self, delta, snapshot):
             """
@@ -468,10 +1430,7 @@ class GPTAssistantV2Wrapper(GPTAssistantWrapper):
             :param delta: The tool call delta.
             :param snapshot: The snapshot of the current state.
             """
-            if delta.type == 'code_interpreter':
-                pass
-            elif delta.type == 'file_search':
-                print(f"\nassistant > {delta.type}\n", flush=True)
+            self._event_bus.publish(TOOL_CALL_DELTA, index=delta.index, type=delta.type)
 
         def on_message_done(self, message) -> None:
             """
@@ -479,20 +1438,22 @@ class GPTAssistantV2Wrapper(GPTAssistantWrapper):
 
             :param message: The completed message.
             """
-            print('Message done')
             message_content = message.content[0].text
             annotations = message_content.annotations
-            citations = []
+            records = []
             for index, annotation in enumerate(annotations):
                 message_content.value = message_content.value.replace(
                     annotation.text, f"[{index}]"
                 )
                 if file_citation := getattr(annotation, "file_citation", None):
-                    cited_file = self._client.files.retrieve(file_citation.file_id)
-                    citations.append(f"[{index}] {cited_file.filename}")
-
-            print(message_content.value)
-            print("\n".join(citations))
+                    cited_file = self._schedule(INTERACTIVE, self._client.files.retrieve, file_citation.file_id)
+                    records.append(CitationRecord(index, annotation.text, file_citation.file_id, cited_file.filename))
+
+            self._event_bus.publish(MESSAGE_DONE, message_id=message.id, text=message_content.value)
+            if records:
+                self._event_bus.publish(CITATIONS, message_id=message.id, citations=[dict(record) for record in records])
+                if self._on_citations is not None:
+                    self._on_citations(records)
 
 
 # API_KEY = 'sk-...'
@@ -0,0 +1,320 @@
+"""
+Multi-client HTTP server mode around GPTAssistantV2Wrapper.
+
+Every user shares one wrapper, so one pooled OpenAI client and one database handler.
+Answers are streamed as Server-Sent Events.
+
+    POST /chat                          {"user": "...", "assistant_id": "...", "prompt": "...", "instructions": "..."}
+    GET  /assistants
+    GET  /assistants/<assistant_id>/vector_stores
+    GET  /vector_stores/<vector_store_id>/files
+    POST /vector_stores/<vector_store_id>/files?filename=<name>   (raw file body, answers with the file batch)
+    GET  /vector_stores/<vector_store_id>/file_batches/<batch_id>
+    GET  /conversations?user=<user>&assistant_id=<assistant_id>
+    GET  /metrics
+
+    OPENAI_API_KEY=sk-... python -m server --port 8080
+"""
+import asyncio, json, os, tempfile, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs, unquote
+
+from run_control import CancelToken
+
+_STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+                413: 'Payload Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+# JSON bodies are read whole, uploads are streamed to disk in blocks and only limited by max_body_size
+_MAX_JSON_SIZE = 1024 * 1024
+_UPLOAD_BLOCK_SIZE = 1024 * 1024
+
+# Marks the end of a stream in the queue between the worker thread and the connection
+_END = object()
+
+
+def _to_json(value):
+    if hasattr(value, 'model_dump'):
+        return value.model_dump()
+    if hasattr(value, 'items'):
+        return dict(value.items())
+    return str(value)
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class AssistantServer:
+    """
+    asyncio HTTP server streaming assistant answers to many clients at once.
+
+    The wrapper is blocking, so each stream runs in a worker thread that feeds a bounded queue.
+    When a client reads slowly, the queue fills up and the worker stops reading from the upstream run.
+    """
+
+    def __init__(self, wrapper, max_streams=512, queue_size=64, max_body_size=64 * 1024 * 1024):
+        """
+        Initializes the AssistantServer.
+
+        :param wrapper: GPTAssistantV2Wrapper shared by every client.
+        :param max_streams: Maximum number of concurrent chat streams, more are answered with 503.
+        :param queue_size: Maximum number of deltas buffered per stream before the worker waits for the client.
+        :param max_body_size: Maximum size of an uploaded file in bytes.
+        """
+        self.__wrapper = wrapper
+        self.__max_streams = max_streams
+        self.__queue_size = queue_size
+        self.__max_body_size = max_body_size
+        self.__executor = ThreadPoolExecutor(max_workers=max_streams + 16, thread_name_prefix='assistant-server')
+        self.__threads = {}
+        self.__threads_lock = threading.Lock()
+        self.__active_streams = 0
+        self.__total_streams = 0
+        self.__server = None
+
+    async def start(self, host='127.0.0.1', port=8080):
+        self.__server = await asyncio.start_server(self.__handle_connection, host, port, backlog=1024)
+        return self.__server
+
+    async def serve_forever(self, host='127.0.0.1', port=8080):
+        server = await self.start(host, port)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        if self.__server is not None:
+            self.__server.close()
+        self.__executor.shutdown(wait=False, cancel_futures=True)
+
+    def get_port(self):
+        return self.__server.sockets[0].getsockname()[1]
+
+    async def __read_request(self, reader):
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        method, target, _ = request_line.decode('latin-1').split(' ', 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, value = line.decode('latin-1').split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+        # The body is left in the reader, each route reads it the way it needs
+        length = int(headers.get('content-length', 0))
+        url = urlsplit(target)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        return method, unquote(url.path), query, headers, length
+
+    async def __read_json(self, reader, length):
+        if length > _MAX_JSON_SIZE:
+            raise HttpError(413, 'Request body is too large')
+        return self.__parse_json(await reader.readexactly(length) if length else b'')
+
+    @staticmethod
+    async def __send_json(writer, status, obj):
+        body = json.dumps(obj, default=_to_json, ensure_ascii=False).encode('utf-8')
+        writer.write(f'HTTP/1.1 {status} {_STATUS_TEXT.get(status, "")}\r\n'
+                     f'Content-Type: application/json\r\nContent-Length: {len(body)}\r\n'
+                     f'Connection: close\r\n\r\n'.encode('latin-1') + body)
+        await writer.drain()
+
+    async def __handle_connection(self, reader, writer):
+        try:
+            request = await self.__read_request(reader)
+            if request is None:
+                return
+            await self.__route(reader, writer, *request)
+        except HttpError as e:
+            await self.__send_json(writer, e.status, {'error': str(e)})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            try:
+                await self.__send_json(writer, 500, {'error': str(e)})
+            except ConnectionError:
+                pass
+        finally:
+            writer.close()
+
+    async def __run_blocking(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.__executor, fn, *args)
+
+    async def __route(self, reader, writer, method, path, query, headers, length):
+        parts = [part for part in path.split('/') if part]
+        if parts == ['chat']:
+            if method != 'POST':
+                raise HttpError(405, 'Use POST')
+            await self.__chat(writer, await self.__read_json(reader, length))
+        elif method == 'GET' and parts == ['assistants']:
+            await self.__send_json(writer, 200, await self.__run_blocking(self.__wrapper.get_assistants))
+        elif method == 'GET' and len(parts) == 3 and parts[0] == 'assistants' and parts[2] == 'vector_stores':
+            await self.__send_json(writer, 200, await self.__run_blocking(self.__wrapper.get_vector_stores, parts[1]))
+        elif len(parts) == 3 and parts[0] == 'vector_stores' and parts[2] == 'files':
+            if method == 'GET':
+                await self.__send_json(writer, 200, await self.__run_blocking(self.__wrapper.get_vector_store_files, parts[1]))
+            elif method == 'POST':
+                result = await self.__upload(reader, length, parts[1], query.get('filename', 'upload.txt'))
+                await self.__send_json(writer, 200, result)
+            else:
+                raise HttpError(405, 'Use GET or POST')
+        elif method == 'GET' and len(parts) == 4 and parts[0] == 'vector_stores' and parts[2] == 'file_batches':
+            await self.__send_json(writer, 200, await self.__run_blocking(self.__wrapper.get_file_batch, parts[1], parts[3]))
+        elif method == 'GET' and parts == ['conversations']:
+            # Without a user the history of every user would be sent
+            if not query.get('user'):
+                raise HttpError(400, 'user is required')
+            conversations = await self.__run_blocking(self.__get_conversations, query.get('user'), query.get('assistant_id'))
+            await self.__send_json(writer, 200, conversations)
+        elif method == 'GET' and parts == ['metrics']:
+            await self.__send_json(writer, 200, self.get_metrics())
+        else:
+            raise HttpError(404, f'No route for {method} {path}')
+
+    @staticmethod
+    def __parse_json(body):
+        try:
+            obj = json.loads(body or b'{}')
+        except ValueError:
+            raise HttpError(400, 'Body is not valid JSON')
+        if not isinstance(obj, dict):
+            raise HttpError(400, 'Body must be a JSON object')
+        return obj
+
+    async def __upload(self, reader, length, vector_store_id, filename):
+        if length > self.__max_body_size:
+            raise HttpError(413, 'Request body is too large')
+        # The SDK uploads from files, keep the original name so the file search citations stay readable
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, os.path.basename(filename))
+        try:
+            with open(path, 'wb') as f:
+                # Block by block, so only one block of each upload is ever in memory
+                left = length
+                while left:
+                    block = await reader.readexactly(min(left, _UPLOAD_BLOCK_SIZE))
+                    await self.__run_blocking(f.write, block)
+                    left -= len(block)
+            # Only the upload holds a worker, the client polls the returned batch while the files are indexed
+            return await self.__run_blocking(
+                lambda: self.__wrapper.upload_files_to_vector_store(vector_store_id, [path], wait=False))
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+            os.rmdir(directory)
+
+    def __get_conversations(self, user_id, assistant_id):
+        return [dict(conversation) for conversation in self.__wrapper.get_conversations(assistant_id=assistant_id, user_id=user_id)]
+
+    def __get_thread(self, user_id, assistant_id, thread_id=None):
+        # One thread per user and assistant unless the client picks one
+        if thread_id:
+            return thread_id
+        with self.__threads_lock:
+            thread_id = self.__threads.get((user_id, assistant_id))
+        if thread_id is None:
+            thread_id = self.__wrapper.create_thread()
+            with self.__threads_lock:
+                thread_id = self.__threads.setdefault((user_id, assistant_id), thread_id)
+        return thread_id
+
+    def __produce(self, loop, queue, token, request):
+        # Runs in a worker thread, put() blocks while the queue is full
+        def put(item):
+            asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+        try:
+            thread_id = self.__get_thread(request['user'], request['assistant_id'], request.get('thread_id'))
+            put(('thread', thread_id))
+            for chunk in self.__wrapper.send_message(request['prompt'], instructions=request.get('instructions', ''),
+                                                     assistant_id=request['assistant_id'], thread_id=thread_id,
+                                                     cancel_token=token, user_id=request['user']):
+                put(('delta', chunk))
+        except Exception as e:
+            put(('error', str(e)))
+        finally:
+            put(_END)
+
+    async def __chat(self, writer, request):
+        for key in ('user', 'assistant_id', 'prompt'):
+            if not request.get(key):
+                raise HttpError(400, f'{key} is required')
+        # Checked here, the watcher thread of the token would fail on them later
+        for key in ('timeout', 'idle_timeout'):
+            value = request.get(key)
+            if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float)) or not value > 0):
+                raise HttpError(400, f'{key} must be a positive number of seconds')
+        if self.__active_streams >= self.__max_streams:
+            raise HttpError(503, 'Too many concurrent streams')
+
+        self.__active_streams += 1
+        self.__total_streams += 1
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=self.__queue_size)
+        token = CancelToken(timeout=request.get('timeout'), idle_timeout=request.get('idle_timeout'))
+        producer = loop.run_in_executor(self.__executor, self.__produce, loop, queue, token, request)
+        try:
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n'
+                         b'Connection: close\r\n\r\n')
+            thread_id = None
+            while True:
+                item = await queue.get()
+                if item is _END:
+                    break
+                kind, value = item
+                if kind == 'thread':
+                    thread_id = value
+                    continue
+                writer.write(f'event: {kind}\ndata: {json.dumps({kind: value}, ensure_ascii=False)}\n\n'.encode('utf-8'))
+                # Waits while the client is slow, which in turn fills the queue and pauses the worker
+                await writer.drain()
+            done = {'thread_id': thread_id, 'seconds': time.perf_counter() - start}
+            writer.write(f'event: done\ndata: {json.dumps(done)}\n\n'.encode('utf-8'))
+            await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            # The client is gone, stop the run and let the worker finish
+            token.cancel()
+            while not producer.done():
+                try:
+                    queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    await asyncio.sleep(0.01)
+            raise
+        finally:
+            self.__active_streams -= 1
+
+    def get_metrics(self):
+        metrics = {
+            'active_streams': self.__active_streams,
+            'total_streams': self.__total_streams,
+            'threads': len(self.__threads),
+        }
+        if hasattr(self.__wrapper, 'get_scheduler_metrics'):
+            metrics['scheduler'] = self.__wrapper.get_scheduler_metrics()
+        return metrics
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from script import GPTAssistantV2Wrapper
+
+    parser = argparse.ArgumentParser(description='Serve the assistants to many clients over HTTP/SSE.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--db-url', default='sqlite:///conv.db')
+    parser.add_argument('--max-streams', type=int, default=512)
+    args = parser.parse_args()
+
+    api_key = os.environ.get('OPENAI_API_KEY')
+    if not api_key:
+        parser.error('set OPENAI_API_KEY')
+    server = AssistantServer(GPTAssistantV2Wrapper(api_key=api_key, db_url=args.db_url), max_streams=args.max_streams)
+    try:
+        asyncio.run(server.serve_forever(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
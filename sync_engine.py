@@ -0,0 +1,186 @@
+import threading, time
+
+from records import SyncDiff
+from scheduler import TokenBucket, BULK
+
+ASSISTANTS = 'assistants'
+VECTOR_STORES = 'vector_stores'
+FILES = 'files'
+
+# ID field and fields compared to detect an update, per listing
+SCOPES = {
+    ASSISTANTS: ('assistant_id', ('name', 'instructions', 'model', 'tools', 'created_at')),
+    VECTOR_STORES: ('vector_store_id', ('name', 'created_at', 'last_activate_at', 'file_counts')),
+    FILES: ('file_id', ('filename', 'bytes', 'created_at')),
+}
+
+
+def diff_records(old, new, scope):
+    """
+    Compares the mirror of a listing with a fresh listing.
+
+    :param old: Dictionary of records by ID from the mirror.
+    :param new: Dictionary of records by ID from the API.
+    :param scope: ASSISTANTS, VECTOR_STORES or FILES.
+    :return: Tuple of the added records, the removed IDs and the updated records.
+    """
+    _, fields = SCOPES[scope]
+    added = [record for record_id, record in new.items() if record_id not in old]
+    removed = [record_id for record_id in old if record_id not in new]
+    updated = [record for record_id, record in new.items()
+               if record_id in old and any(old[record_id].get(field) != record.get(field) for field in fields)]
+    return added, removed, updated
+
+
+class SyncEngine:
+    """
+    Keeps a local mirror of the remote assistants, and of the vector stores and files being watched,
+    and reports what changed since the last pass as SyncDiff.
+
+    The first listing of a scope only fills the mirror. Requests run at bulk priority and within a budget
+    of API calls per minute, so a sync never delays what the user is doing.
+    """
+
+    def __init__(self, wrapper, interval=30, calls_per_minute=30):
+        """
+        Initializes the SyncEngine.
+
+        :param wrapper: GPTAssistantV2Wrapper to list with.
+        :param interval: Seconds between two passes.
+        :param calls_per_minute: Maximum number of API calls per minute.
+        """
+        self.__wrapper = wrapper
+        self.__interval = interval
+        self.__budget = TokenBucket(calls_per_minute, calls_per_minute / 60)
+        self.__lock = threading.Lock()
+        self.__stop = threading.Event()
+        self.__assistant_id = None
+        self.__vector_store_id = None
+        # Mirror of every listing, by scope and parent ID
+        self.__mirror = {}
+
+    def set_interval(self, interval):
+        self.__interval = interval
+
+    def set_calls_per_minute(self, calls_per_minute):
+        with self.__lock:
+            self.__budget = TokenBucket(calls_per_minute, calls_per_minute / 60)
+
+    def watch(self, assistant_id=None, vector_store_id=None):
+        """
+        Sets the assistant whose vector stores and the vector store whose files are synced besides the assistants.
+
+        :param assistant_id: ID of the assistant.
+        :param vector_store_id: ID of the vector store.
+        """
+        with self.__lock:
+            self.__assistant_id = assistant_id
+            self.__vector_store_id = vector_store_id
+            # Mirrors of what isn't watched anymore are dropped, a new selection starts from its own listing
+            self.__mirror = {key: mirror for key, mirror in self.__mirror.items()
+                             if key == (ASSISTANTS, None) or key in ((VECTOR_STORES, assistant_id), (FILES, vector_store_id))}
+
+    def __spend(self, calls=1):
+        # Waits for the budget, the stop event cuts the wait short
+        while True:
+            with self.__lock:
+                wait = self.__budget.get_wait(calls)
+                if wait <= 0:
+                    self.__budget.acquire(calls)
+                    return True
+            if self.__stop.wait(wait):
+                return False
+
+    def __charge(self, calls):
+        # Calls made on top of the listing itself, e.g. file details, the next passes wait for them
+        if calls > 0:
+            with self.__lock:
+                self.__budget.acquire(calls)
+
+    def __list_pages(self, pages):
+        records = []
+        pages = iter(pages)
+        while True:
+            if not self.__spend():
+                # Stopped while waiting for the budget
+                return None
+            try:
+                page, _, has_more = next(pages)
+            except StopIteration:
+                return records
+            records.extend(page)
+            if not has_more:
+                return records
+
+    def __list(self, scope, parent_id, mirror):
+        if scope == ASSISTANTS:
+            return self.__list_pages(self.__wrapper.iter_assistants(priority=BULK))
+        if scope == VECTOR_STORES:
+            if not self.__spend():
+                return None
+            records = self.__wrapper.get_vector_stores(parent_id, priority=BULK)
+            self.__charge(len(records))
+            return records
+        records = self.__list_pages(self.__wrapper.iter_vector_store_files(parent_id, known_files=mirror, priority=BULK))
+        if records is not None:
+            self.__charge(sum(1 for record in records if record['file_id'] not in mirror))
+        return records
+
+    def __sync_scope(self, scope, parent_id):
+        with self.__lock:
+            mirror = self.__mirror.get((scope, parent_id))
+        records = self.__list(scope, parent_id, mirror or {})
+        if records is None:
+            return None
+        id_key, _ = SCOPES[scope]
+        new = {record[id_key]: record for record in records}
+        with self.__lock:
+            # The selection may have changed during the listing
+            watched = scope == ASSISTANTS or parent_id == (self.__assistant_id if scope == VECTOR_STORES else self.__vector_store_id)
+            if watched:
+                self.__mirror[(scope, parent_id)] = new
+        if mirror is None or not watched:
+            return None
+        added, removed, updated = diff_records(mirror, new, scope)
+        if not (added or removed or updated):
+            return None
+        return SyncDiff(scope, parent_id, added, removed, updated)
+
+    def sync_once(self):
+        """
+        Lists the assistants and the watched vector stores and files once.
+
+        :return: List of SyncDiff, one per listing that changed.
+        """
+        with self.__lock:
+            scopes = [(ASSISTANTS, None)]
+            if self.__assistant_id:
+                scopes.append((VECTOR_STORES, self.__assistant_id))
+            if self.__vector_store_id:
+                scopes.append((FILES, self.__vector_store_id))
+        diffs = []
+        for scope, parent_id in scopes:
+            if self.__stop.is_set():
+                break
+            diff = self.__sync_scope(scope, parent_id)
+            if diff is not None:
+                diffs.append(diff)
+        return diffs
+
+    def run(self, callback):
+        """
+        Syncs every interval until stop() is called. Errors of a pass are reported and the next pass goes on.
+
+        :param callback: Called with each SyncDiff, or with the exception of a failed pass.
+        """
+        while not self.__stop.is_set():
+            start = time.monotonic()
+            try:
+                for diff in self.sync_once():
+                    callback(diff)
+            except Exception as e:
+                callback(e)
+            self.__stop.wait(max(0, self.__interval - (time.monotonic() - start)))
+
+    def stop(self):
+        self.__stop.set()
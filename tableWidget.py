@@ -1,51 +1,285 @@
-from PyQt6.QtWidgets import QTableWidget, QTableWidgetItem
-from PyQt6.QtCore import pyqtSignal
+from bisect import bisect_right
 
+from PyQt6.QtWidgets import QTableView
+from PyQt6.QtCore import pyqtSignal, Qt, QAbstractTableModel, QModelIndex, QTimer
 
-class TableWidget(QTableWidget):
-    selectedRecord = pyqtSignal(dict)
 
-    def __init__(self, parent=None, columns=None):
+def _sort_key(value):
+    # Sort on the values of the records, numbers before strings and None first. created_at is already formatted
+    # as 'YYYY-MM-DD HH:MM:SS', which sorts by time as text, other objects like file_counts sort by their text
+    if value is None:
+        return 0, 0
+    if isinstance(value, (int, float)):
+        return 1, value
+    if isinstance(value, str):
+        return 2, value
+    return 3, str(value)
+
+
+class _Descending:
+    # Sort key compared the other way round, so bisect works on a list sorted in descending order
+    __slots__ = ('key',)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+
+class TableModel(QAbstractTableModel):
+    """
+    Table model holding the typed records as they come from the wrapper.
+
+    Cells are only formatted when the view paints them. More pages are fetched from the API
+    when the view scrolls to the bottom, see setFetcher().
+    """
+
+    def __init__(self, columns, id_key=None, parent=None):
+        super(TableModel, self).__init__(parent)
+        self.__columns = columns
+        # With an ID column, a record already in the table is never added twice
+        self.__id_key = id_key
+        self.__records = []
+        # IDs of the records, kept along with them so adding a record doesn't go over the whole table
+        self.__ids = set()
+        self.__sort_column = None
+        self.__sort_order = Qt.SortOrder.AscendingOrder
+        self.__pages = None
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.__records)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.__columns)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid() or role != Qt.ItemDataRole.DisplayRole:
+            return None
+        value = self.__records[index.row()].get(self.__columns[index.column()])
+        return '' if value is None else str(value)
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return self.__columns[section]
+        return None
+
+    def getRecord(self, row):
+        return self.__records[row]
+
+    def setRecords(self, records):
+        self.beginResetModel()
+        self.__records = list(records)
+        self.__ids = {record.get(self.__id_key) for record in self.__records} if self.__id_key is not None else set()
+        self.__pages = None
+        if self.__sort_column is not None:
+            self.__records.sort(key=self.__getSortKey, reverse=self.__sort_order == Qt.SortOrder.DescendingOrder)
+        self.endResetModel()
+
+    def addRecords(self, records):
+        records = list(records)
+        if self.__id_key is not None:
+            # Also once only when the same record is passed twice
+            seen = set()
+            unique = []
+            for record in records:
+                record_id = record.get(self.__id_key)
+                if record_id not in self.__ids and record_id not in seen:
+                    seen.add(record_id)
+                    unique.append(record)
+            records = unique
+        if not records:
+            return
+        if not self.__records:
+            # Fill an empty table with a single reset
+            pages = self.__pages
+            self.setRecords(records)
+            self.__pages = pages
+            return
+        if self.__sort_column is not None and len(records) * 8 <= len(self.__records):
+            # A few records, e.g. one at a time while they arrive, go straight to their sorted position
+            for record in records:
+                self.__insertSorted(record)
+            return
+        row = len(self.__records)
+        self.beginInsertRows(QModelIndex(), row, row + len(records) - 1)
+        self.__records.extend(records)
+        self.__addIds(records)
+        self.endInsertRows()
+        if self.__sort_column is not None:
+            self.__sortRecords()
+
+    def __insertSorted(self, record):
+        # After the records with the same key, where a stable sort would put it
+        if self.__sort_order == Qt.SortOrder.DescendingOrder:
+            row = bisect_right(self.__records, _Descending(self.__getSortKey(record)),
+                               key=lambda other: _Descending(self.__getSortKey(other)))
+        else:
+            row = bisect_right(self.__records, self.__getSortKey(record), key=self.__getSortKey)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.__records.insert(row, record)
+        self.__addIds([record])
+        self.endInsertRows()
+
+    def __addIds(self, records):
+        if self.__id_key is not None:
+            self.__ids.update(record.get(self.__id_key) for record in records)
+
+    def deleteRecords(self, rows):
+        # From the bottom in contiguous ranges so the indexes of the remaining rows don't shift
+        rows = sorted(set(rows), reverse=True)
+        while rows:
+            last = first = rows.pop(0)
+            while rows and rows[0] == first - 1:
+                first = rows.pop(0)
+            self.beginRemoveRows(QModelIndex(), first, last)
+            if self.__id_key is not None:
+                self.__ids.difference_update(record.get(self.__id_key) for record in self.__records[first:last + 1])
+            del self.__records[first:last + 1]
+            self.endRemoveRows()
+
+    def applyDiff(self, added=(), removed=(), updated=()):
+        """
+        Applies the changes of a listing in place, the other rows and the selection are kept.
+
+        :param added: Records to add.
+        :param removed: IDs of the records to remove.
+        :param updated: Records replacing the records with the same ID.
+        """
+        rows = {record.get(self.__id_key): row for row, record in enumerate(self.__records)}
+        self.deleteRecords([rows[record_id] for record_id in removed if record_id in rows])
+        if updated:
+            rows = {record.get(self.__id_key): row for row, record in enumerate(self.__records)}
+            for record in updated:
+                row = rows.get(record.get(self.__id_key))
+                if row is not None:
+                    self.__records[row] = record
+                    self.dataChanged.emit(self.index(row, 0), self.index(row, len(self.__columns) - 1))
+        self.addRecords(added)
+        if updated and self.__sort_column is not None:
+            self.__sortRecords()
+
+    def setFetcher(self, pages):
+        """
+        Sets the pages fetched when the view needs more rows.
+
+        :param pages: Iterable of lists of records, e.g. one list per API page.
+        """
+        self.__pages = iter(pages) if pages is not None else None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self.__pages is not None
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or self.__pages is None:
+            return
+        try:
+            records = next(self.__pages)
+        except StopIteration:
+            self.__pages = None
+            return
+        self.addRecords(records)
+
+    def __getSortKey(self, record):
+        return _sort_key(record.get(self.__columns[self.__sort_column]))
+
+    def __sortRecords(self):
+        self.layoutAboutToBeChanged.emit()
+        old_indexes = self.persistentIndexList()
+        old_records = [self.__records[index.row()] for index in old_indexes]
+        self.__records.sort(key=self.__getSortKey, reverse=self.__sort_order == Qt.SortOrder.DescendingOrder)
+        if old_indexes:
+            rows = {id(record): row for row, record in enumerate(self.__records)}
+            new_indexes = [self.index(rows[id(record)], index.column()) for index, record in zip(old_indexes, old_records)]
+            self.changePersistentIndexList(old_indexes, new_indexes)
+        self.layoutChanged.emit()
+
+    def sort(self, column, order=Qt.SortOrder.AscendingOrder):
+        self.__sort_column = column
+        self.__sort_order = order
+        self.__sortRecords()
+
+
+class TableWidget(QTableView):
+    selectedRecord = pyqtSignal(object)
+
+    def __init__(self, parent=None, columns=None, id_key=None):
         super(TableWidget, self).__init__(parent)
-        self.__initVal(columns)
+        self.__initVal(columns, id_key)
         self.__initUi(columns)
 
-    def __initVal(self, columns=None):
-        self.__column_map = {key: index for index, key in enumerate(columns)}
+    def __initVal(self, columns=None, id_key=None):
+        self.__model = TableModel(columns, id_key, self)
+        # Records added one at a time are inserted together a frame later, a burst costs a single insert and repaint
+        self.__pending = []
+        self.__flushTimer = QTimer(self)
+        self.__flushTimer.setSingleShot(True)
+        self.__flushTimer.setInterval(16)
+        self.__flushTimer.timeout.connect(self.flushRecords)
 
     def __initUi(self, columns):
-        self.setColumnCount(len(columns))
+        self.setModel(self.__model)
         self.horizontalHeader().setStretchLastSection(True)
         self.verticalHeader().setVisible(False)
-        self.setHorizontalHeaderLabels(columns)
         self.setEditTriggers(self.EditTrigger.NoEditTriggers)
         self.setSelectionBehavior(self.SelectionBehavior.SelectRows)
-        self.itemSelectionChanged.connect(self.__onSelectionChanged)
+        self.setSelectionMode(self.SelectionMode.ExtendedSelection)
+        self.selectionModel().selectionChanged.connect(self.__onSelectionChanged)
 
     def clearRecord(self):
-        self.setRowCount(0)
-        self.setColumnCount(len(self.__column_map))
-        self.clearContents()
+        self.__flushTimer.stop()
+        self.__pending = []
+        self.__model.setRecords([])
 
     def addRecord(self, record):
-        row_position = self.rowCount()
-        self.insertRow(row_position)
-        for key, value in record.items():
-            if key in self.__column_map:
-                column_index = self.__column_map[key]
-                # For the 'tools' column, which contains a list, convert it to a string representation
-                if key == 'tools':
-                    value = str(value)
-                self.setItem(row_position, column_index, QTableWidgetItem(str(value)))
+        self.__pending.append(record)
+        if not self.__flushTimer.isActive():
+            self.__flushTimer.start()
+
+    def flushRecords(self):
+        # Inserts the records waiting since addRecord, every other method sees them
+        self.__flushTimer.stop()
+        if self.__pending:
+            records, self.__pending = self.__pending, []
+            self.__model.addRecords(records)
+
+    def addRecords(self, records):
+        self.flushRecords()
+        self.__model.addRecords(records)
+
+    def applyDiff(self, diff):
+        self.flushRecords()
+        self.__model.applyDiff(diff.added, diff.removed, diff.updated)
+
+    def updateRecord(self, record):
+        self.flushRecords()
+        self.__model.applyDiff(updated=[record])
+
+    def setFetcher(self, pages):
+        # Show the first page right away, the next ones are fetched when scrolling to the bottom
+        self.flushRecords()
+        self.__model.setFetcher(pages)
+        self.__model.fetchMore()
 
     def getRecord(self, row):
-        record = {}
-        for key, index in self.__column_map.items():
-            if self.item(row, index) is not None:
-                record[key] = self.item(row, index).text()
-            else:
-                record[key] = ''
-        return record
+        self.flushRecords()
+        return self.__model.getRecord(row)
+
+    def rowCount(self):
+        self.flushRecords()
+        return self.__model.rowCount()
+
+    def currentRow(self):
+        self.flushRecords()
+        return self.currentIndex().row()
+
+    def getVisibleRows(self):
+        # Rows inside the viewport, whole or in part
+        if self.rowCount() == 0:
+            return []
+        first = max(self.rowAt(0), 0)
+        last = self.rowAt(self.viewport().height() - 1)
+        return list(range(first, (last if last != -1 else self.rowCount() - 1) + 1))
 
     def __onSelectionChanged(self):
         selected_row = self.currentRow()
@@ -53,12 +287,18 @@ class TableWidget(QTableWidget):
             record = self.getRecord(selected_row)
             self.selectedRecord.emit(record)
 
+    def getSelectedRows(self):
+        self.flushRecords()
+        return sorted(index.row() for index in self.selectionModel().selectedRows())
+
+    def getSelectedRecords(self):
+        return [self.getRecord(row) for row in self.getSelectedRows()]
+
+    def deleteRecords(self, rows):
+        self.flushRecords()
+        self.__model.deleteRecords(rows)
+
     def deleteRecord(self, row):
         if isinstance(row, int):
-            self.removeRow(row)
-        # elif isinstance(row, str):
-        #     for i in range(self.rowCount()):
-        #         record = self.getRecord(i)
-        #         if record['name'] == row:
-        #             self.removeRow(i)
-        #             break
\ No newline at end of file
+            self.flushRecords()
+            self.__model.deleteRecords([row])
@@ -0,0 +1,49 @@
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Tokens added by the API around every message of a thread
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+class TokenCounter:
+    """
+    Approximate local token counter.
+    It uses tiktoken when it is installed, otherwise about four characters per token.
+    """
+
+    def __init__(self, model='gpt-4o'):
+        """
+        Initializes the TokenCounter.
+
+        :param model: Model to pick the tokenizer for.
+        """
+        self.__encoding = None
+        if tiktoken is not None:
+            try:
+                self.__encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                self.__encoding = tiktoken.get_encoding('o200k_base')
+
+    def count(self, text):
+        """
+        Counts the tokens of a text.
+
+        :param text: Text to count.
+        :return: Number of tokens.
+        """
+        if not text:
+            return 0
+        if self.__encoding is not None:
+            return len(self.__encoding.encode(text, disallowed_special=()))
+        return (len(text) + 3) // 4
+
+    def count_message(self, content):
+        """
+        Counts the tokens a message adds to the context of a thread.
+
+        :param content: Message content.
+        :return: Number of tokens.
+        """
+        return self.count(content) + MESSAGE_OVERHEAD_TOKENS